@@ -53,6 +53,10 @@ export async function initDB() {
           FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE ON UPDATE CASCADE
       )`;
 
+    // Index des lectures par utilisateur triées par date (API et exports par utilisateur)
+    await sql`CREATE INDEX IF NOT EXISTS idx_transactions_user_created_at ON transactions (user_id, created_at)`;
+    await sql`CREATE INDEX IF NOT EXISTS idx_subscriptions_user_created_at ON subscriptions (user_id, created_at)`;
+
     console.log("✅ Base de données initialisée avec succès !");
     
   } catch (error) {
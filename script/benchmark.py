@@ -0,0 +1,496 @@
+"""Mesures de performance du Finance Exporter (hors ligne, ou sur un PostgreSQL local).
+
+Exemple :
+    python benchmark.py bucketing --rows 100000 1000000 10000000
+    python benchmark.py fetch --repeat 5        # nécessite DATABASE_URL (PostgreSQL local)
+    python benchmark.py write --rows 100000 1000000
+    python benchmark.py ingest --rows 1000000   # nécessite DATABASE_URL (PostgreSQL local)
+    python benchmark.py memory --rows 1000000
+    python benchmark.py generate --rows 1000000 --snapshot donnees/1M
+    python benchmark.py generate --rows 1000000 --postgres     # schéma finance_bench de DATABASE_URL
+    python benchmark.py suite --rows 10000 100000 1000000 --save-baseline reference.json
+    python benchmark.py suite --rows 10000 100000 1000000 --baseline reference.json
+"""
+import io
+import os
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import tracemalloc
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from decimal import Decimal
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+import psycopg2
+import xlsxwriter
+from urllib.parse import urlparse
+
+from store import TransactionStore
+from synthetic import APP_CATEGORIES, BENCH_SCHEMA, SyntheticDataset
+from main import (FinanceExporter, MOIS_TRADUCTION, TRANSACTIONS_QUERY, SUBSCRIPTIONS_QUERY,
+                  INGESTION_MODES, database_url)
+
+CATEGORIES = ["Alimentation", "Transport", "Logement", "Loisirs", "Santé", "Salaire", "Shopping", "Autre"]
+
+
+def generate_transactions(n_rows, seed=42):
+    """Génère un DataFrame au format renvoyé par psycopg2 (montants Decimal, dates, UUID en texte)"""
+    rng = np.random.default_rng(seed)
+
+    # Les objets Decimal et les chaînes sont tirés dans des réservoirs pour rester rapides à générer
+    decimals = np.array([Decimal(f"{v:.2f}") for v in rng.normal(-25, 120, 10_000)], dtype=object)
+    ids = np.array([f"{i:08x}-0000-4000-8000-{i:012x}" for i in range(100_000)], dtype=object)
+    titles = np.array([f"Transaction {i}" for i in range(500)], dtype=object)
+
+    created_at = np.datetime64("2023-01-01") + rng.integers(0, 730, n_rows).astype("timedelta64[D]")
+    df = pd.DataFrame({
+        "id": ids[rng.integers(0, len(ids), n_rows)],
+        "user_id": ids[rng.integers(0, 1000, n_rows)],
+        "title": titles[rng.integers(0, len(titles), n_rows)],
+        "amount": decimals[rng.integers(0, len(decimals), n_rows)],
+        "category": np.array(CATEGORIES, dtype=object)[rng.integers(0, len(CATEGORIES), n_rows)],
+        "created_at": np.sort(created_at)[::-1],
+    })
+    return df
+
+
+def legacy_bucketing(df):
+    """Implémentation d'origine (iterrows + liste de dicts), conservée comme référence"""
+    transactions_data = defaultdict(list)
+    df['created_at'] = pd.to_datetime(df['created_at'])
+
+    for _, transaction in df.iterrows():
+        mois_nom_en = transaction['created_at'].strftime("%B").lower()
+        mois_nom_fr = MOIS_TRADUCTION.get(mois_nom_en, mois_nom_en)
+
+        transactions_data[mois_nom_fr].append({
+            'title': transaction['title'],
+            'category': transaction['category'],
+            'amount': float(transaction['amount']),
+            'date': transaction['created_at'].strftime("%Y-%m-%d"),
+            'id': str(transaction['id'])
+        })
+    return transactions_data
+
+
+def legacy_write_rows(worksheet, formats, first_row, rows):
+    """Écriture d'origine : cinq worksheet.write par ligne et couleur du montant choisie en Python"""
+    for row_idx, (title, category, amount, date, trans_id) in enumerate(rows, start=first_row):
+        worksheet.write(row_idx, 0, title, formats['normal'])
+        worksheet.write(row_idx, 1, category, formats['normal'])
+        amount_format = formats['currency_positive'] if amount >= 0 else formats['currency_negative']
+        worksheet.write(row_idx, 2, amount, amount_format)
+        worksheet.write(row_idx, 3, date, formats['date'])
+        worksheet.write(row_idx, 4, trans_id, formats['normal'])
+
+
+def _connect():
+    result = urlparse(database_url())
+    return psycopg2.connect(
+        database=result.path[1:],
+        user=result.username,
+        password=result.password,
+        host=result.hostname,
+        port=result.port
+    )
+
+
+def legacy_fetch():
+    """Récupération d'origine : une nouvelle connexion par requête, requêtes en série"""
+    for query in (TRANSACTIONS_QUERY.format(where=""), SUBSCRIPTIONS_QUERY.format(where="")):
+        conn = _connect()
+        try:
+            pd.read_sql_query(query, conn)
+        finally:
+            conn.close()
+
+
+def pooled_fetch(concurrent):
+    """Récupération via le pool de l'exporteur (ouverture du pool incluse)"""
+    with FinanceExporter(concurrent_fetch=concurrent) as exporter:
+        exporter.fetch_data()
+
+
+def _timed(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def bench_bucketing(args):
+    """Compare la répartition mensuelle iterrows et la version vectorisée"""
+    print(f"{'Lignes':>12} | {'iterrows (s)':>14} | {'vectorisé (s)':>14} | {'accélération':>12}")
+    print("-" * 62)
+
+    for n_rows in args.rows:
+        df = generate_transactions(n_rows)
+
+        vectorized = _timed(FinanceExporter()._bucket_transactions, df.copy())
+
+        # Au-delà de --legacy-max-rows, la référence est mesurée sur un échantillon puis extrapolée
+        legacy_rows = min(n_rows, args.legacy_max_rows)
+        legacy = _timed(legacy_bucketing, df.head(legacy_rows).copy()) * n_rows / legacy_rows
+        suffix = "*" if legacy_rows < n_rows else " "
+
+        print(f"{n_rows:>12,} | {legacy:>13.2f}{suffix} | {vectorized:>14.3f} | {legacy / vectorized:>11.0f}x")
+        del df
+
+    print(f"\n* extrapolé linéairement depuis {args.legacy_max_rows:,} lignes")
+
+
+def bench_fetch(args):
+    """Mesure le temps mural de récupération des transactions et abonnements sur PostgreSQL"""
+    modes = [
+        ("connexion par requête, en série", legacy_fetch, ()),
+        ("pool, en série", pooled_fetch, (False,)),
+        ("pool, en parallèle", pooled_fetch, (True,)),
+    ]
+
+    print(f"{'Mode':<34} | {'médiane (s)':>12} | {'min (s)':>9}")
+    print("-" * 62)
+    for label, func, func_args in modes:
+        durations = []
+        for _ in range(args.repeat):
+            # Les messages de l'exporteur fausseraient la mesure sur un terminal lent
+            with redirect_stdout(io.StringIO()):
+                durations.append(_timed(func, *func_args))
+        print(f"{label:<34} | {statistics.median(durations):>12.3f} | {min(durations):>9.3f}")
+
+
+def bench_write(args):
+    """Mesure le débit d'écriture des lignes de transactions dans un onglet (lignes par seconde)"""
+    print(f"{'Lignes':>12} | {'mode':<15} | {'write (l/s)':>12} | {'typé (l/s)':>12} | {'gain':>6}")
+    print("-" * 70)
+
+    for n_rows in args.rows:
+        transactions = FinanceExporter()._bucket_transactions(generate_transactions(n_rows))
+        transactions = TransactionStore.concat(list(transactions.values()))
+        # L'implémentation d'origine recevait des dates déjà formatées en texte
+        legacy_rows = list(zip(
+            np.asarray(transactions.titles).tolist(),
+            np.asarray(transactions.categories).tolist(),
+            transactions.amounts_euros().tolist(),
+            np.datetime_as_string(transactions.dates).tolist(),
+            transactions.id_strings().tolist(),
+        ))
+
+        for constant_memory in (False, True):
+            rates = []
+            for writer in ("legacy", "typed"):
+                with tempfile.TemporaryDirectory() as tmpdir:
+                    exporter = FinanceExporter(verbose=False)
+                    exporter.workbook = xlsxwriter.Workbook(os.path.join(tmpdir, "bench.xlsx"),
+                                                            {'constant_memory': constant_memory})
+                    exporter.initialize_formats()
+                    worksheet = exporter.workbook.add_worksheet()
+
+                    # close() est inclus : hors constant_memory, le XML n'est produit qu'à la fermeture
+                    start = time.perf_counter()
+                    if writer == "legacy":
+                        legacy_write_rows(worksheet, exporter.formats, 3, legacy_rows)
+                    else:
+                        exporter._write_transaction_rows(worksheet, 3, transactions)
+                        exporter._format_amount_column(worksheet, 3, 2 + n_rows)
+                    exporter.workbook.close()
+                    rates.append(n_rows / (time.perf_counter() - start))
+
+            mode = "constant_memory" if constant_memory else "en mémoire"
+            print(f"{n_rows:>12,} | {mode:<15} | {rates[0]:>12,.0f} | {rates[1]:>12,.0f} | {rates[1] / rates[0]:>5.1f}x")
+        del transactions, legacy_rows
+
+
+def bench_ingest(args):
+    """Compare read_sql_query et COPY ... TO STDOUT sur une table temporaire générée par PostgreSQL"""
+    conn = _connect()
+    try:
+        with conn.cursor() as cursor:
+            # Même schéma que transactions (backend/src/config/db.js), généré côté serveur
+            cursor.execute("""
+                CREATE TEMP TABLE bench_transactions AS
+                SELECT md5('t' || i)::uuid AS id,
+                       md5('u' || (i % 1000))::uuid AS user_id,
+                       'Transaction ' || (i % 500) AS title,
+                       round((random() * 240 - 145)::numeric, 2)::decimal(10, 2) AS amount,
+                       (ARRAY['Alimentation', 'Transport', 'Logement', 'Loisirs',
+                              'Santé', 'Salaire', 'Shopping', 'Autre'])[1 + i % 8] AS category,
+                       DATE '2023-01-01' + (i % 730) AS created_at
+                FROM generate_series(1, %s) AS i
+            """, (args.rows,))
+        query = TRANSACTIONS_QUERY.format(where="").replace("FROM transactions", "FROM bench_transactions")
+
+        print(f"{args.rows:,} lignes, médiane de {args.repeat} mesures")
+        print(f"{'Ingestion':<10} | {'lecture (s)':>12} | {'+ répartition (s)':>18} | {'lignes/s':>12}")
+        print("-" * 62)
+        for mode in INGESTION_MODES:
+            exporter = FinanceExporter(ingestion=mode, verbose=False)
+            reads, totals = [], []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                df = exporter._read_query(conn, query, None, "transactions")
+                reads.append(time.perf_counter() - start)
+                exporter._bucket_transactions(df)
+                totals.append(time.perf_counter() - start)
+                del df
+            read = statistics.median(reads)
+            print(f"{mode:<10} | {read:>12.2f} | {statistics.median(totals):>18.2f} | {args.rows / read:>12,.0f}")
+    finally:
+        conn.close()
+
+
+def _fresh_strings(values):
+    """Une chaîne distincte par ligne, comme celles que crée psycopg2 (aucun partage d'objets)"""
+    return [value.encode().decode() for value in values]
+
+
+def bench_memory(args):
+    """Compare la mémoire des transactions gardées pour les onglets mensuels, ramenée à un million de lignes"""
+    print(f"{'Lignes':>12} | {'dicts (Mo/M)':>13} | {'DataFrame (Mo/M)':>17} | {'compact (Mo/M)':>15}")
+    print("-" * 68)
+
+    for n_rows in args.rows:
+        df = generate_transactions(n_rows)
+        df['id'] = [f"{i:08x}-0000-4000-8000-{i:012x}" for i in range(n_rows)]
+        par_million = 1_000_000 / n_rows / 2**20
+
+        # Format d'origine : un dict par ligne (mesuré par tracemalloc, chaînes distinctes)
+        echantillon = df.head(min(n_rows, args.legacy_max_rows))
+        tracemalloc.start()
+        lignes = [
+            {'title': title, 'category': category, 'amount': float(amount), 'date': str(created_at), 'id': str(trans_id)}
+            for title, category, amount, created_at, trans_id in zip(
+                _fresh_strings(echantillon['title']), _fresh_strings(echantillon['category']),
+                echantillon['amount'], echantillon['created_at'].dt.strftime("%Y-%m-%d"), _fresh_strings(echantillon['id']))
+        ]
+        dicts = tracemalloc.get_traced_memory()[0] * n_rows / len(echantillon)
+        tracemalloc.stop()
+        del lignes
+
+        # Format précédent : un DataFrame de textes, float64 et datetime64 par mois
+        frame = pd.DataFrame({
+            'title': _fresh_strings(df['title']),
+            'category': _fresh_strings(df['category']),
+            'amount': df['amount'].to_numpy(dtype='float64'),
+            'date': df['created_at'].to_numpy(dtype='datetime64[D]'),
+            'id': df['id'].array,
+        })
+        dataframe = frame.memory_usage(deep=True).sum()
+        del frame
+
+        compact = TransactionStore.from_frame(df).nbytes
+        print(f"{n_rows:>12,} | {dicts * par_million:>13.0f} | {dataframe * par_million:>17.0f} | "
+              f"{compact * par_million:>15.1f}")
+        del df
+
+
+# Variantes de l'exporteur mesurées par la suite ; les deux dernières ne concernent que PostgreSQL
+SUITE_MODES = {
+    "memoire": {},
+    "flux": {"streaming": True},
+    "copy": {"ingestion": "copy"},
+    "parallele": {"parallel_fetch": 4},
+}
+POSTGRES_ONLY_MODES = {"copy", "parallele"}
+
+
+def _dataset(args, rows):
+    return SyntheticDataset(rows, users=args.users, categories=args.categories, days=args.days,
+                            subscriptions_per_user=args.subscriptions_per_user, seed=args.seed)
+
+
+def bench_generate(args):
+    """Génère un jeu synthétique dans un snapshot Parquet ou dans le schéma de mesure PostgreSQL"""
+    dataset = _dataset(args, args.rows[0])
+    start = time.perf_counter()
+    if args.snapshot:
+        dataset.write_snapshot(args.snapshot)
+        target = args.snapshot
+    else:
+        conn = _connect()
+        try:
+            dataset.load_postgres(conn, args.schema)
+        finally:
+            conn.close()
+        target = f"schéma {args.schema}"
+    print(f"✅ {dataset.rows:,} transactions, {dataset.users_count:,} utilisateurs, {len(dataset.categories)} catégories "
+          f"sur {dataset.days} jours → {target} en {time.perf_counter() - start:.1f} s")
+
+
+def _run_report(source, options, schema):
+    """Exécute generate_report dans un processus neuf, pour que le pic de RSS soit celui du seul export"""
+    if schema:
+        # Lu par libpq à l'ouverture des connexions : les requêtes de l'exporteur visent le schéma de mesure
+        os.environ["PGOPTIONS"] = f"-c search_path={schema},public"
+    with tempfile.TemporaryDirectory() as tmpdir:
+        with FinanceExporter(from_snapshot=source, verbose=False, **options) as exporter:
+            result = exporter.generate_report(os.path.join(tmpdir, "rapport.xlsx"))
+    return result['metrics']
+
+
+def bench_suite(args):
+    """Mesure generate_report de bout en bout, étape par étape, à plusieurs tailles de jeu synthétique"""
+    results = {}
+    # Un processus par export (spawn : rien n'est hérité de la génération du jeu)
+    context = multiprocessing.get_context("spawn")
+
+    print(f"{'Lignes':>12} | {'mode':<10} | {'total (s)':>10} | {'lignes/s':>12} | {'pic RSS (Mo)':>13}")
+    print("-" * 70)
+    for n_rows in args.rows:
+        dataset = _dataset(args, n_rows)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            if args.source == "snapshot":
+                source, schema = dataset.write_snapshot(os.path.join(tmpdir, "snapshot")), None
+            else:
+                conn = _connect()
+                try:
+                    dataset.load_postgres(conn, args.schema)
+                finally:
+                    conn.close()
+                source, schema = None, args.schema
+
+            for mode in args.modes:
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                    metrics = executor.submit(_run_report, source, SUITE_MODES[mode], schema).result()
+                results[f"{n_rows}/{mode}"] = _suite_result(n_rows, mode, metrics)
+                _print_suite_result(results[f"{n_rows}/{mode}"])
+
+    report = {
+        'created_at': metrics['started_at'],
+        'source': args.source,
+        'dataset': {key: value for key, value in dataset.params.items() if key != 'rows'},
+        'results': results,
+    }
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n💾 Référence enregistrée: {args.save_baseline}")
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline['dataset'] != report['dataset'] or baseline['source'] != report['source']:
+            print("\n⚠️  La référence a été mesurée sur un autre jeu de données ou une autre source")
+        regressions = compare_to_baseline(results, baseline['results'], args.tolerance)
+        if regressions:
+            raise SystemExit(f"\n❌ {regressions} régression(s) au-delà de {args.tolerance:.0%}")
+
+
+def _suite_result(n_rows, mode, metrics):
+    """Débit et mémoire d'un export à partir de ses mesures d'étapes"""
+    total = metrics['stages']['total']
+    return {
+        'rows': n_rows,
+        'mode': mode,
+        'seconds': round(total['seconds'], 4),
+        'rows_per_second': round(n_rows / total['seconds']),
+        'peak_rss_bytes': metrics['peak_rss_bytes'],
+        'bytes_written': metrics['counts'].get('bytes_written'),
+        # Étapes de premier niveau seulement : les étapes imbriquées sont comptées dans leur parente
+        'stages': {name: round(entry['seconds'], 4) for name, entry in metrics['stages'].items()
+                   if 'peak_rss_bytes' in entry and name != 'total'},
+    }
+
+
+def _print_suite_result(result):
+    print(f"{result['rows']:>12,} | {result['mode']:<10} | {result['seconds']:>10.2f} | "
+          f"{result['rows_per_second']:>12,} | {result['peak_rss_bytes'] / 2**20:>13.0f}")
+    print(" " * 15 + ", ".join(f"{name} {seconds:.2f}s" for name, seconds in result['stages'].items()))
+
+
+def compare_to_baseline(results, baseline, tolerance):
+    """Compare durée et pic de RSS à la référence ; renvoie le nombre de régressions"""
+    print(f"\n{'Lignes':>12} | {'mode':<10} | {'durée':>9} | {'pic RSS':>9} | étapes (écart de durée)")
+    print("-" * 90)
+    regressions = 0
+    for key, result in results.items():
+        reference = baseline.get(key)
+        if reference is None:
+            print(f"{result['rows']:>12,} | {result['mode']:<10} | absent de la référence")
+            continue
+
+        duration = result['seconds'] / reference['seconds'] - 1
+        memory = result['peak_rss_bytes'] / reference['peak_rss_bytes'] - 1
+        stages = ", ".join(f"{name} {seconds / reference['stages'][name] - 1:+.0%}"
+                           for name, seconds in result['stages'].items() if reference['stages'].get(name))
+        flag = ""
+        if duration > tolerance or memory > tolerance:
+            regressions += 1
+            flag = " ❌"
+        print(f"{result['rows']:>12,} | {result['mode']:<10} | {duration:>+9.1%} | {memory:>+9.1%} | {stages}{flag}")
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks du Finance Exporter")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    bucketing = subparsers.add_parser("bucketing", help="répartition des transactions par mois")
+    bucketing.add_argument("--rows", type=int, nargs="+", default=[100_000, 1_000_000, 10_000_000])
+    bucketing.add_argument("--legacy-max-rows", type=int, default=1_000_000,
+                           help="taille maximale mesurée pour l'implémentation iterrows")
+    bucketing.set_defaults(func=bench_bucketing)
+
+    fetch = subparsers.add_parser("fetch", help="récupération PostgreSQL : pool et requêtes parallèles")
+    fetch.add_argument("--repeat", type=int, default=5)
+    fetch.set_defaults(func=bench_fetch)
+
+    write = subparsers.add_parser("write", help="écriture des lignes de transactions dans un onglet")
+    write.add_argument("--rows", type=int, nargs="+", default=[100_000, 1_000_000])
+    write.set_defaults(func=bench_write)
+
+    memory = subparsers.add_parser("memory", help="mémoire des transactions : dicts, DataFrame, stockage compact")
+    memory.add_argument("--rows", type=int, nargs="+", default=[1_000_000])
+    memory.add_argument("--legacy-max-rows", type=int, default=200_000,
+                        help="taille maximale mesurée pour les dicts (extrapolée au-delà)")
+    memory.set_defaults(func=bench_memory)
+
+    ingest = subparsers.add_parser("ingest", help="ingestion PostgreSQL : read_sql_query contre COPY")
+    ingest.add_argument("--rows", type=int, default=1_000_000)
+    ingest.add_argument("--repeat", type=int, default=3)
+    ingest.set_defaults(func=bench_ingest)
+
+    # Paramètres communs du jeu synthétique
+    dataset = argparse.ArgumentParser(add_help=False)
+    dataset.add_argument("--users", type=int, default=1000, help="nombre d'utilisateurs (défaut: 1000)")
+    dataset.add_argument("--categories", type=int, default=len(APP_CATEGORIES),
+                         help=f"nombre de catégories distinctes (défaut: {len(APP_CATEGORIES)}, celles de l'application)")
+    dataset.add_argument("--days", type=int, default=730, help="étendue des dates en jours (défaut: 730)")
+    dataset.add_argument("--subscriptions-per-user", type=int, default=3)
+    dataset.add_argument("--seed", type=int, default=42)
+    dataset.add_argument("--schema", default=BENCH_SCHEMA,
+                         help=f"schéma PostgreSQL des données synthétiques (défaut: {BENCH_SCHEMA})")
+
+    generate = subparsers.add_parser("generate", parents=[dataset],
+                                     help="jeu synthétique au schéma de l'application (PostgreSQL ou snapshot)")
+    generate.add_argument("--rows", type=int, nargs=1, default=[1_000_000])
+    target = generate.add_mutually_exclusive_group(required=True)
+    target.add_argument("--snapshot", metavar="DOSSIER", help="écrit un snapshot Parquet relisible par --from-snapshot")
+    target.add_argument("--postgres", action="store_true",
+                        help="charge DATABASE_URL (tables du schéma --schema vidées au préalable)")
+    generate.set_defaults(func=bench_generate)
+
+    suite = subparsers.add_parser("suite", parents=[dataset],
+                                  help="generate_report de bout en bout et par étape, à plusieurs tailles")
+    suite.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    suite.add_argument("--modes", nargs="+", choices=SUITE_MODES, default=["memoire", "flux"])
+    suite.add_argument("--source", choices=("snapshot", "postgres"), default="snapshot",
+                       help="lecture depuis un snapshot (sans base) ou depuis PostgreSQL (schéma --schema)")
+    suite.add_argument("--save-baseline", metavar="FICHIER", help="enregistre les mesures comme référence")
+    suite.add_argument("--baseline", metavar="FICHIER", help="compare les mesures à une référence enregistrée")
+    suite.add_argument("--tolerance", type=float, default=0.10,
+                       help="écart relatif toléré sur la durée et le pic de RSS (défaut: 0.10)")
+    suite.set_defaults(func=bench_suite)
+
+    args = parser.parse_args(argv)
+    if args.command == "suite" and args.source == "snapshot" and POSTGRES_ONLY_MODES & set(args.modes):
+        parser.error("les modes copy et parallele ne concernent que --source postgres")
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    args.func(args)
@@ -0,0 +1,145 @@
+"""Cache local (SQLite) des agrégats mensuels pour les exports incrémentaux.
+
+Les agrégats sont rangés par périmètre d'export (utilisateur, période) ; chaque
+mois (année, mois) d'un périmètre conserve ses totaux par catégorie, ses revenus, ses
+dépenses et son nombre de lignes, ainsi que l'empreinte PostgreSQL (nombre de
+lignes, somme des montants, hachage md5 des lignes) qui a servi à les calculer. Un mois dont l'empreinte
+n'a pas changé est relu depuis le cache au lieu d'être recalculé.
+"""
+import sqlite3
+from datetime import datetime
+from collections import defaultdict
+
+# Le cache est jetable : un changement de schéma le réinitialise simplement
+SCHEMA_VERSION = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS monthly_aggregates (
+    scope TEXT NOT NULL,
+    annee INTEGER NOT NULL,
+    mois INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    somme TEXT NOT NULL,
+    signature TEXT NOT NULL,
+    depenses REAL NOT NULL,
+    revenus REAL NOT NULL,
+    nb_depenses INTEGER NOT NULL,
+    nb_revenus INTEGER NOT NULL,
+    PRIMARY KEY (scope, annee, mois)
+);
+
+CREATE TABLE IF NOT EXISTS category_totals (
+    scope TEXT NOT NULL,
+    annee INTEGER NOT NULL,
+    mois INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    category TEXT NOT NULL,
+    total REAL NOT NULL,
+    PRIMARY KEY (scope, annee, mois, category)
+);
+
+CREATE TABLE IF NOT EXISTS watermark (
+    scope TEXT PRIMARY KEY,
+    created_at TEXT NOT NULL,
+    transaction_id TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+"""
+
+
+class AggregateCache:
+    def __init__(self, path, scope="*"):
+        self.path = path
+        self.scope = scope
+        self.conn = sqlite3.connect(path)
+        self._ensure_schema()
+
+    def _ensure_schema(self):
+        """Crée les tables, ou les recrée si le cache date d'une autre version du schéma"""
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        if version != SCHEMA_VERSION:
+            self.conn.executescript("""
+                DROP TABLE IF EXISTS monthly_aggregates;
+                DROP TABLE IF EXISTS category_totals;
+                DROP TABLE IF EXISTS watermark;
+            """)
+            self.conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self.conn.executescript(SCHEMA)
+
+    def load_fingerprints(self):
+        """Retourne l'empreinte (nombre de lignes, somme, hachage) de chaque mois en cache"""
+        rows = self.conn.execute("SELECT annee, mois, count, somme, signature FROM monthly_aggregates WHERE scope = ?",
+                                 (self.scope,))
+        return {(annee, mois): (count, somme, signature) for annee, mois, count, somme, signature in rows}
+
+    def load_watermark(self):
+        """Retourne le high-water mark (created_at, id) du dernier export, ou None"""
+        row = self.conn.execute("SELECT created_at, transaction_id FROM watermark WHERE scope = ?",
+                                (self.scope,)).fetchone()
+        return tuple(row) if row else None
+
+    def load_stats(self, periods):
+        """Relit les agrégats des mois demandés, au format de FinanceExporter.monthly_stats"""
+        stats_by_period = {}
+        for annee, mois in periods:
+            row = self.conn.execute("""
+                SELECT count, depenses, revenus, nb_depenses, nb_revenus
+                FROM monthly_aggregates WHERE scope = ? AND annee = ? AND mois = ?
+            """, (self.scope, annee, mois)).fetchone()
+            if row is None:
+                continue
+
+            categories = defaultdict(float)
+            for category, total in self.conn.execute("""
+                SELECT category, total FROM category_totals
+                WHERE scope = ? AND annee = ? AND mois = ? ORDER BY position
+            """, (self.scope, annee, mois)):
+                categories[category] = total
+
+            count, depenses, revenus, nb_depenses, nb_revenus = row
+            stats_by_period[(annee, mois)] = {
+                'count': count,
+                'categories': categories,
+                'depenses': depenses,
+                'revenus': revenus,
+                'nb_depenses': nb_depenses,
+                'nb_revenus': nb_revenus,
+            }
+        return stats_by_period
+
+    def save(self, stats_by_period, fingerprints, watermark):
+        """Enregistre les mois recalculés, purge les mois disparus et avance le high-water mark"""
+        with self.conn:
+            for (annee, mois), stats in stats_by_period.items():
+                count, somme, signature = fingerprints[(annee, mois)]
+                self.conn.execute("""
+                    INSERT OR REPLACE INTO monthly_aggregates
+                        (scope, annee, mois, count, somme, signature, depenses, revenus, nb_depenses, nb_revenus)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """, (self.scope, annee, mois, count, somme, signature, stats['depenses'], stats['revenus'],
+                      stats['nb_depenses'], stats['nb_revenus']))
+
+                self._delete_period(annee, mois, tables=("category_totals",))
+                self.conn.executemany("""
+                    INSERT INTO category_totals (scope, annee, mois, position, category, total)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                """, [(self.scope, annee, mois, position, category, total)
+                      for position, (category, total) in enumerate(stats['categories'].items())])
+
+            # Les mois qui n'existent plus dans PostgreSQL (suppressions) sortent du cache
+            for annee, mois in set(self.load_fingerprints()) - set(fingerprints):
+                self._delete_period(annee, mois)
+
+            if watermark:
+                self.conn.execute("""
+                    INSERT OR REPLACE INTO watermark (scope, created_at, transaction_id, updated_at)
+                    VALUES (?, ?, ?, ?)
+                """, (self.scope, *watermark, datetime.now().isoformat(timespec="seconds")))
+
+    def _delete_period(self, annee, mois, tables=("monthly_aggregates", "category_totals")):
+        for table in tables:
+            self.conn.execute(f"DELETE FROM {table} WHERE scope = ? AND annee = ? AND mois = ?",
+                              (self.scope, annee, mois))
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,178 @@
+"""Contrôles des transactions : doublons (même jour ou jours proches) et montants atypiques.
+
+Doublons : deux lignes de même utilisateur, titre et montant, créées le même jour ou à au plus
+`tolerance` jours d'intervalle. `transactions.created_at` est une DATE : les lignes lues en base
+comme celles d'un snapshot n'ont pas d'heure, le jour est donc la plus fine unité comparable.
+Chaque ligne est réduite à une empreinte de 64 bits ; un tri sur (empreinte, jour) rend voisines
+les lignes candidates, que l'on compare à leur prédécesseur : O(n log n), sans comparaison deux
+à deux. Les blocs arrivant par date décroissante, seules les lignes à moins de `tolerance`
+jours du plus ancien jour vu sont gardées d'un bloc à l'autre.
+
+Montants atypiques : pour chaque catégorie, les plus gros montants (valeur absolue) sont
+gardés comme candidats, avec le nombre, la somme et la somme des carrés des montants. Au
+rendu, un candidat au-delà de Q3 + 3 × IQR de sa catégorie (quartiles des sketches KLL) est
+signalé, avec son z-score.
+
+Les contrôles sont tenus par mois et fusionnables, comme les sketches : deux lignes de part
+et d'autre d'un changement de mois ne sont pas comparées.
+"""
+import numpy as np
+import pandas as pd
+
+# Candidats gardés par catégorie et lignes listées dans l'onglet
+OUTLIER_CANDIDATES = 100
+MAX_LISTED = 10_000
+IQR_FACTOR = 3.0
+# En deçà, les quartiles d'une catégorie ne disent rien de son niveau habituel
+MIN_CATEGORY_COUNT = 20
+
+DETAIL_COLUMNS = ["day", "title", "category", "amount", "id"]
+
+
+def prepare(df):
+    """Colonnes des contrôles d'un bloc de lignes brutes, par mois : {(année, mois): DataFrame}"""
+    created = pd.to_datetime(df['created_at'])
+    # Jours depuis 1970 : une heure éventuelle est ignorée, comme pour les lignes sans heure
+    days = created.to_numpy(dtype='datetime64[D]').astype(np.int64)
+    cents = np.rint(df['amount'].to_numpy(dtype='float64') * 100).astype(np.int64)
+    lignes = pd.DataFrame({
+        'day': days,
+        'title': df['title'].to_numpy(dtype=object),
+        'category': df['category'].to_numpy(dtype=object),
+        'amount': cents,
+        'id': df['id'].astype(str).to_numpy(),
+    })
+    # Empreinte (utilisateur, titre, montant) : les collisions sur 64 bits sont négligeables
+    lignes['key'] = pd.util.hash_pandas_object(
+        pd.DataFrame({'user_id': df['user_id'].astype(str).to_numpy(), 'title': lignes['title'], 'amount': cents}),
+        index=False).to_numpy()
+
+    mois = created.to_numpy(dtype='datetime64[M]').astype(np.int64)
+    return {(1970 + int(m) // 12, int(m) % 12 + 1): bloc
+            for m, bloc in lignes.groupby(mois, sort=False)}
+
+
+class TransactionControls:
+    """Doublons et candidats aux montants atypiques d'un ensemble de transactions"""
+
+    def __init__(self, tolerance):
+        # Écart maximal en jours (0 : le même jour seulement)
+        self.tolerance = tolerance
+        self.carry = None
+        self.oldest = None
+        self.duplicates = []
+        self.same_day = 0
+        self.near = 0
+        self.stats = {}
+        self.candidates = None
+
+    def update(self, lignes):
+        """Examine un bloc de lignes d'un mois (colonnes de `prepare`)"""
+        self._find_duplicates(lignes)
+        self._collect_candidates(lignes)
+
+    def _find_duplicates(self, lignes):
+        nouvelles = lignes.assign(new=True)
+        combined = nouvelles if self.carry is None else pd.concat([self.carry, nouvelles], ignore_index=True)
+        keys = combined['key'].to_numpy()
+        days = combined['day'].to_numpy()
+        new = combined['new'].to_numpy()
+        # Les nouvelles lignes ne sont pas plus récentes que les lignes gardées : à jour égal, placées
+        # avant elles, elles ne s'insèrent jamais entre deux lignes déjà appariées
+        ordre = np.lexsort((~new, days, keys))
+        keys, days, new = keys[ordre], days[ordre], new[ordre]
+
+        # Une ligne est le doublon de sa voisine précédente (même empreinte, assez proche dans le temps)
+        ecarts = np.diff(days)
+        doublons = np.flatnonzero((keys[1:] == keys[:-1]) & (ecarts <= self.tolerance)) + 1
+        # Paires entre lignes déjà vues : signalées au bloc précédent
+        doublons = doublons[new[doublons] | new[doublons - 1]]
+        if len(doublons):
+            meme_jour = ecarts[doublons - 1] == 0
+            self.same_day += int(meme_jour.sum())
+            self.near += int((~meme_jour).sum())
+            if sum(len(found) for found in self.duplicates) < MAX_LISTED:
+                details = combined.iloc[ordre[doublons]][DETAIL_COLUMNS].reset_index(drop=True)
+                details['original'] = combined['id'].to_numpy()[ordre[doublons - 1]]
+                details['gap'] = ecarts[doublons - 1]
+                self.duplicates.append(details)
+
+        # Les blocs suivants sont plus anciens : seules les lignes proches du plus ancien jour peuvent s'y apparier
+        oldest = int(lignes['day'].min())
+        self.oldest = oldest if self.oldest is None else min(self.oldest, oldest)
+        self.carry = combined.loc[combined['day'] <= self.oldest + self.tolerance].assign(new=False)
+
+    def _collect_candidates(self, lignes):
+        montants = np.abs(lignes['amount'].to_numpy()).astype(np.float64)
+        sommes = pd.DataFrame({'category': lignes['category'], 'n': 1, 's': montants, 'ss': montants ** 2}
+                              ).groupby('category', sort=False, dropna=False).sum()
+        for categorie, (n, s, ss) in zip(sommes.index, sommes.to_numpy().tolist()):
+            self._add_stats(categorie, n, s, ss)
+        self._keep_candidates(lignes[DETAIL_COLUMNS])
+
+    def _add_stats(self, categorie, n, s, ss):
+        ancien = self.stats.get(categorie, (0, 0.0, 0.0))
+        self.stats[categorie] = (ancien[0] + n, ancien[1] + s, ancien[2] + ss)
+
+    def _keep_candidates(self, lignes):
+        """Garde les OUTLIER_CANDIDATES plus gros montants de chaque catégorie"""
+        if self.candidates is not None:
+            lignes = pd.concat([self.candidates, lignes], ignore_index=True)
+        ordre = np.lexsort((-np.abs(lignes['amount'].to_numpy()), pd.factorize(lignes['category'])[0]))
+        lignes = lignes.iloc[ordre]
+        self.candidates = lignes[lignes.groupby('category', sort=False, dropna=False).cumcount().to_numpy() < OUTLIER_CANDIDATES]
+
+    def merge(self, other):
+        """Ajoute les contrôles d'un autre mois (celui-ci est modifié, l'autre non)"""
+        self.same_day += other.same_day
+        self.near += other.near
+        self.duplicates.extend(other.duplicates)
+        for categorie, (n, s, ss) in other.stats.items():
+            self._add_stats(categorie, n, s, ss)
+        if other.candidates is not None:
+            self._keep_candidates(other.candidates)
+        return self
+
+    @classmethod
+    def merged(cls, controls):
+        """Contrôles de l'union de plusieurs mois"""
+        result = cls(None)
+        for control in controls:
+            result.tolerance = control.tolerance
+            result.merge(control)
+        return result
+
+    def duplicate_rows(self):
+        """Doublons détectés, les plus récents d'abord (au plus MAX_LISTED lignes)"""
+        if not self.duplicates:
+            return pd.DataFrame(columns=DETAIL_COLUMNS + ['original', 'gap'])
+        return pd.concat(self.duplicates, ignore_index=True).sort_values(['day', 'id'], ascending=False).head(MAX_LISTED)
+
+    def outliers(self, sketches):
+        """Montants atypiques : candidats au-delà de Q3 + IQR_FACTOR × IQR de leur catégorie, z-score décroissant
+
+        `sketches` associe à chaque catégorie le sketch KLL de ses montants absolus (centimes).
+        """
+        if self.candidates is None:
+            return pd.DataFrame(columns=DETAIL_COLUMNS + ['fence', 'median', 'zscore'])
+        seuils = {}
+        for categorie, (n, s, ss) in self.stats.items():
+            sketch = sketches.get(categorie)
+            if n < MIN_CATEGORY_COUNT or sketch is None:
+                continue
+            q1, mediane, q3 = sketch.quantiles([0.25, 0.5, 0.75])
+            moyenne = s / n
+            ecart_type = np.sqrt(max(ss / n - moyenne ** 2, 0.0))
+            seuils[categorie] = (q3 + IQR_FACTOR * (q3 - q1), mediane, moyenne, ecart_type)
+
+        candidats = self.candidates[self.candidates['category'].isin(seuils)]
+        if candidats.empty:
+            return pd.DataFrame(columns=DETAIL_COLUMNS + ['fence', 'median', 'zscore'])
+        fence, median, moyenne, ecart_type = (candidats['category'].map(lambda c, i=i: seuils[c][i]).to_numpy(dtype=np.float64)
+                                              for i in range(4))
+        montants = np.abs(candidats['amount'].to_numpy()).astype(np.float64)
+        atypiques = candidats.assign(fence=fence, median=median,
+                                     zscore=np.divide(montants - moyenne, ecart_type,
+                                                      out=np.zeros_like(montants), where=ecart_type > 0))
+        atypiques = atypiques[montants > fence]
+        return atypiques.sort_values('zscore', ascending=False).head(MAX_LISTED)
@@ -0,0 +1,263 @@
+"""Démon d'export : données chargées une fois, tenues à jour par LISTEN/NOTIFY, classeurs rendus sur demande.
+
+Des triggers sur `transactions` et `subscriptions` notifient le canal `finance_exporter` à
+chaque écriture : une notification par (utilisateur, mois) touché par l'instruction, même pour
+un COPY de plusieurs millions de lignes. Le démon ne relit que ces mois (ou les abonnements)
+et garde le reste en mémoire. Une notification sur `finance_exporter_report`, dont la charge
+utile est le nom du fichier, produit un classeur à partir de cet état, sans autre lecture.
+
+    NOTIFY finance_exporter_report, 'rapport.xlsx';
+"""
+import os
+import json
+import time
+import select
+import signal
+import threading
+from datetime import date, datetime
+
+import psycopg2
+
+from main import connection_params
+from metrics import RunMetrics
+
+CHANGES_CHANNEL = "finance_exporter"
+REPORTS_CHANNEL = "finance_exporter_report"
+
+# Écritures regroupées avant relecture : une rafale d'insertions ne relit chaque mois qu'une fois
+DEBOUNCE_SECONDS = 0.5
+MAX_BATCH_SECONDS = 5.0
+# Réveil périodique sans notification (arrêt demandé, changement de mois de la projection)
+IDLE_SECONDS = 5.0
+RECONNECT_SECONDS = 5.0
+
+# Triggers par instruction : les tables de transition donnent les (utilisateur, mois) touchés
+TRIGGERS_DDL = """
+CREATE OR REPLACE FUNCTION finance_exporter_notify() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        PERFORM pg_notify('{channel}', json_build_object('table', TG_TABLE_NAME)::text);
+        RETURN NULL;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM pg_notify('{channel}', json_build_object('table', TG_TABLE_NAME, 'user_id', user_id, 'month', mois)::text)
+        FROM (SELECT DISTINCT user_id, to_char(created_at, 'YYYY-MM') AS mois FROM old_rows) AS touches;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM pg_notify('{channel}', json_build_object('table', TG_TABLE_NAME, 'user_id', user_id, 'month', mois)::text)
+        FROM (SELECT DISTINCT user_id, to_char(created_at, 'YYYY-MM') AS mois FROM new_rows) AS touches;
+    END IF;
+    RETURN NULL;
+END;
+$$;
+"""
+
+TABLE_TRIGGERS_DDL = """
+DROP TRIGGER IF EXISTS finance_exporter_insert ON {table};
+DROP TRIGGER IF EXISTS finance_exporter_update ON {table};
+DROP TRIGGER IF EXISTS finance_exporter_delete ON {table};
+DROP TRIGGER IF EXISTS finance_exporter_truncate ON {table};
+CREATE TRIGGER finance_exporter_insert AFTER INSERT ON {table}
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION finance_exporter_notify();
+CREATE TRIGGER finance_exporter_update AFTER UPDATE ON {table}
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION finance_exporter_notify();
+CREATE TRIGGER finance_exporter_delete AFTER DELETE ON {table}
+    REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION finance_exporter_notify();
+CREATE TRIGGER finance_exporter_truncate AFTER TRUNCATE ON {table}
+    FOR EACH STATEMENT EXECUTE FUNCTION finance_exporter_notify();
+"""
+
+NOTIFY_TABLES = ("transactions", "subscriptions")
+
+
+class ExportDaemon:
+    def __init__(self, exporter, output_dir, debounce=DEBOUNCE_SECONDS):
+        # L'état chaud est l'ensemble des lignes et agrégats en mémoire de l'exporteur
+        if exporter.streaming or exporter.cache or exporter.snapshot or exporter.source:
+            raise ValueError("❌ Le mode démon ne se combine ni avec le mode flux, ni avec le cache, ni avec les snapshots")
+        if exporter.budget is not None:
+            raise ValueError("❌ Le mode démon ne se combine pas avec --max-memory")
+        if exporter.monthly_sheets_max_rows is not None:
+            raise ValueError("❌ Le mode démon ne se combine pas avec --monthly-sheets-max-rows")
+        self.exporter = exporter
+        self.output_dir = output_dir
+        self.debounce = debounce
+        self.conn = None
+        self.pending_periods = set()
+        self.pending_subscriptions = False
+        self.reload_needed = True
+        self.running = False
+
+    def install_triggers(self):
+        """Crée (ou remplace) la fonction et les triggers qui notifient les écritures"""
+        exporter = self.exporter
+        conn = exporter.get_db_connection()
+        if not conn:
+            return False
+
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(TRIGGERS_DDL.format(channel=CHANGES_CHANNEL))
+                for table in NOTIFY_TABLES:
+                    cursor.execute(TABLE_TRIGGERS_DDL.format(table=table))
+            conn.commit()
+            exporter._print_success(f"Triggers de notification installés sur {', '.join(NOTIFY_TABLES)}")
+            return True
+        except Exception as e:
+            conn.rollback()
+            exporter._print_error(f"Erreur lors de l'installation des triggers: {e}")
+            return False
+        finally:
+            exporter.release_db_connection(conn)
+
+    def listen(self):
+        """Ouvre la connexion d'écoute, hors du pool : elle reste occupée pendant toute la vie du démon"""
+        self.conn = psycopg2.connect(**connection_params())
+        # Hors transaction, les notifications sont reçues dès leur validation
+        self.conn.autocommit = True
+        with self.conn.cursor() as cursor:
+            cursor.execute(f"LISTEN {CHANGES_CHANNEL}; LISTEN {REPORTS_CHANNEL}")
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def run(self):
+        """Boucle du démon : écoute, relit les mois modifiés et rend les classeurs demandés"""
+        self.running = True
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, self.stop)
+
+        try:
+            while self.running:
+                try:
+                    if self.conn is None:
+                        self.listen()
+                        # Ce qui a été écrit avant l'écoute n'a pas été notifié : on relit tout
+                        self.reload_needed = True
+                        self.exporter._print(f"👂 En écoute sur {CHANGES_CHANNEL} et {REPORTS_CHANNEL}")
+                    if self.reload_needed:
+                        self.load()
+                    requests = self.wait()
+                    self.apply_changes()
+                    for name in requests:
+                        self.render(name)
+                except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                    self.exporter._print_error(f"Connexion d'écoute perdue: {e}")
+                    self.close()
+                    time.sleep(RECONNECT_SECONDS)
+        finally:
+            self.close()
+            self.exporter._print("🛑 Démon arrêté")
+
+    def stop(self, *_):
+        """Demande l'arrêt de la boucle (aussi appelé sur SIGTERM)"""
+        self.running = False
+
+    def load(self):
+        """Charge toutes les données du périmètre (démarrage, reconnexion, TRUNCATE)"""
+        exporter = self.exporter
+        start = time.perf_counter()
+        exporter.transactions_data = {}
+        exporter.monthly_stats = {}
+        exporter.subscriptions_data = []
+        exporter.month_sketches = {}
+        exporter.daily_totals = {}
+        exporter.month_controls = {}
+        exporter.fetch_data()
+
+        self.pending_periods.clear()
+        self.pending_subscriptions = False
+        self.reload_needed = False
+        exporter._print_success(f"État chargé: {len(exporter.monthly_stats)} mois, "
+                                f"{len(exporter.subscriptions_data)} abonnements en {time.perf_counter() - start:.1f} s")
+
+    def wait(self):
+        """Attend des notifications ; une rafale prolonge l'attente de `debounce` pour les regrouper
+
+        Retourne les noms de classeurs demandés, les écritures notifiées étant mises en attente.
+        """
+        requests = []
+        timeout, deadline = IDLE_SECONDS, None
+        while self.running:
+            if deadline is not None:
+                timeout = min(self.debounce, deadline - time.monotonic())
+                if timeout <= 0:
+                    break
+            if select.select([self.conn], [], [], timeout) == ([], [], []):
+                break
+
+            self.conn.poll()
+            while self.conn.notifies:
+                notify = self.conn.notifies.pop(0)
+                if notify.channel == REPORTS_CHANNEL:
+                    requests.append(notify.payload)
+                else:
+                    self._record_change(notify.payload)
+            if deadline is None:
+                deadline = time.monotonic() + MAX_BATCH_SECONDS
+        return requests
+
+    def _record_change(self, payload):
+        """Retient le mois ou les abonnements à relire, si l'écriture touche le périmètre de l'export"""
+        change = json.loads(payload)
+        if 'month' not in change:
+            # TRUNCATE : aucune ligne n'est décrite
+            self.reload_needed = True
+            return
+
+        user_id = self.exporter.user_id
+        if user_id is not None and str(user_id).lower() != change['user_id'].lower():
+            return
+        if change['table'] == "subscriptions":
+            self.pending_subscriptions = True
+            return
+
+        annee, mois = map(int, change['month'].split("-"))
+        debut, fin = self.exporter._period_bounds((annee, mois))
+        if self.exporter.since is not None and fin <= self.exporter.since:
+            return
+        if self.exporter.until is not None and debut > self.exporter.until:
+            return
+        self.pending_periods.add((annee, mois))
+
+    def apply_changes(self):
+        """Relit les mois et abonnements modifiés ; en cas d'échec, ils restent en attente"""
+        exporter = self.exporter
+        if self.reload_needed:
+            self.load()
+            return
+
+        if self.pending_subscriptions and exporter.fetch_subscriptions() is not None:
+            self.pending_subscriptions = False
+
+        if self.pending_periods:
+            periodes = sorted(self.pending_periods)
+            start = time.perf_counter()
+            if exporter.refresh_months(periodes):
+                self.pending_periods.clear()
+                exporter._print(f"🔄 {len(periodes)} mois relus en {time.perf_counter() - start:.2f} s")
+
+    def render(self, name=None):
+        """Rend un classeur à partir de l'état en mémoire, dans le dossier de sortie"""
+        exporter = self.exporter
+        self.apply_changes()
+        if self.pending_periods or self.pending_subscriptions:
+            exporter._print_error("Données incomplètes (relecture en échec) : classeur non généré")
+            return None
+
+        # La projection part du mois courant : elle est recalculée si le mois a changé depuis la lecture
+        projection = exporter.subscription_projection
+        if projection is not None and str(projection.start) != date.today().strftime("%Y-%m"):
+            exporter._load_subscriptions(exporter.subscriptions_data)
+
+        # Le nom vient d'une notification : seul le nom de fichier est retenu, jamais un chemin
+        name = os.path.basename(name or "") or f"rapport_financier_{datetime.now():%Y%m%d_%H%M%S}.xlsx"
+        if not name.endswith(".xlsx"):
+            name += ".xlsx"
+        os.makedirs(self.output_dir, exist_ok=True)
+
+        exporter.metrics = RunMetrics(trace_memory=exporter.metrics.trace_memory)
+        return exporter.generate_report(os.path.join(self.output_dir, name), fetch=False)
@@ -1,23 +1,22 @@
+import io
 import os
-import psycopg2
-import pandas as pd
-from datetime import datetime
-import xlsxwriter
+import json
+import math
+import time
+import argparse
+import threading
+import sys
+from datetime import date, datetime
 from urllib.parse import urlparse
 from collections import defaultdict
-from dotenv import load_dotenv
+from itertools import repeat
+from contextlib import contextmanager, redirect_stdout
+from concurrent.futures import ThreadPoolExecutor
 
-# Charger les variables d'environnement du fichier .env
-load_dotenv()
+from metrics import Profiler, RunMetrics
 
-# Configuration de la base de données (récupérée depuis .env)
-DATABASE_URL = os.getenv("DATABASE_URL")
-
-if not DATABASE_URL:
-    raise ValueError("❌ La variable d'environnement DATABASE_URL n'est pas définie dans le fichier .env")
-
-# Exemple de connexion (optionnel)
-# conn = psycopg2.connect(DATABASE_URL)
+# pandas, NumPy, pyarrow, psycopg2 et xlsxwriter sont importés par les étapes qui s'en servent :
+# --help, la vérification de la configuration ou un export d'agrégats ne paient que ce qu'ils utilisent
 
 
 # Palette de couleurs moderne et cohérente
@@ -57,67 +56,892 @@ MOIS_TRADUCTION = {
     "october": "Octobre", "november": "Novembre", "december": "Décembre"
 }
 
+# Mois en français indexés par numéro (1 = Janvier), indépendant de la locale
+MOIS_PAR_NUMERO = dict(enumerate(MOIS_TRADUCTION.values(), start=1))
+
+# Requête et colonnes des transactions (partagées entre le mode complet et le mode flux)
+TRANSACTIONS_QUERY = """
+SELECT id, user_id, title, amount, category, created_at
+FROM transactions 
+{where}
+ORDER BY created_at DESC
+"""
+
+SUBSCRIPTIONS_QUERY = """
+SELECT id, user_id, label, amount, date, recurrence, rating, image_url, created_at
+FROM subscriptions 
+{where}
+ORDER BY created_at DESC
+"""
+
+# Empreinte par mois (nombre de lignes, somme et hachage du contenu) pour détecter les mois nouveaux ou modifiés :
+# le hachage couvre les modifications sur place (catégorie, titre) qui laissent le nombre et la somme inchangés
+MONTH_FINGERPRINTS_QUERY = """
+SELECT EXTRACT(YEAR FROM created_at)::int AS annee,
+       EXTRACT(MONTH FROM created_at)::int AS mois,
+       COUNT(*) AS nb,
+       SUM(amount) AS total,
+       md5(string_agg(concat_ws(chr(31), id, category, amount, title), chr(30) ORDER BY id)) AS signature
+FROM transactions
+{where}
+GROUP BY 1, 2
+"""
+
+# Agrégats mensuels calculés par PostgreSQL (mode --sql-aggregates)
+MONTHLY_AGGREGATES_QUERY = """
+SELECT EXTRACT(YEAR FROM date_trunc('month', created_at))::int AS annee,
+       EXTRACT(MONTH FROM date_trunc('month', created_at))::int AS mois,
+       category,
+       COUNT(*) AS nb,
+       SUM(ABS(amount)) AS total_categorie,
+       COALESCE(SUM(-amount) FILTER (WHERE amount < 0), 0) AS depenses,
+       COALESCE(SUM(amount) FILTER (WHERE amount > 0), 0) AS revenus,
+       COUNT(*) FILTER (WHERE amount < 0) AS nb_depenses,
+       COUNT(*) FILTER (WHERE amount > 0) AS nb_revenus
+FROM transactions
+{where}
+GROUP BY date_trunc('month', created_at), category
+ORDER BY date_trunc('month', created_at) DESC, total_categorie DESC
+"""
+
+# Dépenses et revenus par jour (mode --sql-aggregates), pour les séries temporelles
+DAILY_TOTALS_QUERY = """
+SELECT created_at::date AS jour,
+       COALESCE(SUM(-amount) FILTER (WHERE amount < 0), 0) AS depenses,
+       COALESCE(SUM(amount) FILTER (WHERE amount > 0), 0) AS revenus
+FROM transactions
+{where}
+GROUP BY 1
+"""
+
+# Bornes created_at qui partagent les transactions en plages de même taille (lecture parallèle)
+PARTITION_BOUNDS_QUERY = """
+SELECT percentile_disc(%s::float8[]) WITHIN GROUP (ORDER BY created_at)
+FROM transactions
+{where}
+"""
+
+# High-water mark : dernière transaction insérée (created_at puis id)
+WATERMARK_QUERY = """
+SELECT created_at, id
+FROM transactions
+{where}
+ORDER BY created_at DESC, id DESC
+LIMIT 1
+"""
+
+# Filigrane d'un périmètre (nombre de lignes, somme, dernière date) : une écriture qui change le rapport le change
+DATA_WATERMARK_QUERY = """
+SELECT COUNT(*), COALESCE(SUM(amount), 0), MAX(created_at)
+FROM {table}
+{where}
+"""
+
+# Index nécessaires aux exports par utilisateur et par période : (table, nom, colonnes)
+REQUIRED_INDEXES = [
+    ("transactions", "idx_transactions_user_created_at", "user_id, created_at"),
+    ("subscriptions", "idx_subscriptions_user_created_at", "user_id, created_at"),
+]
+TRANSACTION_COLUMNS = ["id", "user_id", "title", "amount", "category", "created_at"]
+
+# Nombre de lignes ramenées par aller-retour du curseur serveur en mode flux
+STREAMING_ITERSIZE = 5000
+
+# Connexions du pool partagé par toutes les requêtes d'un export (transactions et abonnements en parallèle)
+POOL_SIZE = 2
+
+INGESTION_MODES = ("read_sql", "copy")
+
+# Horizon par défaut de la projection des prélèvements d'abonnements, en mois
+PROJECTION_MONTHS = 12
+# Écart maximal (jours) entre deux lignes identiques signalées comme doublon : created_at est une DATE
+DUPLICATE_TOLERANCE = 0
+RECURRENCE_LABELS = {"weekly": "Hebdomadaire", "monthly": "Mensuel", "yearly": "Annuel"}
+
+# Origine des numéros de série de dates Excel (système 1900)
+EXCEL_EPOCH = "1899-12-30"
+
+def copy_column_types(table):
+    """Types des colonnes de `table` lues par COPY ... TO STDOUT (CSV) : aucune inférence, aucun objet Python par valeur"""
+    import pyarrow as pa
+    # Les deux colonnes amount sont en DECIMAL(10,2), mais seules celles des transactions sont volumineuses :
+    # elles sont lues en float64 (sans objet Decimal par ligne), puis toujours arrondies au centime (np.rint)
+    # par TransactionStore et les contrôles, ce qui est exact pour un DECIMAL(10,2). Les abonnements, peu nombreux,
+    # restent en Decimal comme avec le curseur psycopg2 : leurs onglets ne dépendent pas du mode de lecture.
+    if table == "transactions":
+        return {
+            "id": pa.string(),
+            "user_id": pa.string(),
+            "title": pa.string(),
+            "amount": pa.float64(),
+            "category": pa.string(),
+            "created_at": pa.date32(),
+        }
+    return {
+        "id": pa.string(),
+        "user_id": pa.string(),
+        "label": pa.string(),
+        "amount": pa.decimal128(10, 2),
+        "date": pa.date32(),
+        "recurrence": pa.string(),
+        "rating": pa.int32(),
+        "image_url": pa.string(),
+        "created_at": pa.timestamp("us"),
+    }
+
+def required_pool_size(pool_size, parallel_fetch=1):
+    """Taille de pool nécessaire : en lecture parallèle, l'instantané, les abonnements et N plages sont ouverts ensemble"""
+    return max(pool_size, parallel_fetch + 2) if parallel_fetch > 1 else pool_size
+
+def database_url():
+    """URL PostgreSQL (.env ou environnement), vérifiée seulement quand une étape en a besoin"""
+    from dotenv import load_dotenv
+    load_dotenv()
+    url = os.getenv("DATABASE_URL")
+    if not url:
+        raise ValueError("❌ La variable d'environnement DATABASE_URL n'est pas définie dans le fichier .env")
+    return url
+
+def connection_params():
+    """Paramètres de connexion psycopg2 tirés de DATABASE_URL"""
+    result = urlparse(database_url())
+    return dict(
+        database=result.path[1:],
+        user=result.username,
+        password=result.password,
+        host=result.hostname,
+        port=result.port
+    )
+
+def create_connection_pool(size):
+    """Ouvre un pool de `size` connexions vers DATABASE_URL"""
+    from psycopg2.pool import ThreadedConnectionPool
+    
+    # minconn = maxconn : psycopg2 ferme les connexions rendues au-delà de minconn
+    return ThreadedConnectionPool(size, size, **connection_params())
+
 class FinanceExporter:
-    def __init__(self):
+    def __init__(self, user_id=None, since=None, until=None,
+                 streaming=False, itersize=STREAMING_ITERSIZE, cache_path=None,
+                 sql_aggregates=False, skip_monthly_sheets=False, monthly_sheets_max_rows=None,
+                 pool_size=POOL_SIZE, concurrent_fetch=True, pool=None, verbose=True,
+                 constant_memory=False, snapshot_path=None, from_snapshot=None, ingestion="read_sql",
+                 parallel_fetch=1, metrics_path=None, trace_memory=False, profile_path=None,
+                 projection_months=PROJECTION_MONTHS, periods=None, include_subscriptions=True, max_memory=None,
+                 duplicate_tolerance=DUPLICATE_TOLERANCE):
         self.workbook = None
-        self.transactions_data = defaultdict(list)
+        self.transactions_data = {}
         self.subscriptions_data = []
+        self.monthly_stats = {}
+        self.subscription_stats = None
+        self.subscription_projection = None
+        self.projection_months = projection_months
+        self.monthly_sheets = {}
+        self.sheet_rows = {}
         self.formats = {}
+        # Sketches de quantiles et de titres fréquents par mois, fusionnés pour l'onglet Insights
+        self.month_sketches = {}
+        self.insights = None
+        # Dépenses et revenus de chaque jour, par mois (centimes), pour l'onglet des séries temporelles
+        self.daily_totals = {}
+        # Doublons et candidats aux montants atypiques par mois, fusionnés pour l'onglet Contrôles
+        self.month_controls = {}
+        self.controls = None
+        self.duplicate_tolerance = duplicate_tolerance
+        self.user_id = user_id
+        self.since = since
+        self.until = until
+        self.streaming = streaming
+        self.itersize = itersize
+        # Budget mémoire (octets) : blocs adaptés à la mémoire résidente, mois terminés déversés sur disque
+        if max_memory:
+            from memory import MemoryBudget
+        self.budget = MemoryBudget(max_memory, itersize) if max_memory else None
+        # En mode flux, chaque ligne écrite est vidée sur disque : la mémoire reste bornée à une ligne
+        self.constant_memory = constant_memory or streaming or self.budget is not None
+        if cache_path:
+            from cache import AggregateCache
+        self.cache = AggregateCache(cache_path, scope=self._scope_key()) if cache_path else None
+        self.refresh_periods = None
+        # Classeur d'une tranche (mode fragmenté) : ses mois seulement, les abonnements étant dans l'index
+        self.periods = sorted(periods, reverse=True) if periods is not None else None
+        self.include_subscriptions = include_subscriptions
+        # Classeurs des tranches, listés dans l'onglet index (mode fragmenté)
+        self.shards = None
+        # Sans lignes détaillées, les agrégats ne peuvent venir que de PostgreSQL
+        self.sql_aggregates = sql_aggregates or skip_monthly_sheets or monthly_sheets_max_rows is not None
+        self.skip_monthly_sheets = skip_monthly_sheets
+        self.monthly_sheets_max_rows = monthly_sheets_max_rows
+        # Un pool fourni par l'appelant (processus de lot) lui appartient : il n'est pas fermé ici
+        self.pool = pool
+        self._owns_pool = pool is None
+        self.pool_size = required_pool_size(pool_size, parallel_fetch)
+        self.parallel_fetch = parallel_fetch
+        self.pg_snapshot = None
+        self.verbose = verbose
+        self.metrics = RunMetrics(trace_memory=trace_memory)
+        self.metrics_path = metrics_path
+        self.profile_path = profile_path
+        self.concurrent_fetch = concurrent_fetch
+        self.ingestion = ingestion
+        self._pool_lock = threading.Lock()
+        
+        # Un snapshot contient toutes les lignes du périmètre : incompatible avec les lectures partielles
+        if (snapshot_path or from_snapshot) and (cache_path or self.sql_aggregates):
+            raise ValueError("❌ Les snapshots ne se combinent ni avec le cache incrémental ni avec les agrégats SQL")
+        # Le curseur serveur du mode flux lit après fetch_data, hors de l'instantané partagé
+        if parallel_fetch > 1 and streaming:
+            raise ValueError("❌ La lecture parallèle ne se combine pas avec le mode flux")
+        # Sous budget, les lignes arrivent par blocs d'un seul curseur serveur
+        if max_memory and (parallel_fetch > 1 or ingestion == "copy"):
+            raise ValueError("❌ Le budget mémoire ne se combine ni avec la lecture parallèle ni avec l'ingestion COPY")
+        if snapshot_path or from_snapshot:
+            from snapshot import SnapshotReader, SnapshotWriter
+        self.snapshot = SnapshotWriter(snapshot_path, self._scope_key()) if snapshot_path else None
+        self.source = SnapshotReader(from_snapshot) if from_snapshot else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Ferme les connexions du pool et le snapshot éventuel (fin de vie de l'exporteur)"""
+        if self.snapshot:
+            self.snapshot.close()
+        if self.pool is not None and self._owns_pool:
+            self.pool.closeall()
+            self.pool = None
+        if self.budget:
+            self.budget.close()
+
+    def _get_pool(self):
+        """Ouvre le pool de connexions à la première utilisation (URL analysée une seule fois)"""
+        with self._pool_lock:
+            if self.pool is None:
+                self.pool = create_connection_pool(self.pool_size)
+                self._print_success("Connexion à la base de données établie")
+        return self.pool
 
     def get_db_connection(self):
-        """Établit une connexion à la base de données"""
+        """Emprunte une connexion au pool de l'exporteur (rattachée à l'instantané partagé s'il y en a un)"""
+        conn = None
         try:
-            result = urlparse(DATABASE_URL)
-            conn = psycopg2.connect(
-                database=result.path[1:],
-                user=result.username,
-                password=result.password,
-                host=result.hostname,
-                port=result.port
-            )
-            self._print_success("Connexion à la base de données établie")
+            conn = self._get_pool().getconn()
+            if self.pg_snapshot:
+                with conn.cursor() as cursor:
+                    cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+                    cursor.execute("SET TRANSACTION SNAPSHOT %s", (self.pg_snapshot,))
             return conn
         except Exception as e:
+            if conn is not None:
+                self.release_db_connection(conn)
             self._print_error(f"Erreur de connexion: {e}")
             return None
 
-    def fetch_transactions(self):
-        """Récupère toutes les transactions"""
+    @contextmanager
+    def shared_snapshot(self):
+        """Exporte un instantané REPEATABLE READ que toutes les connexions empruntées ensuite importent
+        
+        La transaction qui l'exporte reste ouverte jusqu'à la fin du bloc : c'est elle qui le maintient.
+        """
         conn = self.get_db_connection()
         if not conn:
-            return None
+            yield
+            return
+        
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+                cursor.execute("SELECT pg_export_snapshot()")
+                self.pg_snapshot = cursor.fetchone()[0]
+            yield
+        finally:
+            self.pg_snapshot = None
+            self.release_db_connection(conn)
+
+    def release_db_connection(self, conn):
+        """Rend une connexion au pool (une transaction restée ouverte est annulée)"""
+        self.pool.putconn(conn)
+
+    def fetch_user_ids(self):
+        """Liste les identifiants de tous les utilisateurs (mode lot)"""
+        conn = self.get_db_connection()
+        if not conn:
+            return []
+        
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT id FROM users ORDER BY created_at, id")
+                return [str(user_id) for (user_id,) in cursor.fetchall()]
+        except Exception as e:
+            self._print_error(f"Erreur lors de la récupération des utilisateurs: {e}")
+            return []
+        finally:
+            self.release_db_connection(conn)
+
+    def check_connection(self):
+        """Vérifie la configuration : DATABASE_URL est définie et PostgreSQL répond"""
+        conn = self.get_db_connection()
+        if not conn:
+            return False
         
         try:
-            query = """
-            SELECT id, user_id, title, amount, category, created_at
-            FROM transactions 
-            ORDER BY created_at DESC
-            """
-            df = pd.read_sql_query(query, conn)
+            with conn.cursor() as cursor:
+                cursor.execute("SHOW server_version")
+                version = cursor.fetchone()[0]
+            conn.rollback()
+            self._print_success(f"PostgreSQL {version} joignable")
+            return True
+        except Exception as e:
+            self._print_error(f"Erreur lors de la vérification de la connexion: {e}")
+            return False
+        finally:
+            self.release_db_connection(conn)
+
+    def check_indexes(self, create=False):
+        """Vérifie que les index (user_id, created_at) existent, et les crée si demandé"""
+        conn = self.get_db_connection()
+        if not conn:
+            return False
+        
+        try:
+            missing = []
+            with conn.cursor() as cursor:
+                for table, name, columns in REQUIRED_INDEXES:
+                    cursor.execute("SELECT indexdef FROM pg_indexes WHERE tablename = %s", (table,))
+                    if not any(f"({columns}" in indexdef for (indexdef,) in cursor.fetchall()):
+                        missing.append((table, name, columns))
+            conn.rollback()
+            
+            if missing and create:
+                # CREATE INDEX CONCURRENTLY ne bloque pas les écritures mais refuse de s'exécuter dans une transaction
+                conn.autocommit = True
+                try:
+                    with conn.cursor() as cursor:
+                        for table, name, columns in missing:
+                            cursor.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} ({columns})")
+                            self._print_success(f"Index {name} créé sur {table} ({columns})")
+                finally:
+                    conn.autocommit = False
+                return True
+            
+            for table, name, columns in missing:
+                self._print_error(f"Index manquant sur {table} ({columns}) : relancez avec --create-indexes")
+            return not missing
+        except Exception as e:
+            self._print_error(f"Erreur lors de la vérification des index: {e}")
+            return False
+        finally:
+            self.release_db_connection(conn)
+
+    def fetch_data(self):
+        """Récupère les données du rapport, les requêtes indépendantes en parallèle sur le pool
+        
+        Retourne True si les lignes de transactions doivent encore être écrites dans les onglets mensuels.
+        """
+        if self.source:
+            # Rendu hors ligne : aucune requête PostgreSQL
+            self.load_snapshot()
+            return True
+        
+        if self.parallel_fetch > 1:
+            # Lecture parallèle : toutes les requêtes de l'export voient le même instantané PostgreSQL
+            with self.shared_snapshot():
+                return self._fetch_from_database()
+        return self._fetch_from_database()
+
+    def _fetch_from_database(self):
+        """Enchaîne cache, agrégats et lectures de lignes ; retourne True s'il reste des lignes à écrire"""
+        if self.cache:
+            self.plan_incremental_refresh()
+        fetch_rows = self.refresh_periods != []
+        
+        if self.sql_aggregates:
+            # Les agrégats décident de l'omission des onglets mensuels : ils précèdent la lecture des lignes
+            tasks = [self.fetch_subscriptions] if self.include_subscriptions else []
+            if fetch_rows:
+                tasks.append(self.fetch_monthly_aggregates)
+            self._run_concurrently(tasks)
+        
+            if fetch_rows and self._should_skip_monthly_sheets():
+                self._print("⏭️  Onglets mensuels détaillés ignorés (synthèse calculée à partir des agrégats)")
+                fetch_rows = False
+            if fetch_rows and not self.streaming:
+                self.fetch_transactions()
+        else:
+            tasks = [self.fetch_subscriptions] if self.include_subscriptions else []
+            if fetch_rows and not self.streaming:
+                tasks.append(self.fetch_transactions)
+            self._run_concurrently(tasks)
+        
+        return fetch_rows
+
+    def _run_concurrently(self, tasks):
+        """Exécute des récupérations indépendantes en parallèle, chacune sur sa connexion du pool"""
+        if not self.concurrent_fetch or len(tasks) <= 1:
+            for task in tasks:
+                task()
+            return
+        
+        # Le pool psycopg2 ne met pas en attente : pas plus de tâches simultanées que de connexions
+        with ThreadPoolExecutor(max_workers=min(len(tasks), self.pool_size)) as executor:
+            for future in [executor.submit(task) for task in tasks]:
+                future.result()
+
+    def fetch_transactions(self):
+        """Récupère toutes les transactions (par plages de dates sur plusieurs connexions en lecture parallèle)"""
+        if self.budget:
+            return self._fetch_transactions_within_budget()
+        try:
+            if self.parallel_fetch > 1:
+                df = self._read_transactions_partitioned()
+            else:
+                df = self._read_transactions()
             self._print_success(f"{len(df)} transactions récupérées")
+            if self.snapshot:
+                self.snapshot.write_transactions(df)
             self._organize_transactions_by_month(df)
             return df
         except Exception as e:
             self._print_error(f"Erreur lors de la récupération des transactions: {e}")
             return None
+
+    def _fetch_transactions_within_budget(self):
+        """Lit les transactions par blocs adaptés au budget mémoire ; retourne le nombre de lignes lues
+        
+        La requête trie par date décroissante : les mois plus récents que le dernier bloc sont
+        terminés. Ils sont regroupés en un stockage, puis déversés sur disque si la mémoire
+        approche du budget.
+        """
+        from store import TransactionStore
+        blocs = defaultdict(list)
+        total = 0
+        for chunk in self.iter_transaction_chunks():
+            total += len(chunk)
+            self._inspect(chunk)
+            with self.metrics.stage("organize"):
+                buckets = self._bucket_transactions(chunk)
+                for periode, transactions in buckets.items():
+                    if not self.sql_aggregates:
+                        self._accumulate_monthly_stats(periode, transactions)
+                    self._observe(periode, transactions)
+                    blocs[periode].append(transactions)
+                
+                plus_ancien = min(buckets)
+                for periode in [periode for periode in blocs if periode > plus_ancien]:
+                    self.transactions_data[periode] = TransactionStore.concat(blocs.pop(periode))
+                if self.budget.under_pressure:
+                    self._spill_months()
+        
+        for periode in sorted(blocs, reverse=True):
+            self.transactions_data[periode] = TransactionStore.concat(blocs.pop(periode))
+        if self.budget.under_pressure:
+            self._spill_months()
+        return total
+
+    def _spill_months(self):
+        """Déverse sur disque les mois terminés encore en mémoire"""
+        from memory import SpilledPartition
+        deja = self.budget.spilled
+        for periode, transactions in self.transactions_data.items():
+            if not isinstance(transactions, SpilledPartition):
+                self.transactions_data[periode] = self.budget.spill(periode, transactions)
+        if self.budget.spilled > deja:
+            self._print(f"💽 {self.budget.spilled} mois déversés sur disque ({self.budget.spilled_bytes / 1e6:.0f} Mo)")
+
+    def _read_transactions(self, created_range=(None, None)):
+        """Lit les transactions du périmètre, restreintes à la plage [début, fin[ de created_at donnée"""
+        conn = self.get_db_connection()
+        if not conn:
+            raise ConnectionError("aucune connexion disponible")
+        
+        try:
+            query, params = self._transactions_query(created_range)
+            return self._read_query(conn, query, params, "transactions")
         finally:
-            conn.close()
+            self.release_db_connection(conn)
+
+    def _read_transactions_partitioned(self):
+        """Lit les transactions en plages de created_at équilibrées, une connexion par plage"""
+        conn = self.get_db_connection()
+        if not conn:
+            raise ConnectionError("aucune connexion disponible")
+        
+        try:
+            where, params = self._transactions_filter()
+            fractions = [k / self.parallel_fetch for k in range(1, self.parallel_fetch)]
+            with conn.cursor() as cursor:
+                cursor.execute(PARTITION_BOUNDS_QUERY.format(where=where), [fractions] + params)
+                bornes = sorted({borne for borne in cursor.fetchone()[0] or [] if borne is not None})
+        finally:
+            self.release_db_connection(conn)
+        
+        # Plages les plus récentes d'abord : la concaténation garde l'ordre created_at DESC de la requête
+        limites = [None] + bornes + [None]
+        plages = list(zip(limites[:-1], limites[1:]))[::-1]
+        with ThreadPoolExecutor(max_workers=len(plages)) as executor:
+            frames = list(executor.map(self._read_transactions, plages))
+        self._print(f"🔀 {len(plages)} plages lues en parallèle dans un même instantané")
+        import pandas as pd
+        return pd.concat(frames, ignore_index=True)
+
+    def _read_query(self, conn, query, params, table, dates_as_objects=False):
+        """Exécute une requête de lignes sur `table`, par le curseur DB-API ou par COPY selon le mode d'ingestion"""
+        if self.ingestion != "copy":
+            import pandas as pd
+            return pd.read_sql_query(query, conn, params=params or None)
+        
+        from pyarrow import csv as pa_csv
+        
+        # COPY n'accepte pas de paramètres : ils sont échappés côté client par mogrify
+        with conn.cursor() as cursor:
+            sql = cursor.mogrify(query, params or None).decode()
+            buffer = io.BytesIO()
+            cursor.copy_expert(f"COPY ({sql}) TO STDOUT WITH (FORMAT csv, HEADER true)", buffer)
+        buffer.seek(0)
+        
+        # En CSV PostgreSQL, NULL est un champ vide non quoté et la chaîne vide est ""
+        table = pa_csv.read_csv(buffer, convert_options=pa_csv.ConvertOptions(
+            column_types=copy_column_types(table),
+            null_values=[""],
+            strings_can_be_null=True,
+            quoted_strings_can_be_null=False,
+        ))
+        return table.to_pandas(date_as_object=dates_as_objects)
+
+    def plan_incremental_refresh(self):
+        """Compare les empreintes mensuelles de PostgreSQL au cache et ne garde que les mois à recalculer"""
+        conn = self.get_db_connection()
+        if not conn:
+            return
+        
+        try:
+            where, params = self._scope_filter()
+            with conn.cursor() as cursor:
+                cursor.execute(MONTH_FINGERPRINTS_QUERY.format(where=where), params or None)
+                fingerprints = {
+                    (annee, mois): (nb, str(total), signature)
+                    for annee, mois, nb, total, signature in cursor.fetchall()
+                }
+                cursor.execute(WATERMARK_QUERY.format(where=where), params or None)
+                row = cursor.fetchone()
+        except Exception as e:
+            self._print_error(f"Erreur lors du calcul des empreintes mensuelles: {e}")
+            return
+        finally:
+            self.release_db_connection(conn)
+        
+        watermark = (row[0].isoformat(), str(row[1])) if row else None
+        cached = self.cache.load_fingerprints()
+        dirty = {periode for periode, empreinte in fingerprints.items() if cached.get(periode) != empreinte}
+        
+        # Des lignes arrivées après le dernier high-water mark rendent son mois obsolète
+        if watermark and watermark != self.cache.load_watermark():
+            created_at = datetime.fromisoformat(watermark[0])
+            dirty.add((created_at.year, created_at.month))
+        
+        reused = self.cache.load_stats(set(fingerprints) - dirty)
+        dirty |= set(fingerprints) - dirty - set(reused)
+        
+        self.monthly_stats.update(reused)
+        self.refresh_periods = sorted(dirty, reverse=True)
+        self._cache_state = (fingerprints, watermark)
+        self._print_success(f"Cache: {len(reused)} mois réutilisés, {len(dirty)} mois à recalculer")
+
+    def update_cache(self):
+        """Enregistre dans le cache les agrégats des mois recalculés"""
+        fingerprints, watermark = self._cache_state
+        refreshed = {
+            periode: self.monthly_stats[periode]
+            for periode in self.refresh_periods if periode in self.monthly_stats
+        }
+        self.cache.save(refreshed, fingerprints, watermark)
+
+    def refresh_months(self, periodes):
+        """Relit les mois (année, mois) donnés et remplace leurs lignes et agrégats en mémoire (mode démon)
+        
+        Retourne False si une lecture a échoué : les mois restent alors à relire.
+        """
+        for periode in periodes:
+            self.transactions_data.pop(periode, None)
+            self.monthly_stats.pop(periode, None)
+            self.month_sketches.pop(periode, None)
+            self.daily_totals.pop(periode, None)
+            self.month_controls.pop(periode, None)
+        
+        # Même filtre par mois que le cache incrémental
+        self.refresh_periods = sorted(periodes, reverse=True)
+        try:
+            ok = True
+            if self.sql_aggregates:
+                ok = self.fetch_monthly_aggregates()
+            if ok and not self.skip_monthly_sheets:
+                ok = self.fetch_transactions() is not None
+        finally:
+            self.refresh_periods = None
+        
+        # Un mois nouveau est ajouté en fin de dictionnaire : on rétablit l'ordre de la requête (récent d'abord)
+        self.monthly_stats = dict(sorted(self.monthly_stats.items(), reverse=True))
+        self.transactions_data = dict(sorted(self.transactions_data.items(), reverse=True))
+        return ok
+
+    def data_watermark(self):
+        """Filigrane des transactions et abonnements du périmètre, ou None si la lecture échoue
+        
+        Deux rapports d'un même périmètre et d'un même mois courant (horizon de la projection)
+        sont identiques tant que le filigrane ne change pas, aux libellés modifiés sur place près.
+        """
+        conn = self.get_db_connection()
+        if not conn:
+            return None
+        
+        try:
+            filigrane = [date.today().strftime("%Y-%m")]
+            with conn.cursor() as cursor:
+                for table, with_dates in (("transactions", True), ("subscriptions", False)):
+                    where, params = self._scope_filter(with_dates)
+                    cursor.execute(DATA_WATERMARK_QUERY.format(table=table, where=where), params or None)
+                    nb, total, dernier = cursor.fetchone()
+                    filigrane.append(f"{nb}:{total}:{dernier.isoformat() if dernier else ''}")
+            conn.rollback()
+            return "|".join(filigrane)
+        except Exception as e:
+            self._print_error(f"Erreur lors du calcul du filigrane des données: {e}")
+            return None
+        finally:
+            self.release_db_connection(conn)
+
+    def fetch_monthly_aggregates(self):
+        """Calcule les agrégats mensuels dans PostgreSQL (GROUP BY mois, catégorie) sans lire les lignes"""
+        conn = self.get_db_connection()
+        if not conn:
+            return False
+        
+        try:
+            where, params = self._transactions_filter()
+            with conn.cursor() as cursor:
+                cursor.execute(MONTHLY_AGGREGATES_QUERY.format(where=where), params or None)
+                rows = cursor.fetchall()
+                cursor.execute(DAILY_TOTALS_QUERY.format(where=where), params or None)
+                jours = cursor.fetchall()
+        except Exception as e:
+            self._print_error(f"Erreur lors du calcul des agrégats mensuels: {e}")
+            return False
+        finally:
+            self.release_db_connection(conn)
+        
+        for annee, mois, category, nb, total, depenses, revenus, nb_depenses, nb_revenus in rows:
+            stats = self.monthly_stats.setdefault((annee, mois), self._new_monthly_stats())
+            stats['categories'][category] += float(total)
+            stats['depenses'] += float(depenses)
+            stats['revenus'] += float(revenus)
+            stats['nb_depenses'] += nb_depenses
+            stats['nb_revenus'] += nb_revenus
+            stats['count'] += nb
+        
+        if jours:
+            import numpy as np
+            from timeseries import daily_totals
+            dates, depenses, revenus = zip(*jours)
+            # DECIMAL(10,2) : l'arrondi au centime absorbe l'erreur du float
+            self._add_daily_totals(daily_totals(np.array(dates, dtype='datetime64[D]'),
+                                                np.rint(np.array(depenses, dtype='float64') * 100),
+                                                np.rint(np.array(revenus, dtype='float64') * 100)))
+        self._print_success(f"Agrégats de {len({(r[0], r[1]) for r in rows})} mois calculés par PostgreSQL")
+        return True
+
+    def _transactions_query(self, created_range=(None, None)):
+        """Construit la requête des transactions et ses paramètres selon le périmètre demandé"""
+        where, params = self._transactions_filter(created_range)
+        return TRANSACTIONS_QUERY.format(where=where), params
+
+    def _scope_filter(self, with_dates=True):
+        """Clause WHERE du périmètre de l'export (utilisateur, période) et ses paramètres"""
+        clauses, params = self._scope_clauses(with_dates)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        return where, params
+
+    def _scope_clauses(self, with_dates=True):
+        """Conditions paramétrées du périmètre ; l'index (user_id, created_at) les couvre toutes"""
+        clauses, params = [], []
+        if self.user_id is not None:
+            clauses.append("user_id = %s")
+            params.append(str(self.user_id))
+        if with_dates and self.since is not None:
+            clauses.append("created_at >= %s")
+            params.append(self.since)
+        if with_dates and self.until is not None:
+            clauses.append("created_at <= %s")
+            params.append(self.until)
+        return clauses, params
+
+    def _scope_key(self):
+        """Identifiant du périmètre, pour ne pas mélanger les agrégats en cache de deux exports"""
+        return f"user={self.user_id or '*'};since={self.since or '*'};until={self.until or '*'}"
+
+    def _transactions_filter(self, created_range=(None, None)):
+        """Construit la clause WHERE commune aux requêtes sur les transactions"""
+        clauses, params = self._scope_clauses()
+        
+        # Plage [début, fin[ d'une lecture parallèle
+        debut, fin = created_range
+        if debut is not None:
+            clauses.append("created_at >= %s")
+            params.append(debut)
+        if fin is not None:
+            clauses.append("created_at < %s")
+            params.append(fin)
+        
+        # Mois d'un classeur fragmenté, puis mode incrémental : on ne relit que les mois nouveaux ou modifiés
+        for periodes in (self.periods, self.refresh_periods):
+            if periodes is None:
+                continue
+            ranges = []
+            for annee, mois in periodes:
+                ranges.append("(created_at >= %s AND created_at < %s)")
+                params.extend(self._period_bounds((annee, mois)))
+            clauses.append("(" + " OR ".join(ranges) + ")")
+        
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        return where, params
+
+    def _should_skip_monthly_sheets(self):
+        """Indique si les onglets mensuels (lignes détaillées) doivent être omis pour ce compte"""
+        if self.skip_monthly_sheets:
+            return True
+        if self.monthly_sheets_max_rows is None:
+            return False
+        
+        # Le seuil porte sur les lignes à relire, connues grâce aux agrégats SQL
+        periods = self.monthly_stats if self.refresh_periods is None else self.refresh_periods
+        nb_lignes = sum(self.monthly_stats[p]['count'] for p in periods if p in self.monthly_stats)
+        return nb_lignes > self.monthly_sheets_max_rows
+
+    def iter_transaction_chunks(self):
+        """Parcourt les transactions par blocs via un curseur nommé côté serveur (ou depuis le snapshot)"""
+        if self.source:
+            if not self.budget:
+                yield from self.source.iter_transaction_chunks(self.itersize)
+                return
+            for chunk in self.source.iter_transaction_chunks(lambda: self.itersize):
+                yield chunk
+                self.itersize = self.budget.next_chunk_size()
+            return
+        
+        conn = self.get_db_connection()
+        if not conn:
+            return
+        
+        import pandas as pd
+        try:
+            # Un curseur nommé garde le résultat côté PostgreSQL : seul le bloc courant est en mémoire
+            with conn.cursor(name="finance_export_transactions") as cursor:
+                cursor.itersize = self.itersize
+                query, params = self._transactions_query()
+                cursor.execute(query, params or None)
+                total = 0
+                while True:
+                    rows = cursor.fetchmany(self.itersize)
+                    if not rows:
+                        break
+                    total += len(rows)
+                    chunk = pd.DataFrame(rows, columns=TRANSACTION_COLUMNS)
+                    if self.snapshot:
+                        self.snapshot.write_transactions(chunk)
+                    yield chunk
+                    # Le bloc a été traité : le suivant est dimensionné d'après la mémoire résidente
+                    if self.budget:
+                        self.itersize = self.budget.next_chunk_size()
+            self._print_success(f"{total} transactions récupérées en flux")
+        except Exception as e:
+            self._print_error(f"Erreur lors de la lecture en flux des transactions: {e}")
+        finally:
+            self.release_db_connection(conn)
 
     def _organize_transactions_by_month(self, df):
         """Organise les transactions par mois"""
-        df['created_at'] = pd.to_datetime(df['created_at'])
-        
-        for _, transaction in df.iterrows():
-            mois_nom_en = transaction['created_at'].strftime("%B").lower()
-            mois_nom_fr = MOIS_TRADUCTION.get(mois_nom_en, mois_nom_en)
-            
-            self.transactions_data[mois_nom_fr].append({
-                'title': transaction['title'],
-                'category': transaction['category'],
-                'amount': float(transaction['amount']),
-                'date': transaction['created_at'].strftime("%Y-%m-%d"),
-                'id': str(transaction['id'])
-            })
+        from store import TransactionStore
+        self._inspect(df)
+        with self.metrics.stage("organize"):
+            for periode, transactions in self._bucket_transactions(df).items():
+                if not self.sql_aggregates:
+                    self._accumulate_monthly_stats(periode, transactions)
+                self._observe(periode, transactions)
+                if periode in self.transactions_data:
+                    transactions = TransactionStore.concat([self.transactions_data[periode], transactions])
+                self.transactions_data[periode] = transactions
+
+    def _bucket_transactions(self, df):
+        """Répartit un bloc de transactions en un stockage compact par (année, mois), ordre d'apparition conservé"""
+        from store import TransactionStore
+        return TransactionStore.from_frame(df).split_by_month()
+
+    def _accumulate_monthly_stats(self, periode, transactions):
+        """Met à jour les agrégats du mois (catégories, dépenses, revenus) à partir des sommes en centimes"""
+        stats = self.monthly_stats.setdefault(periode, self._new_monthly_stats())
+        totaux = transactions.totals()
+        
+        for categorie, centimes in totaux['categories'].items():
+            stats['categories'][categorie] = self._add_cents(stats['categories'][categorie], centimes)
+        stats['depenses'] = self._add_cents(stats['depenses'], totaux['depenses'])
+        stats['revenus'] = self._add_cents(stats['revenus'], totaux['revenus'])
+        stats['nb_depenses'] += totaux['nb_depenses']
+        stats['nb_revenus'] += totaux['nb_revenus']
+        stats['count'] += totaux['count']
+        
+        import numpy as np
+        from timeseries import daily_totals
+        # Totaux journaliers des séries temporelles, gardés par mois : quelques centaines d'octets chacun
+        montants = transactions.amounts
+        self._add_daily_totals(daily_totals(transactions.dates, np.maximum(-montants, 0), np.maximum(montants, 0)))
+
+    def _add_daily_totals(self, totaux):
+        """Ajoute des totaux journaliers {(année, mois): tableau (jours, 2)} à ceux déjà lus"""
+        for periode, jours in totaux.items():
+            if periode in self.daily_totals:
+                jours = self.daily_totals[periode] + jours
+            self.daily_totals[periode] = jours
+
+    def _observe(self, periode, transactions):
+        """Alimente les sketches du mois (quantiles par catégorie, titres fréquents) avec un bloc de lignes"""
+        from sketches import TransactionSketch
+        with self.metrics.stage("sketches"):
+            self.month_sketches.setdefault(periode, TransactionSketch()).update(transactions)
+
+    def _inspect(self, df):
+        """Alimente les contrôles de chaque mois (doublons, montants atypiques) avec un bloc de lignes brutes"""
+        import controls
+        with self.metrics.stage("controls"):
+            for periode, lignes in controls.prepare(df).items():
+                self.month_controls.setdefault(periode, controls.TransactionControls(self.duplicate_tolerance)).update(lignes)
+
+    def _merged_controls(self):
+        """Contrôles de toutes les transactions du rapport, ou None si des mois n'ont pas été relus"""
+        if not self.month_controls or set(self.monthly_stats) - set(self.month_controls):
+            return None
+        from controls import TransactionControls
+        with self.metrics.stage("controls_merge"):
+            return TransactionControls.merged(self.month_controls[periode] for periode in self.monthly_stats)
+
+    def _merged_sketch(self):
+        """Sketch de toutes les transactions du rapport, ou None si des mois n'ont pas été relus (cache, agrégats seuls)"""
+        if not self.month_sketches or set(self.monthly_stats) - set(self.month_sketches):
+            return None
+        from sketches import TransactionSketch
+        # Étape distincte de "sketches", mesurée pendant la lecture : la fusion est une étape de premier niveau
+        with self.metrics.stage("insights_merge"):
+            # Fusion dans l'ordre des mois : le résultat ne dépend pas de l'ordre des relectures
+            return TransactionSketch.merged(self.month_sketches[periode] for periode in self.monthly_stats)
+
+    def _time_series(self):
+        """Série quotidienne de tout le rapport, ou None si des mois n'ont pas de totaux journaliers (cache)"""
+        if not self.daily_totals or set(self.monthly_stats) - set(self.daily_totals):
+            return None
+        from timeseries import TimeSeries
+        with self.metrics.stage("timeseries_build"):
+            return TimeSeries({periode: self.daily_totals[periode] for periode in self.monthly_stats})
 
     def fetch_subscriptions(self):
         """Récupère tous les abonnements"""
@@ -126,20 +950,63 @@ class FinanceExporter:
             return None
         
         try:
-            query = """
-            SELECT id, user_id, label, amount, date, recurrence, rating, image_url, created_at
-            FROM subscriptions 
-            ORDER BY created_at DESC
-            """
-            df = pd.read_sql_query(query, conn)
-            self._print_success(f"{len(df)} abonnements récupérés")
-            self.subscriptions_data = df.to_dict('records')
-            return df
+            # Un abonnement souscrit avant la période reste actif : seul l'utilisateur filtre
+            where, params = self._scope_filter(with_dates=False)
+            query = SUBSCRIPTIONS_QUERY.format(where=where)
+            if self.ingestion == "copy" or self.snapshot:
+                df = self._read_query(conn, query, params, "subscriptions", dates_as_objects=True)
+                if self.snapshot:
+                    self.snapshot.write_subscriptions(df)
+                subscriptions = df.to_dict('records')
+            else:
+                # Quelques lignes par utilisateur : des dicts lus au curseur suffisent, sans pandas
+                with conn.cursor() as cursor:
+                    cursor.execute(query, params or None)
+                    columns = [column[0] for column in cursor.description]
+                    subscriptions = [dict(zip(columns, row)) for row in cursor.fetchall()]
+            self._print_success(f"{len(subscriptions)} abonnements récupérés")
+            self._load_subscriptions(subscriptions)
+            return subscriptions
         except Exception as e:
             self._print_error(f"Erreur lors de la récupération des abonnements: {e}")
             return None
         finally:
-            conn.close()
+            self.release_db_connection(conn)
+
+    def _load_subscriptions(self, subscriptions):
+        """Retient les abonnements (un dict par ligne) et projette leurs prélèvements"""
+        self.subscriptions_data = subscriptions
+        self.subscription_stats = self._compute_subscription_stats(subscriptions)
+
+    def load_snapshot(self):
+        """Charge les données du rapport depuis un snapshot Parquet (transactions lues en flux ou sous budget si demandé)"""
+        info = self.source.info
+        self._print_success(f"Snapshot {self.source.path} ({info.get('scope')}, {info.get('created_at')}): "
+                            f"{self.source.num_transactions} transactions")
+        self._load_subscriptions(self.source.read_subscriptions().to_dict('records'))
+        if self.streaming:
+            return
+        if self.budget:
+            # Le snapshot garde l'ordre created_at DESC de la requête : les mois terminés peuvent être déversés
+            self._fetch_transactions_within_budget()
+        else:
+            self._organize_transactions_by_month(self.source.read_transactions())
+
+    def _compute_subscription_stats(self, subscriptions):
+        """Projette les prélèvements sur l'horizon et en déduit coût mensuel moyen et coût par récurrence"""
+        from projection import RECURRENCES, SubscriptionProjection
+        self.subscription_projection = SubscriptionProjection.from_records(
+            subscriptions, date.today(), self.projection_months)
+        
+        projection = self.subscription_projection
+        par_recurrence = projection.by_recurrence.sum(axis=1) / len(projection.months) / 100
+        return {
+            'count': len(subscriptions),
+            'total_mensuel': projection.monthly_average() / 100,
+            'recurrences': {RECURRENCE_LABELS[recurrence]: float(cout)
+                            for recurrence, cout in zip(RECURRENCES, par_recurrence) if cout},
+            'non_reconnues': projection.unknown,
+        }
 
     def initialize_formats(self):
         """Initialise tous les formats Excel"""
@@ -220,6 +1087,18 @@ class FinanceExporter:
             'border': 1
         })
         
+        # Format des montants de transactions : la couleur vient des formats conditionnels
+        self.formats['amount'] = self.workbook.add_format({
+            'num_format': '#,##0.00 €',
+            'align': 'right',
+            'bg_color': COLORS['light'],
+            'font_name': 'Helvetica Neue',
+            'border': 1,
+            'bold': True
+        })
+        self.formats['amount_positive'] = self.workbook.add_format({'font_color': COLORS['success']})
+        self.formats['amount_negative'] = self.workbook.add_format({'font_color': COLORS['danger']})
+        
         # Format date
         self.formats['date'] = self.workbook.add_format({
             'num_format': 'dd/mm/yyyy',
@@ -252,88 +1131,150 @@ class FinanceExporter:
 
     def create_monthly_sheets(self):
         """Crée un onglet pour chaque mois"""
-        for mois, transactions in self.transactions_data.items():
-            worksheet = self.workbook.add_worksheet(name=mois[:31])
-            
-            # Titre du mois
-            worksheet.merge_range('A1:E1', f'📊 {mois} - Transactions', self.formats['title'])
-            worksheet.set_row(0, 30)
-            
-            # En-têtes
-            headers = ["📝 Titre", "🏷️ Catégorie", "💰 Montant", "📅 Date", "🆔 ID"]
-            worksheet.write_row(2, 0, headers, self.formats['header'])
-            worksheet.set_row(2, 25)
-            
-            # Données des transactions
-            for row_idx, trans in enumerate(transactions, start=3):
-                worksheet.write(row_idx, 0, trans['title'], self.formats['normal'])
-                worksheet.write(row_idx, 1, trans['category'], self.formats['normal'])
-                
-                # Formatage conditionnel pour les montants
-                amount_format = self.formats['currency_positive'] if trans['amount'] >= 0 else self.formats['currency_negative']
-                worksheet.write(row_idx, 2, trans['amount'], amount_format)
-                
-                worksheet.write(row_idx, 3, trans['date'], self.formats['date'])
-                worksheet.write(row_idx, 4, trans['id'], self.formats['normal'])
-            
-            # Formatage des colonnes
-            worksheet.set_column('A:A', 35)
-            worksheet.set_column('B:B', 20)
-            worksheet.set_column('C:C', 15)
-            worksheet.set_column('D:D', 15)
-            worksheet.set_column('E:E', 38)
+        for periode, transactions in self.transactions_data.items():
+            # Un mois déversé sur disque n'est relu que le temps d'écrire son onglet
+            if self.budget:
+                transactions = self.budget.restore(transactions)
+            worksheet = self._add_month_sheet(periode)
+            self._write_transaction_rows(worksheet, 3, transactions)
+            self._format_amount_column(worksheet, 3, 2 + len(transactions))
             
             # Statistiques et graphiques
-            self._add_monthly_analytics(worksheet, mois, transactions)
+            self._add_monthly_analytics(worksheet, self._month_label(periode), self.monthly_stats[periode],
+                                        len(transactions) + 5)
+
+    def stream_monthly_sheets(self):
+        """Écrit les onglets mensuels au fil des blocs reçus du curseur serveur"""
+        for chunk in self.iter_transaction_chunks():
+            self._inspect(chunk)
+            with self.metrics.stage("organize"):
+                buckets = self._bucket_transactions(chunk)
+            for periode, transactions in buckets.items():
+                worksheet = self.monthly_sheets.get(periode) or self._add_month_sheet(periode)
+                first_row = 3 + self.sheet_rows.get(periode, 0)
+                self._write_transaction_rows(worksheet, first_row, transactions)
+                self.sheet_rows[periode] = self.sheet_rows.get(periode, 0) + len(transactions)
+                if not self.sql_aggregates:
+                    self._accumulate_monthly_stats(periode, transactions)
+                self._observe(periode, transactions)
+        
+        # Les analyses ne dépendent que des agrégats : elles sont écrites une fois le flux terminé
+        for periode, worksheet in self.monthly_sheets.items():
+            self._format_amount_column(worksheet, 3, 2 + self.sheet_rows[periode])
+            self._add_monthly_analytics(worksheet, self._month_label(periode), self.monthly_stats[periode],
+                                        self.sheet_rows[periode] + 5)
+
+    def _add_month_sheet(self, periode):
+        """Crée l'onglet d'un mois avec son titre, ses en-têtes et ses colonnes"""
+        mois = self._month_label(periode)
+        worksheet = self.workbook.add_worksheet(name=mois[:31])
+        self.monthly_sheets[periode] = worksheet
+        
+        # Titre du mois
+        worksheet.merge_range('A1:E1', f'📊 {mois} - Transactions', self.formats['title'])
+        worksheet.set_row(0, 30)
+        
+        # En-têtes
+        headers = ["📝 Titre", "🏷️ Catégorie", "💰 Montant", "📅 Date", "🆔 ID"]
+        worksheet.write_row(2, 0, headers, self.formats['header'])
+        worksheet.set_row(2, 25)
+        
+        # Formatage des colonnes
+        worksheet.set_column('A:A', 35)
+        worksheet.set_column('B:B', 20)
+        worksheet.set_column('C:C', 15)
+        worksheet.set_column('D:D', 15)
+        worksheet.set_column('E:E', 38)
+        
+        return worksheet
 
-    def _add_monthly_analytics(self, worksheet, mois, transactions):
-        """Ajoute les analyses mensuelles"""
-        # Calcul des totaux par catégorie
-        categorie_totaux = defaultdict(float)
-        for trans in transactions:
-            categorie_totaux[trans['category']] += abs(trans['amount'])
+    def _write_transaction_rows(self, worksheet, first_row, transactions):
+        """Écrit les lignes de transactions à partir de la ligne donnée
+        
+        Les écritures sont typées (sans détection du type de chaque valeur) et restent
+        ligne par ligne pour le mode constant_memory ; aucun format n'est choisi par ligne.
+        """
+        write_string = worksheet.write_string
+        write_number = worksheet.write_number
+        normal = self.formats['normal']
+        amount_format = self.formats['amount']
+        date_format = self.formats['date']
+        
+        # Les colonnes sont décodées d'un bloc : dictionnaires, centimes, numéros de série Excel, UUID
+        import numpy as np
+        serials = (transactions.dates - np.datetime64(EXCEL_EPOCH, "D")).astype('float64')
+        rows = zip(
+            np.asarray(transactions.titles).tolist(),
+            np.asarray(transactions.categories).tolist(),
+            transactions.amounts_euros().tolist(),
+            serials.tolist(),
+            transactions.id_strings().tolist(),
+        )
+        for row_idx, (title, category, amount, serial, trans_id) in enumerate(rows, start=first_row):
+            write_string(row_idx, 0, title, normal)
+            write_string(row_idx, 1, category, normal)
+            write_number(row_idx, 2, amount, amount_format)
+            write_number(row_idx, 3, serial, date_format)
+            write_string(row_idx, 4, trans_id, normal)
 
-        categories = list(categorie_totaux.keys())
-        valeurs = list(categorie_totaux.values())
+    def _format_amount_column(self, worksheet, first_row, last_row, col=2):
+        """Colore les montants (revenus en vert, dépenses en rouge) par formats conditionnels"""
+        if last_row < first_row:
+            return
+        
+        worksheet.conditional_format(first_row, col, last_row, col, {
+            'type': 'cell', 'criteria': '>=', 'value': 0, 'format': self.formats['amount_positive'],
+        })
+        worksheet.conditional_format(first_row, col, last_row, col, {
+            'type': 'cell', 'criteria': '<', 'value': 0, 'format': self.formats['amount_negative'],
+        })
+
+    def _add_monthly_analytics(self, worksheet, mois, stats, start_row):
+        """Ajoute les analyses mensuelles sous les lignes de transactions
+        
+        Les cellules sont écrites ligne par ligne (répartition et bilan côte à côte),
+        ce qu'exige le mode constant_memory de xlsxwriter.
+        """
+        categories = list(stats['categories'].keys())
+        valeurs = list(stats['categories'].values())
 
         if not categories:
             return
-
-        start_row = len(transactions) + 5
         
-        # Section catégories
+        # Titres des sections catégories et bilan mensuel
         worksheet.merge_range(start_row, 6, start_row, 7, 
                              f"📊 Répartition par Catégorie", 
                              self.formats['subheader'])
-        
-        worksheet.write(start_row + 1, 6, "Catégorie", self.formats['header'])
-        worksheet.write(start_row + 1, 7, "Montant", self.formats['header'])
-        
-        for idx, (categorie, valeur) in enumerate(zip(categories, valeurs)):
-            worksheet.write(start_row + 2 + idx, 6, categorie, self.formats['normal'])
-            worksheet.write(start_row + 2 + idx, 7, valeur, self.formats['currency'])
-        
-        # Bilan mensuel
         worksheet.merge_range(start_row, 9, start_row, 11, 
                              f"💼 Bilan du Mois", 
                              self.formats['subheader'])
         
+        # En-têtes
+        worksheet.write(start_row + 1, 6, "Catégorie", self.formats['header'])
+        worksheet.write(start_row + 1, 7, "Montant", self.formats['header'])
         worksheet.write(start_row + 1, 9, "💸 Total Dépenses", self.formats['header'])
         worksheet.write(start_row + 1, 10, "💵 Total Revenus", self.formats['header'])
         worksheet.write(start_row + 1, 11, "⚖️ Balance", self.formats['header'])
         
-        total_depenses = sum(t['amount'] for t in transactions if t['amount'] < 0)
-        total_revenus = sum(t['amount'] for t in transactions if t['amount'] > 0)
-        balance = total_revenus + total_depenses
+        # Bilan (sur la ligne de la première catégorie)
+        total_depenses = stats['depenses']
+        total_revenus = stats['revenus']
+        balance = total_revenus - total_depenses
         
-        worksheet.write(start_row + 2, 9, abs(total_depenses), self.formats['currency_negative'])
+        worksheet.write(start_row + 2, 9, total_depenses, self.formats['currency_negative'])
         worksheet.write(start_row + 2, 10, total_revenus, self.formats['currency_positive'])
         
         balance_format = self.formats['currency_positive'] if balance >= 0 else self.formats['currency_negative']
         worksheet.write(start_row + 2, 11, balance, balance_format)
         
+        # Répartition par catégorie
+        for idx, (categorie, valeur) in enumerate(zip(categories, valeurs)):
+            worksheet.write(start_row + 2 + idx, 6, categorie, self.formats['normal'])
+            worksheet.write(start_row + 2 + idx, 7, valeur, self.formats['currency'])
+        
         # Graphique
-        self._create_category_chart(worksheet, mois, categories, valeurs, start_row, 'G3')
+        with self.metrics.stage("charts"):
+            self._create_category_chart(worksheet, mois, categories, valeurs, start_row, 'G3')
 
     def _create_category_chart(self, worksheet, mois, categories, valeurs, data_row, position):
         """Crée un graphique moderne pour les catégories"""
@@ -384,18 +1325,15 @@ class FinanceExporter:
         worksheet.write_row(2, 0, headers, self.formats['header'])
         worksheet.set_row(2, 25)
         
-        # Données
-        total_mensuel = 0
+        # Données (écritures typées : toutes les colonnes sont NOT NULL)
+        normal = self.formats['normal']
         for row_idx, sub in enumerate(self.subscriptions_data, start=3):
-            worksheet.write(row_idx, 0, sub['label'], self.formats['normal'])
-            worksheet.write(row_idx, 1, float(sub['amount']), self.formats['currency'])
-            worksheet.write(row_idx, 2, sub['date'], self.formats['date'])
-            worksheet.write(row_idx, 3, sub['recurrence'], self.formats['normal'])
-            worksheet.write(row_idx, 4, sub['rating'], self.formats['normal'])
-            worksheet.write(row_idx, 5, str(sub['id']), self.formats['normal'])
-            
-            if sub['recurrence'].lower() == 'mensuel':
-                total_mensuel += float(sub['amount'])
+            worksheet.write_string(row_idx, 0, sub['label'], normal)
+            worksheet.write_number(row_idx, 1, float(sub['amount']), self.formats['currency'])
+            worksheet.write_datetime(row_idx, 2, sub['date'], self.formats['date'])
+            worksheet.write_string(row_idx, 3, sub['recurrence'], normal)
+            worksheet.write_number(row_idx, 4, sub['rating'], normal)
+            worksheet.write_string(row_idx, 5, str(sub['id']), normal)
         
         # Formatage
         worksheet.set_column('A:A', 35)
@@ -411,21 +1349,23 @@ class FinanceExporter:
                              "📊 Statistiques d'Abonnements", 
                              self.formats['subheader'])
         
-        worksheet.write(start_row + 1, 0, "Total Mensuel Récurrent", self.formats['stat_label'])
-        worksheet.write(start_row + 1, 1, f"{total_mensuel:.2f} €", self.formats['stat_value'])
+        worksheet.write(start_row + 1, 0, f"Coût Mensuel Projeté ({self.projection_months} mois)", self.formats['stat_label'])
+        worksheet.write(start_row + 1, 1, f"{self.subscription_stats['total_mensuel']:.2f} €", self.formats['stat_value'])
         
         worksheet.write(start_row + 2, 0, "Nombre d'Abonnements Actifs", self.formats['stat_label'])
-        worksheet.write(start_row + 2, 1, len(self.subscriptions_data), self.formats['stat_value'])
+        worksheet.write(start_row + 2, 1, self.subscription_stats['count'], self.formats['stat_value'])
+        
+        if self.subscription_stats['non_reconnues']:
+            worksheet.write(start_row + 3, 0, "Récurrences Non Reconnues", self.formats['stat_label'])
+            worksheet.write(start_row + 3, 1, self.subscription_stats['non_reconnues'], self.formats['stat_value'])
         
         # Graphique
-        self._create_subscriptions_chart(worksheet, start_row)
+        with self.metrics.stage("charts"):
+            self._create_subscriptions_chart(worksheet, start_row)
 
     def _create_subscriptions_chart(self, worksheet, data_start_row):
-        """Crée le graphique des abonnements"""
-        recurrence_totals = defaultdict(float)
-        for sub in self.subscriptions_data:
-            recurrence_totals[sub['recurrence']] += float(sub['amount'])
-        
+        """Crée le graphique du coût mensuel projeté par récurrence"""
+        recurrence_totals = self.subscription_stats['recurrences']
         recurrences = list(recurrence_totals.keys())
         amounts = list(recurrence_totals.values())
         
@@ -435,7 +1375,7 @@ class FinanceExporter:
         # Écrire les données
         start_row = data_start_row + 5
         worksheet.write(start_row, 3, "Type", self.formats['header'])
-        worksheet.write(start_row, 4, "Montant Total", self.formats['header'])
+        worksheet.write(start_row, 4, "Coût Mensuel", self.formats['header'])
         
         for idx, (recurrence, amount) in enumerate(zip(recurrences, amounts)):
             worksheet.write(start_row + 1 + idx, 3, recurrence, self.formats['normal'])
@@ -444,7 +1384,7 @@ class FinanceExporter:
         # Graphique
         chart = self.workbook.add_chart({'type': 'pie'})
         chart.add_series({
-            'name': 'Abonnements par Type',
+            'name': 'Coût mensuel par récurrence',
             'categories': [worksheet.get_name(), start_row + 1, 3, start_row + len(recurrences), 3],
             'values': [worksheet.get_name(), start_row + 1, 4, start_row + len(recurrences), 4],
             'data_labels': {
@@ -457,7 +1397,7 @@ class FinanceExporter:
         })
         
         chart.set_title({
-            'name': '💳 Répartition des Abonnements par Type',
+            'name': '💳 Coût Mensuel Projeté par Récurrence',
             'name_font': {'bold': True, 'size': 14, 'color': COLORS['primary'], 'name': 'Helvetica Neue'}
         })
         
@@ -466,20 +1406,90 @@ class FinanceExporter:
         
         worksheet.insert_chart('G3', chart)
 
+    def create_projection_sheet(self):
+        """Crée l'onglet de projection des prélèvements : coût par mois et récurrence, puis par utilisateur"""
+        from projection import RECURRENCES
+        projection = self.subscription_projection
+        worksheet = self.workbook.add_worksheet("🔮 Projection")
+        
+        worksheet.set_row(0, 30)
+        worksheet.merge_range('A1:E1', f'🔮 Prélèvements Projetés sur {len(projection.months)} Mois', self.formats['title'])
+        
+        # Coût de chaque mois de l'horizon, par récurrence (écrit ligne par ligne pour constant_memory)
+        headers = ["📅 Mois"] + [RECURRENCE_LABELS[recurrence] for recurrence in RECURRENCES] + ["💰 Total"]
+        worksheet.set_row(2, 25)
+        worksheet.write_row(2, 0, headers, self.formats['header'])
+        
+        couts = projection.by_recurrence / 100
+        totaux = projection.monthly_totals() / 100
+        for idx, mois in enumerate(projection.months.tolist()):
+            row = 3 + idx
+            worksheet.write_string(row, 0, self._month_label((mois.year, mois.month)), self.formats['normal'])
+            for col, cout in enumerate(couts[:, idx].tolist(), start=1):
+                worksheet.write_number(row, col, cout, self.formats['currency'])
+            worksheet.write_number(row, len(RECURRENCES) + 1, float(totaux[idx]), self.formats['currency'])
+        
+        with self.metrics.stage("charts"):
+            self._create_projection_chart(worksheet, len(projection.months))
+        
+        # Coût par utilisateur, du plus élevé au plus faible
+        start_row = len(projection.months) + 5
+        worksheet.merge_range(start_row, 0, start_row, 3, "👥 Coût Projeté par Utilisateur", self.formats['subheader'])
+        worksheet.write_row(start_row + 1, 0, ["🆔 Utilisateur", "Abonnements", "Coût Mensuel Moyen",
+                                               f"Total sur {len(projection.months)} Mois"], self.formats['header'])
+        
+        import numpy as np
+        ordre = np.argsort(-projection.by_user, kind='stable')
+        lignes = zip(projection.user_ids[ordre].tolist(), projection.count_by_user[ordre].tolist(),
+                     (projection.by_user[ordre] / 100).tolist())
+        for row, (user_id, nb, total) in enumerate(lignes, start=start_row + 2):
+            worksheet.write_string(row, 0, user_id, self.formats['normal'])
+            worksheet.write_number(row, 1, nb, self.formats['normal'])
+            worksheet.write_number(row, 2, total / len(projection.months), self.formats['currency'])
+            worksheet.write_number(row, 3, total, self.formats['currency'])
+        
+        worksheet.set_column('A:A', 38)
+        worksheet.set_column('B:E', 18)
+
+    def _create_projection_chart(self, worksheet, nb_mois):
+        """Crée l'histogramme empilé du coût projeté par mois et par récurrence"""
+        from projection import RECURRENCES
+        chart = self.workbook.add_chart({'type': 'column', 'subtype': 'stacked'})
+        
+        for col, recurrence in enumerate(RECURRENCES, start=1):
+            chart.add_series({
+                'name': [worksheet.get_name(), 2, col],
+                'categories': [worksheet.get_name(), 3, 0, 2 + nb_mois, 0],
+                'values': [worksheet.get_name(), 3, col, 2 + nb_mois, col],
+                'fill': {'color': COLORS['chart_colors'][col - 1]},
+            })
+        
+        chart.set_title({
+            'name': '🔮 Prélèvements Projetés par Mois',
+            'name_font': {'bold': True, 'size': 14, 'color': COLORS['primary'], 'name': 'Helvetica Neue'}
+        })
+        chart.set_y_axis({'name': 'Montant (€)', 'name_font': {'bold': True, 'size': 11}})
+        chart.set_legend({'position': 'top', 'font': {'bold': True, 'size': 10}})
+        chart.set_style(11)
+        chart.set_size({'width': 720, 'height': 400})
+        
+        worksheet.insert_chart('G3', chart)
+
     def create_summary_sheet(self):
         """Crée l'onglet de synthèse"""
         worksheet = self.workbook.add_worksheet("📈 SYNTHÈSE")
         
         # Titre principal avec date
+        # Hauteurs définies avant l'écriture : en mode constant_memory, une ligne écrite est figée
         date_rapport = datetime.now().strftime("%d/%m/%Y à %H:%M")
+        worksheet.set_row(0, 35)
+        worksheet.set_row(1, 20)
         worksheet.merge_range('A1:G1', 
                              f'📊 SYNTHÈSE FINANCIÈRE COMPLÈTE', 
                              self.formats['title'])
         worksheet.merge_range('A2:G2', 
                              f'Généré le {date_rapport}', 
                              self.formats['header'])
-        worksheet.set_row(0, 35)
-        worksheet.set_row(1, 20)
         
         # Statistiques globales
         self._add_comprehensive_stats(worksheet)
@@ -489,34 +1499,43 @@ class FinanceExporter:
 
     def _add_comprehensive_stats(self, worksheet):
         """Ajoute des statistiques complètes"""
-        all_transactions = []
-        for transactions in self.transactions_data.values():
-            all_transactions.extend(transactions)
+        all_stats = list(self.monthly_stats.values())
+        nb_transactions = sum(stats['count'] for stats in all_stats)
         
-        if not all_transactions:
+        if not nb_transactions:
             return
         
-        total_depenses = sum(t['amount'] for t in all_transactions if t['amount'] < 0)
-        total_revenus = sum(t['amount'] for t in all_transactions if t['amount'] > 0)
-        balance_finale = total_revenus + total_depenses
+        total_depenses = sum(stats['depenses'] for stats in all_stats)
+        total_revenus = sum(stats['revenus'] for stats in all_stats)
+        balance_finale = total_revenus - total_depenses
         
-        avg_depense = abs(total_depenses) / len([t for t in all_transactions if t['amount'] < 0]) if any(t['amount'] < 0 for t in all_transactions) else 0
-        avg_revenu = total_revenus / len([t for t in all_transactions if t['amount'] > 0]) if any(t['amount'] > 0 for t in all_transactions) else 0
+        nb_depenses = sum(stats['nb_depenses'] for stats in all_stats)
+        nb_revenus = sum(stats['nb_revenus'] for stats in all_stats)
+        avg_depense = total_depenses / nb_depenses if nb_depenses else 0
+        avg_revenu = total_revenus / nb_revenus if nb_revenus else 0
         
         # Titre de section
         worksheet.merge_range('A4:B4', '💼 VUE D\'ENSEMBLE FINANCIÈRE', self.formats['subheader'])
         
         stats = [
             ("💵 Total des Revenus", f"{total_revenus:,.2f} €", self.formats['currency_positive']),
-            ("💸 Total des Dépenses", f"{abs(total_depenses):,.2f} €", self.formats['currency_negative']),
+            ("💸 Total des Dépenses", f"{total_depenses:,.2f} €", self.formats['currency_negative']),
             ("⚖️ Balance Finale", f"{balance_finale:,.2f} €", 
              self.formats['currency_positive'] if balance_finale >= 0 else self.formats['currency_negative']),
-            ("📊 Nombre de Transactions", str(len(all_transactions)), self.formats['stat_value']),
-            ("💳 Nombre d'Abonnements", str(len(self.subscriptions_data)), self.formats['stat_value']),
+            ("📊 Nombre de Transactions", str(nb_transactions), self.formats['stat_value']),
+            ("💳 Nombre d'Abonnements", str(self.subscription_stats['count'] if self.subscription_stats else 0),
+             self.formats['stat_value']),
             ("📉 Dépense Moyenne", f"{avg_depense:,.2f} €", self.formats['stat_value']),
             ("📈 Revenu Moyen", f"{avg_revenu:,.2f} €", self.formats['stat_value']),
         ]
         
+        # Médiane issue des sketches : seulement si toutes les lignes ont été lues
+        if self.insights and self.insights.depenses.count:
+            mediane = self.insights.depenses.quantiles([0.5])[0] / 100
+            stats.append(("📐 Dépense Médiane", f"{mediane:,.2f} €", self.formats['stat_value']))
+        if self.controls:
+            stats.append(("🧪 Doublons Détectés", str(self.controls.same_day + self.controls.near), self.formats['stat_value']))
+        
         row = 5
         for label, value, value_format in stats:
             worksheet.write(row, 0, label, self.formats['stat_label'])
@@ -526,10 +1545,320 @@ class FinanceExporter:
         worksheet.set_column('A:A', 30)
         worksheet.set_column('B:B', 20)
 
+    def create_shards_sheet(self):
+        """Crée l'onglet index du mode fragmenté : un lien vers chaque classeur et les totaux de ses mois"""
+        worksheet = self.workbook.add_worksheet("🗂️ Classeurs")
+        
+        worksheet.set_row(0, 30)
+        worksheet.merge_range('A1:H1', '🗂️ Index des Classeurs', self.formats['title'])
+        headers = ["📁 Classeur", "📅 Période", "📊 Transactions", "💸 Dépenses", "💵 Revenus", "⚖️ Balance",
+                   "⏱️ Durée (s)", "Statut"]
+        worksheet.set_row(2, 25)
+        worksheet.write_row(2, 0, headers, self.formats['header'])
+        
+        # Totaux tirés des agrégats de l'index : ils ne dépendent pas de la réussite des classeurs
+        row = 3
+        for shard in self.shards:
+            stats = [self.monthly_stats[periode] for periode in shard['periods'] if periode in self.monthly_stats]
+            depenses = round(sum(mois['depenses'] for mois in stats), 2)
+            revenus = round(sum(mois['revenus'] for mois in stats), 2)
+            if shard['path']:
+                # Lien relatif : l'index et les classeurs restent ensemble dans le même dossier
+                nom = os.path.basename(shard['path'])
+                worksheet.write_url(row, 0, f"external:{nom}", string=nom)
+            else:
+                worksheet.write_string(row, 0, shard['label'], self.formats['normal'])
+            worksheet.write_string(row, 1, f"{self._month_label(min(shard['periods']))} - "
+                                           f"{self._month_label(max(shard['periods']))}", self.formats['normal'])
+            worksheet.write_number(row, 2, sum(mois['count'] for mois in stats), self.formats['normal'])
+            worksheet.write_number(row, 3, depenses, self.formats['currency_negative'])
+            worksheet.write_number(row, 4, revenus, self.formats['currency_positive'])
+            worksheet.write_number(row, 5, revenus - depenses,
+                                   self.formats['currency_positive'] if revenus >= depenses else self.formats['currency_negative'])
+            worksheet.write_number(row, 6, shard['seconds'], self.formats['normal'])
+            worksheet.write_string(row, 7, shard['status'], self.formats['normal'])
+            row += 1
+        
+        worksheet.set_column('A:A', 40)
+        worksheet.set_column('B:B', 32)
+        worksheet.set_column('C:G', 16)
+        worksheet.set_column('H:H', 20)
+
+    def create_insights_sheet(self):
+        """Crée l'onglet Insights : quantiles des montants par catégorie et titres les plus fréquents"""
+        from sketches import QUANTILES
+        insights = self.insights
+        worksheet = self.workbook.add_worksheet("🔎 Insights")
+        
+        worksheet.set_row(0, 30)
+        worksheet.merge_range('A1:F1', '🔎 Insights - Distribution des Montants', self.formats['title'])
+        
+        # Quantiles des montants (valeurs absolues) : dépenses, revenus puis chaque catégorie
+        headers = ["🏷️ Catégorie", "Transactions", "Médiane", "P90", "P99", "Maximum"]
+        worksheet.set_row(2, 25)
+        worksheet.write_row(2, 0, headers, self.formats['header'])
+        
+        categories = sorted(insights.categories.items(), key=lambda item: -item[1].count)
+        lignes = [("💸 Toutes dépenses", insights.depenses, self.formats['stat_label']),
+                  ("💵 Tous revenus", insights.revenus, self.formats['stat_label'])]
+        lignes += [(categorie, sketch, self.formats['normal']) for categorie, sketch in categories]
+        
+        row = 3
+        for libelle, sketch, label_format in lignes:
+            if not sketch.count:
+                continue
+            worksheet.write_string(row, 0, libelle, label_format)
+            worksheet.write_number(row, 1, sketch.count, self.formats['normal'])
+            for col, valeur in enumerate(sketch.quantiles(QUANTILES) + [sketch.max], start=2):
+                worksheet.write_number(row, col, valeur / 100, self.formats['currency'])
+            row += 1
+        first_category_row = row - len(categories)
+        
+        with self.metrics.stage("charts"):
+            self._create_insights_chart(worksheet, first_category_row, row - 1)
+        
+        # Titres les plus fréquents (comptes exacts tant que les titres distincts tiennent dans le sketch)
+        start_row = row + 2
+        worksheet.merge_range(start_row, 0, start_row, 2, "🏆 Titres les Plus Fréquents", self.formats['subheader'])
+        worksheet.write_row(start_row + 1, 0, ["Rang", "📝 Titre", "Occurrences"], self.formats['header'])
+        top = insights.titles.top(20)
+        for rang, (titre, nb) in enumerate(top, start=1):
+            worksheet.write_number(start_row + 1 + rang, 0, rang, self.formats['normal'])
+            worksheet.write_string(start_row + 1 + rang, 1, titre, self.formats['normal'])
+            worksheet.write_number(start_row + 1 + rang, 2, nb, self.formats['normal'])
+        if insights.titles.error:
+            worksheet.write_string(start_row + len(top) + 3, 0,
+                                   f"Occurrences estimées : sous-évaluées d'au plus {insights.titles.error} "
+                                   f"sur {insights.titles.total} transactions", self.formats['normal'])
+        
+        worksheet.set_column('A:A', 28)
+        worksheet.set_column('B:B', 35)
+        worksheet.set_column('C:F', 15)
+
+    def _create_insights_chart(self, worksheet, first_row, last_row):
+        """Crée l'histogramme horizontal de la médiane et du P90 par catégorie"""
+        if last_row < first_row:
+            return
+        
+        chart = self.workbook.add_chart({'type': 'bar'})
+        for col, color in ((2, COLORS['chart_colors'][0]), (3, COLORS['chart_colors'][1])):
+            chart.add_series({
+                'name': [worksheet.get_name(), 2, col],
+                'categories': [worksheet.get_name(), first_row, 0, last_row, 0],
+                'values': [worksheet.get_name(), first_row, col, last_row, col],
+                'fill': {'color': color},
+            })
+        
+        chart.set_title({
+            'name': '🔎 Médiane et P90 par Catégorie',
+            'name_font': {'bold': True, 'size': 14, 'color': COLORS['primary'], 'name': 'Helvetica Neue'}
+        })
+        chart.set_x_axis({'name': 'Montant (€)', 'name_font': {'bold': True, 'size': 11}})
+        chart.set_legend({'position': 'top', 'font': {'bold': True, 'size': 10}})
+        chart.set_style(10)
+        chart.set_size({'width': 640, 'height': max(360, 24 * (last_row - first_row + 1))})
+        
+        worksheet.insert_chart('H3', chart)
+
+    def create_controls_sheet(self):
+        """Crée l'onglet Contrôles : doublons (même jour et jours proches) et montants atypiques par catégorie
+        
+        Les deux listes sont côte à côte et écrites ligne par ligne, pour le mode constant_memory.
+        """
+        import numpy as np
+        from itertools import zip_longest
+        from controls import IQR_FACTOR
+        controls = self.controls
+        doublons = controls.duplicate_rows()
+        atypiques = controls.outliers(self.insights.categories)
+        worksheet = self.workbook.add_worksheet("🧪 Contrôles")
+        
+        worksheet.set_row(0, 30)
+        worksheet.merge_range('A1:H1', '🧪 Contrôles - Doublons et Montants Atypiques', self.formats['title'])
+        
+        resume = [("🔁 Doublons le même jour", controls.same_day)]
+        if controls.tolerance:
+            resume.append((f"🔂 Doublons proches (≤ {controls.tolerance} j)", controls.near))
+        resume.append((f"🚨 Montants atypiques (> Q3 + {IQR_FACTOR:g} × IQR)", len(atypiques)))
+        for row, (libelle, valeur) in enumerate(resume, start=2):
+            worksheet.write_string(row, 0, libelle, self.formats['stat_label'])
+            worksheet.write(row, 1, valeur, self.formats['stat_value'])
+        
+        # Doublons (A:H) et montants atypiques (J:Q)
+        start_row = len(resume) + 3
+        worksheet.merge_range(start_row, 0, start_row, 7, "🔁 Doublons", self.formats['subheader'])
+        worksheet.merge_range(start_row, 9, start_row, 16, "🚨 Montants Atypiques", self.formats['subheader'])
+        worksheet.write_row(start_row + 1, 0, ["📅 Date", "📝 Titre", "🏷️ Catégorie", "💰 Montant", "🆔 Doublon",
+                                               "🆔 Original", "⏱️ Écart (j)", "Type"], self.formats['header'])
+        worksheet.write_row(start_row + 1, 9, ["📅 Date", "📝 Titre", "🏷️ Catégorie", "💰 Montant", "📐 Seuil",
+                                               "📊 Médiane", "Z-score", "🆔 ID"], self.formats['header'])
+        
+        # Jours depuis 1970 vers numéros de série Excel
+        decalage = (np.datetime64("1970-01-01", "D") - np.datetime64(EXCEL_EPOCH, "D")).astype('float64')
+        lignes_doublons = zip((doublons['day'].to_numpy(dtype='float64') + decalage).tolist(),
+                              doublons['title'].tolist(), doublons['category'].tolist(),
+                              (doublons['amount'].to_numpy() / 100).tolist(), doublons['id'].tolist(),
+                              doublons['original'].tolist(), doublons['gap'].tolist())
+        lignes_atypiques = zip((atypiques['day'].to_numpy(dtype='float64') + decalage).tolist(),
+                               atypiques['title'].tolist(), atypiques['category'].tolist(),
+                               (atypiques['amount'].to_numpy() / 100).tolist(),
+                               (atypiques['fence'].to_numpy() / 100).tolist(),
+                               (atypiques['median'].to_numpy() / 100).tolist(),
+                               atypiques['zscore'].round(1).tolist(), atypiques['id'].tolist())
+        
+        normal = self.formats['normal']
+        date_format = self.formats['date']
+        amount_format = self.formats['amount']
+        currency = self.formats['currency']
+        row = start_row + 2
+        for doublon, atypique in zip_longest(lignes_doublons, lignes_atypiques):
+            if doublon:
+                serial, titre, categorie, montant, id_doublon, id_original, ecart = doublon
+                worksheet.write_number(row, 0, serial, date_format)
+                worksheet.write(row, 1, titre, normal)
+                worksheet.write(row, 2, categorie, normal)
+                worksheet.write_number(row, 3, montant, amount_format)
+                worksheet.write_string(row, 4, id_doublon, normal)
+                worksheet.write_string(row, 5, id_original, normal)
+                worksheet.write_number(row, 6, ecart, normal)
+                worksheet.write_string(row, 7, "même jour" if ecart == 0 else "proche", normal)
+            if atypique:
+                serial, titre, categorie, montant, seuil, mediane, zscore, trans_id = atypique
+                worksheet.write_number(row, 9, serial, date_format)
+                worksheet.write(row, 10, titre, normal)
+                worksheet.write(row, 11, categorie, normal)
+                worksheet.write_number(row, 12, montant, amount_format)
+                worksheet.write_number(row, 13, seuil, currency)
+                worksheet.write_number(row, 14, mediane, currency)
+                worksheet.write_number(row, 15, zscore, normal)
+                worksheet.write_string(row, 16, trans_id, normal)
+            row += 1
+        
+        self._format_amount_column(worksheet, start_row + 2, start_row + 1 + len(doublons), col=3)
+        self._format_amount_column(worksheet, start_row + 2, start_row + 1 + len(atypiques), col=12)
+        worksheet.set_column('A:A', 12)
+        worksheet.set_column('B:B', 30)
+        worksheet.set_column('C:D', 15)
+        worksheet.set_column('E:F', 38)
+        worksheet.set_column('G:H', 12)
+        worksheet.set_column('J:J', 12)
+        worksheet.set_column('K:K', 30)
+        worksheet.set_column('L:O', 15)
+        worksheet.set_column('P:P', 10)
+        worksheet.set_column('Q:Q', 38)
+
+    def create_time_series_sheet(self, series):
+        """Crée l'onglet des séries temporelles : quotidien, hebdomadaire et variation mensuelle par catégorie
+        
+        Les trois tableaux sont côte à côte sous le graphique ; ils sont écrits ligne par ligne,
+        ensemble, pour le mode constant_memory.
+        """
+        import numpy as np
+        from itertools import zip_longest
+        from timeseries import ROLLING_WINDOWS, month_over_month
+        worksheet = self.workbook.add_worksheet("📉 Séries Temporelles")
+        
+        worksheet.set_row(0, 30)
+        worksheet.merge_range('A1:F1', '📉 Séries Temporelles - Dépenses Glissantes et Balance', self.formats['title'])
+        
+        # Colonnes des trois tableaux : quotidien (A), hebdomadaire (H), variation mensuelle (M)
+        start_row = 25
+        with self.metrics.stage("charts"):
+            self._create_time_series_chart(worksheet, series, start_row + 2)
+        
+        variations = month_over_month(self.monthly_stats)
+        categories = variations.columns.tolist()
+        worksheet.merge_range(start_row, 0, start_row, 5, "📅 Quotidien", self.formats['subheader'])
+        worksheet.merge_range(start_row, 7, start_row, 10, "🗓️ Hebdomadaire", self.formats['subheader'])
+        worksheet.merge_range(start_row, 12, start_row, 12 + max(1, len(categories)),
+                              "📊 Variation par Catégorie vs Mois Précédent", self.formats['subheader'])
+        worksheet.write_row(start_row + 1, 0, ["📅 Jour", "💸 Dépenses", "💵 Revenus"]
+                            + [f"💸 {window} j glissants" for window in ROLLING_WINDOWS] + ["⚖️ Balance cumulée"],
+                            self.formats['header'])
+        worksheet.write_row(start_row + 1, 7, ["🗓️ Semaine du", "💸 Dépenses", "💵 Revenus", "⚖️ Balance cumulée"],
+                            self.formats['header'])
+        worksheet.write_row(start_row + 1, 12, ["📅 Mois"] + categories, self.formats['header'])
+        
+        # Colonnes décodées d'un bloc : numéros de série Excel et euros
+        epoch = np.datetime64(EXCEL_EPOCH, "D")
+        quotidien = zip(((series.days - epoch).astype('float64')).tolist(), (series.depenses / 100).tolist(),
+                        (series.revenus / 100).tolist(),
+                        *[(series.rolling[window] / 100).tolist() for window in ROLLING_WINDOWS],
+                        (series.balance / 100).tolist())
+        lundis, depenses, revenus, balances = series.weekly()
+        hebdomadaire = zip(((lundis - epoch).astype('float64')).tolist(), (depenses / 100).tolist(),
+                           (revenus / 100).tolist(), (balances / 100).tolist())
+        mensuel = zip(map(self._month_label, variations.index), variations.to_numpy().tolist())
+        
+        write_number = worksheet.write_number
+        date_format = self.formats['date']
+        currency = self.formats['currency']
+        amount_format = self.formats['amount']
+        row = start_row + 2
+        for jour, semaine, mois in zip_longest(quotidien, hebdomadaire, mensuel):
+            if jour:
+                write_number(row, 0, jour[0], date_format)
+                for col, valeur in enumerate(jour[1:], start=1):
+                    write_number(row, col, valeur, currency)
+            if semaine:
+                write_number(row, 7, semaine[0], date_format)
+                for col, valeur in enumerate(semaine[1:], start=8):
+                    write_number(row, col, valeur, currency)
+            if mois:
+                libelle, valeurs = mois
+                worksheet.write_string(row, 12, libelle, self.formats['normal'])
+                # Premier mois : aucune variation (NaN)
+                for col, valeur in enumerate(valeurs, start=13):
+                    if valeur == valeur:
+                        write_number(row, col, valeur, amount_format)
+            row += 1
+        
+        for col in range(13, 13 + len(categories)):
+            self._format_amount_column(worksheet, start_row + 3, start_row + 1 + len(variations), col)
+        
+        worksheet.set_column('A:A', 14)
+        worksheet.set_column('B:F', 17)
+        worksheet.set_column('H:H', 14)
+        worksheet.set_column('I:K', 17)
+        worksheet.set_column(12, 12 + len(categories), 16)
+
+    def _create_time_series_chart(self, worksheet, series, first_row):
+        """Crée le graphique en courbes des dépenses glissantes et de la balance cumulée (axe secondaire)"""
+        from timeseries import ROLLING_WINDOWS
+        
+        last_row = first_row + len(series) - 1
+        chart = self.workbook.add_chart({'type': 'line'})
+        for col, window in enumerate(ROLLING_WINDOWS, start=3):
+            chart.add_series({
+                'name': f'💸 Dépenses {window} j glissants',
+                'categories': [worksheet.get_name(), first_row, 0, last_row, 0],
+                'values': [worksheet.get_name(), first_row, col, last_row, col],
+                'line': {'color': COLORS['chart_colors'][col - 3], 'width': 1.5},
+            })
+        chart.add_series({
+            'name': '⚖️ Balance cumulée',
+            'categories': [worksheet.get_name(), first_row, 0, last_row, 0],
+            'values': [worksheet.get_name(), first_row, 3 + len(ROLLING_WINDOWS), last_row, 3 + len(ROLLING_WINDOWS)],
+            'line': {'color': COLORS['success'], 'width': 2},
+            'y2_axis': True,
+        })
+        
+        chart.set_title({
+            'name': '📉 Dépenses Glissantes et Balance Cumulée',
+            'name_font': {'bold': True, 'size': 16, 'color': COLORS['primary'], 'name': 'Helvetica Neue'}
+        })
+        chart.set_x_axis({'date_axis': True, 'num_format': 'mm/yyyy', 'major_unit': 1, 'major_unit_type': 'months'})
+        chart.set_y_axis({'name': 'Dépenses (€)', 'name_font': {'bold': True, 'size': 11}})
+        chart.set_y2_axis({'name': 'Balance (€)', 'name_font': {'bold': True, 'size': 11}})
+        chart.set_legend({'position': 'top', 'font': {'bold': True, 'size': 10}})
+        chart.set_size({'width': 1100, 'height': 450})
+        
+        worksheet.insert_chart('A3', chart)
+
     def _add_trend_analysis(self, worksheet):
         """Ajoute l'analyse de tendance mensuelle"""
-        months = sorted(self.transactions_data.keys(), 
-                       key=lambda x: list(MOIS_TRADUCTION.values()).index(x))
+        # Les clés (année, mois) se trient chronologiquement
+        months = sorted(self.monthly_stats.keys())
         
         if not months:
             return
@@ -539,10 +1868,10 @@ class FinanceExporter:
         revenus_mensuels = []
         balances_mensuelles = []
         
-        for mois in months:
-            transactions = self.transactions_data[mois]
-            depenses = abs(sum(t['amount'] for t in transactions if t['amount'] < 0))
-            revenus = sum(t['amount'] for t in transactions if t['amount'] > 0)
+        for periode in months:
+            stats = self.monthly_stats[periode]
+            depenses = stats['depenses']
+            revenus = stats['revenus']
             balance = revenus - depenses
             
             depenses_mensuelles.append(depenses)
@@ -559,8 +1888,8 @@ class FinanceExporter:
         for col, header in enumerate(headers):
             worksheet.write(start_row, col, header, self.formats['header'])
         
-        for i, mois in enumerate(months):
-            worksheet.write(start_row + 1 + i, 0, mois, self.formats['normal'])
+        for i, periode in enumerate(months):
+            worksheet.write(start_row + 1 + i, 0, self._month_label(periode), self.formats['normal'])
             worksheet.write(start_row + 1 + i, 1, depenses_mensuelles[i], self.formats['currency_negative'])
             worksheet.write(start_row + 1 + i, 2, revenus_mensuels[i], self.formats['currency_positive'])
             
@@ -568,7 +1897,8 @@ class FinanceExporter:
             worksheet.write(start_row + 1 + i, 3, balances_mensuelles[i], balance_format)
         
         # Graphique combiné
-        self._create_trend_chart(worksheet, months, depenses_mensuelles, revenus_mensuels, start_row)
+        with self.metrics.stage("charts"):
+            self._create_trend_chart(worksheet, months, depenses_mensuelles, revenus_mensuels, start_row)
 
     def _create_trend_chart(self, worksheet, months, depenses, revenus, data_row):
         """Crée un graphique de tendance sophistiqué"""
@@ -613,75 +1943,604 @@ class FinanceExporter:
         
         worksheet.insert_chart('E4', chart)
 
-    def generate_report(self):
-        """Génère le rapport complet"""
-        print("\n" + "="*60)
-        print("🚀 GÉNÉRATEUR DE RAPPORT FINANCIER".center(60))
-        print("="*60 + "\n")
-        
-        # Récupération des données
-        print("📊 Récupération des données...")
-        transactions_df = self.fetch_transactions()
-        subscriptions_df = self.fetch_subscriptions()
-        
-        if not self.transactions_data and not self.subscriptions_data:
+    def generate_report(self, filename=None, fetch=True, output=None):
+        """Génère le rapport complet
+        
+        Retourne le chemin du classeur, ses nombres de lignes et les mesures de l'exécution,
+        ou None s'il n'y avait rien à exporter. `output` choisit une autre destination que le
+        fichier `filename` (voir sinks.py : mémoire, flux, rappel, formats csv et jsonl). Avec
+        fetch=False, le rapport est rendu à partir des données déjà en mémoire (mode démon).
+        """
+        profiler = Profiler(self.profile_path) if self.profile_path else None
+        if profiler:
+            profiler.start()
+        try:
+            with self.metrics.run():
+                result = self._generate_report(filename, fetch, output)
+        finally:
+            if profiler:
+                profiler.stop()
+        
+        if result:
+            result['metrics'] = self.metrics.to_dict()
+            self._print_stage_timings()
+        if self.metrics_path:
+            self.metrics.write(self.metrics_path)
+            self._print(f"📏 Mesures: {self.metrics_path}")
+        return result
+
+    def _generate_report(self, filename, fetch=True, output=None):
+        """Enchaîne récupération, onglets et écriture du classeur, chaque étape chronométrée"""
+        self._print("\n" + "="*60)
+        self._print("🚀 GÉNÉRATEUR DE RAPPORT FINANCIER".center(60))
+        self._print("="*60 + "\n")
+        
+        if self.budget:
+            from memory import current_rss
+            self._print(f"🧮 Budget mémoire: {self.budget.max_bytes / 2**20:.0f} Mo "
+                        f"(RSS actuel {current_rss() / 2**20:.0f} Mo)")
+        
+        # Récupération des données (en mode flux, les transactions sont lues pendant l'écriture)
+        fetch_rows = False
+        if fetch:
+            self._print("📊 Récupération des données...")
+            with self.metrics.stage("fetch"):
+                fetch_rows = self.fetch_data()
+        
+        if not self.streaming and not self.monthly_stats and not self.subscriptions_data:
             self._print_error("Aucune donnée à exporter")
-            return
-        
-        # Création du fichier
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"rapport_financier_{timestamp}.xlsx"
+            return None
         
-        print(f"\n📄 Création du fichier: {filename}")
-        self.workbook = xlsxwriter.Workbook(filename)
+        # Destination : fichier horodaté par défaut
+        from sinks import FileSink
+        sink = output
+        if sink is None:
+            if filename is None:
+                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+                filename = f"rapport_financier_{timestamp}.xlsx"
+            sink = FileSink(filename)
+        
+        self._print(f"\n📄 Création du fichier: {sink.name}")
+        if sink.format == "xlsx":
+            self._write_workbook(sink, fetch_rows)
+        else:
+            with self.metrics.stage("data_export"):
+                self._write_data_export(sink, fetch_rows)
+        
+        if not self.monthly_stats and not self.subscriptions_data:
+            sink.discard()
+            self._print_error("Aucune donnée à exporter")
+            return None
+        sink.close()
+        
+        transactions = sum(stats['count'] for stats in self.monthly_stats.values())
+        self.metrics.count('transactions', transactions)
+        self.metrics.count('subscriptions', len(self.subscriptions_data))
+        self.metrics.count('monthly_sheets', len(self.monthly_sheets))
+        self.metrics.count('bytes_written', sink.bytes_written)
+        if self.budget:
+            self.metrics.count('memory_budget_bytes', self.budget.max_bytes)
+            self.metrics.count('spilled_months', self.budget.spilled)
+            self.metrics.count('spilled_bytes', self.budget.spilled_bytes)
+        
+        self._print("\n" + "="*60)
+        self._print("✅ RAPPORT GÉNÉRÉ AVEC SUCCÈS".center(60))
+        self._print("="*60)
+        self._print(f"\n📁 Fichier: {sink.name}")
+        if sink.format == "xlsx":
+            self._print("\n📋 Contenu du rapport:")
+            self._print("   ✓ Onglets mensuels détaillés avec graphiques")
+            self._print("   ✓ Analyse par catégorie de dépenses")
+            self._print("   ✓ Gestion complète des abonnements")
+            self._print("   ✓ Synthèse financière globale")
+            self._print("   ✓ Graphiques de tendance et statistiques")
+            self._print("   ✓ Formatage conditionnel des montants")
+        self._print("\n" + "="*60 + "\n")
+        
+        return {
+            'path': sink.path,
+            'format': sink.format,
+            'content': sink.content,
+            'transactions': transactions,
+            'subscriptions': len(self.subscriptions_data),
+        }
+
+    def _write_workbook(self, sink, fetch_rows):
+        """Écrit le classeur XLSX (onglets mensuels, synthèse, abonnements, projection) dans la destination"""
+        self.workbook = sink.workbook({'constant_memory': self.constant_memory})
+        # Onglets et formats appartiennent au classeur : un exporteur peut en rendre plusieurs
+        self.monthly_sheets = {}
+        self.sheet_rows = {}
+        self.formats = {}
         self.initialize_formats()
         
         # Génération des onglets
-        if self.transactions_data:
-            print("📅 Génération des onglets mensuels...")
-            self.create_monthly_sheets()
-            print("📈 Création de la synthèse globale...")
-            self.create_summary_sheet()
+        with self.metrics.stage("monthly_sheets"):
+            if fetch_rows and self.streaming:
+                self._print(f"📅 Génération des onglets mensuels en flux (blocs de {self.itersize} lignes)...")
+                self.stream_monthly_sheets()
+            elif self.transactions_data:
+                self._print("📅 Génération des onglets mensuels...")
+                self.create_monthly_sheets()
+        
+        self._finish_row_pass()
+        self.insights = self._merged_sketch()
+        self.controls = self._merged_controls()
+        
+        if self.monthly_stats:
+            self._print("📈 Création de la synthèse globale...")
+            with self.metrics.stage("summary_sheet"):
+                self.create_summary_sheet()
+        
+        if self.shards:
+            self._print("🗂️ Création de l'index des classeurs...")
+            with self.metrics.stage("shards_sheet"):
+                self.create_shards_sheet()
+        
+        if self.insights:
+            self._print("🔎 Création de l'onglet Insights (quantiles et titres fréquents)...")
+            with self.metrics.stage("insights_sheet"):
+                self.create_insights_sheet()
+        
+        if self.controls and self.insights:
+            self._print("🧪 Création de l'onglet Contrôles (doublons et montants atypiques)...")
+            with self.metrics.stage("controls_sheet"):
+                self.create_controls_sheet()
+        
+        series = self._time_series()
+        if series is not None:
+            self._print("📉 Création de l'onglet Séries temporelles (quotidien, hebdomadaire, variations)...")
+            with self.metrics.stage("timeseries_sheet"):
+                self.create_time_series_sheet(series)
         
         if self.subscriptions_data:
-            print("💳 Création de l'onglet abonnements...")
-            self.create_subscriptions_sheet()
+            self._print("💳 Création de l'onglet abonnements...")
+            with self.metrics.stage("subscriptions_sheet"):
+                self.create_subscriptions_sheet()
+            self._print(f"🔮 Projection des prélèvements sur {self.projection_months} mois...")
+            with self.metrics.stage("projection_sheet"):
+                self.create_projection_sheet()
         
         # Finalisation
-        self.workbook.close()
-        
-        print("\n" + "="*60)
-        print("✅ RAPPORT GÉNÉRÉ AVEC SUCCÈS".center(60))
-        print("="*60)
-        print(f"\n📁 Fichier: {filename}")
-        print("\n📋 Contenu du rapport:")
-        print("   ✓ Onglets mensuels détaillés avec graphiques")
-        print("   ✓ Analyse par catégorie de dépenses")
-        print("   ✓ Gestion complète des abonnements")
-        print("   ✓ Synthèse financière globale")
-        print("   ✓ Graphiques de tendance et statistiques")
-        print("   ✓ Formatage conditionnel des montants")
-        print("\n" + "="*60 + "\n")
+        with self.metrics.stage("workbook_close"):
+            self.workbook.close()
+
+    def _finish_row_pass(self):
+        """Après la lecture des lignes : mise à jour du cache et fermeture du snapshot"""
+        if self.cache and self.refresh_periods is not None:
+            with self.metrics.stage("cache_update"):
+                self.update_cache()
+        
+        if self.snapshot:
+            self.snapshot.close()
+            self._print(f"💾 Snapshot enregistré: {self.snapshot.path} ({self.snapshot.transactions} transactions)")
+
+    def _write_data_export(self, sink, fetch_rows):
+        """Écrit les transactions en CSV, ou transactions, mois et abonnements en JSON lines, sans classeur
+        
+        Les lignes sont groupées par mois comme dans les onglets mensuels ; en mode flux, chaque
+        bloc du curseur serveur est encodé et envoyé dès sa réception.
+        """
+        import sinks
+        
+        def write_rows(transactions):
+            if sink.format == "csv":
+                sink.write(sinks.transactions_csv(transactions))
+            else:
+                sink.write(sinks.transactions_jsonl(transactions))
+        
+        if sink.format == "csv":
+            sink.write((",".join(f'"{field}"' for field in sinks.TRANSACTION_FIELDS) + "\n").encode())
+        
+        if fetch_rows and self.streaming:
+            self._print(f"📤 Export {sink.format} en flux (blocs de {self.itersize} lignes)...")
+            for chunk in self.iter_transaction_chunks():
+                self._inspect(chunk)
+                with self.metrics.stage("organize"):
+                    buckets = self._bucket_transactions(chunk)
+                for periode, transactions in buckets.items():
+                    write_rows(transactions)
+                    if not self.sql_aggregates:
+                        self._accumulate_monthly_stats(periode, transactions)
+                    self._observe(periode, transactions)
+        else:
+            self._print(f"📤 Export {sink.format}...")
+            for transactions in self.transactions_data.values():
+                write_rows(self.budget.restore(transactions) if self.budget else transactions)
+        
+        self._finish_row_pass()
+        
+        # Le CSV ne porte que les transactions ; le JSON lines y ajoute agrégats et abonnements
+        if sink.format == "jsonl":
+            sink.write(sinks.records_jsonl("mois", (
+                {'mois': f"{annee}-{mois:02d}", **stats} for (annee, mois), stats in self.monthly_stats.items())))
+            sink.write(sinks.records_jsonl("abonnement", self.subscriptions_data))
+
+    @staticmethod
+    def _new_monthly_stats():
+        """Agrégats vides d'un mois"""
+        return {
+            'count': 0,
+            'categories': defaultdict(float),
+            'depenses': 0.0,
+            'revenus': 0.0,
+            'nb_depenses': 0,
+            'nb_revenus': 0,
+        }
+
+    @staticmethod
+    def _add_cents(total, centimes):
+        """Ajoute des centimes à un montant en euros sans accumuler d'erreur d'arrondi"""
+        return (round(total * 100) + centimes) / 100
+
+    @staticmethod
+    def _month_label(periode):
+        """Libellé d'un mois (année, mois), par exemple « Janvier 2025 »"""
+        annee, mois = periode
+        return f"{MOIS_PAR_NUMERO[mois]} {annee}"
 
     @staticmethod
-    def _print_success(message):
+    def _period_bounds(periode):
+        """Bornes [début, fin[ d'un mois (année, mois)"""
+        annee, mois = periode
+        debut = date(annee, mois, 1)
+        fin = date(annee + 1, 1, 1) if mois == 12 else date(annee, mois + 1, 1)
+        return debut, fin
+
+    def _print_stage_timings(self):
+        """Affiche la durée de chaque étape de premier niveau"""
+        stages = self.metrics.stages
+        durees = ", ".join(f"{name} {stages[name]['seconds']:.2f}s" for name in stages
+                           if 'peak_rss_bytes' in stages[name] and name != 'total')
+        self._print(f"⏱️  {durees} (total {stages['total']['seconds']:.2f}s, "
+                    f"pic RSS {self.metrics.to_dict()['peak_rss_bytes'] / 1e6:.0f} Mo)")
+
+    def _print(self, message):
+        """Affiche un message de progression (muet en mode lot)"""
+        if self.verbose:
+            print(message)
+
+    def _print_success(self, message):
         """Affiche un message de succès"""
-        print(f"✅ {message}")
+        self._print(f"✅ {message}")
     
     @staticmethod
     def _print_error(message):
         """Affiche un message d'erreur"""
         print(f"❌ {message}")
 
+# Pool de connexions propre à chaque processus du mode lot
+_worker_pool = None
+
+def _init_batch_worker(pool_size):
+    """Ouvre les connexions d'un processus du lot, réutilisées pour tous ses utilisateurs"""
+    global _worker_pool
+    _worker_pool = create_connection_pool(pool_size)
+
+def _generate_user_report(user_id, path, options):
+    """Génère le classeur d'un utilisateur dans un processus du lot"""
+    start = time.perf_counter()
+    result, status = None, "ok"
+    try:
+        with FinanceExporter(user_id=user_id, pool=_worker_pool, verbose=False, **options) as exporter:
+            result = exporter.generate_report(path)
+        if result is None:
+            status = "vide"
+    except Exception as e:
+        status = f"erreur: {e}"
+    
+    return {
+        'user_id': user_id,
+        'path': result['path'] if result else None,
+        'transactions': result['transactions'] if result else 0,
+        'subscriptions': result['subscriptions'] if result else 0,
+        'seconds': round(time.perf_counter() - start, 3),
+        'status': status,
+        'metrics': result['metrics'] if result else None,
+    }
+
+def report_path(output_dir, user_id, since=None, until=None):
+    """Chemin déterministe du classeur d'un utilisateur pour une période"""
+    name = f"rapport_financier_{user_id}"
+    if since or until:
+        name += f"_{since or 'debut'}_{until or 'fin'}"
+    return os.path.join(output_dir, f"{name}.xlsx")
+
+def run_batch(output_dir, jobs, options):
+    """Génère un classeur par utilisateur sur un pool de processus et écrit le manifeste du lot"""
+    start = time.perf_counter()
+    
+    # Le pool du processus parent est fermé avant de forker : les connexions libpq ne se partagent pas
+    with FinanceExporter(pool_size=1) as exporter:
+        user_ids = exporter.fetch_user_ids()
+    print(f"👥 {len(user_ids)} utilisateurs à exporter sur {jobs} processus")
+    
+    os.makedirs(output_dir, exist_ok=True)
+    paths = [report_path(output_dir, user_id, options.get('since'), options.get('until')) for user_id in user_ids]
+    
+    # Des lots de plusieurs utilisateurs par envoi amortissent le coût de communication entre processus
+    from concurrent.futures import ProcessPoolExecutor
+    chunksize = max(1, math.ceil(len(user_ids) / (jobs * 4)))
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_batch_worker,
+                             initargs=(required_pool_size(options.get('pool_size', POOL_SIZE),
+                                                          options.get('parallel_fetch', 1)),)) as executor:
+        reports = list(executor.map(_generate_user_report, user_ids, paths, repeat(options), chunksize=chunksize))
+    
+    manifest = {
+        'generated_at': datetime.now().isoformat(timespec="seconds"),
+        'since': str(options['since']) if options.get('since') else None,
+        'until': str(options['until']) if options.get('until') else None,
+        'jobs': jobs,
+        'seconds': round(time.perf_counter() - start, 3),
+        'reports': reports,
+    }
+    manifest_path = os.path.join(output_dir, "manifest.json")
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    
+    generated = sum(1 for report in reports if report['status'] == "ok")
+    failed = sum(1 for report in reports if report['status'].startswith("erreur"))
+    print(f"✅ {generated} classeurs générés, {failed} en erreur, en {manifest['seconds']:.1f} s")
+    print(f"📁 Manifeste: {manifest_path}")
+    return manifest
+
+def shard_key(periode, shard):
+    """Tranche d'un mois (année, mois) : (année,) ou (année, trimestre)"""
+    annee, mois = periode
+    return (annee,) if shard == "year" else (annee, (mois - 1) // 3 + 1)
+
+def shard_path(output_dir, key, user_id=None):
+    """Chemin du classeur d'une tranche, par exemple rapport_financier_2024-T3.xlsx"""
+    name = "rapport_financier" + (f"_{user_id}" if user_id else "")
+    name += f"_{key[0]}" + (f"-T{key[1]}" if len(key) > 1 else "")
+    return os.path.join(output_dir, f"{name}.xlsx")
+
+def _generate_shard(periodes, path, options):
+    """Génère le classeur des mois d'une tranche dans un processus du pool"""
+    start = time.perf_counter()
+    result, status = None, "ok"
+    try:
+        with FinanceExporter(pool=_worker_pool, verbose=False, periods=periodes, include_subscriptions=False,
+                             **options) as exporter:
+            result = exporter.generate_report(path)
+        if result is None:
+            status = "vide"
+    except Exception as e:
+        status = f"erreur: {e}"
+    
+    return {
+        'path': result['path'] if result else None,
+        'transactions': result['transactions'] if result else 0,
+        'seconds': round(time.perf_counter() - start, 3),
+        'status': status,
+    }
+
+def run_sharded(output_dir, shard, jobs, options):
+    """Génère un classeur par année ou par trimestre sur un pool de processus, puis le classeur index
+    
+    L'index porte la synthèse de toute la période (agrégats calculés par PostgreSQL), les séries
+    temporelles, les abonnements et un lien vers chaque classeur.
+    """
+    start = time.perf_counter()
+    user_id = options.get('user_id')
+    
+    # Agrégats et abonnements de l'index, sans lecture de lignes ; le pool est fermé avant de forker
+    index = FinanceExporter(user_id=user_id, since=options.get('since'), until=options.get('until'),
+                            skip_monthly_sheets=True, pool_size=options.get('pool_size', POOL_SIZE),
+                            projection_months=options.get('projection_months', PROJECTION_MONTHS))
+    with index:
+        index.fetch_data()
+    if not index.monthly_stats:
+        index._print_error("Aucune transaction à exporter")
+        return None
+    
+    tranches = {}
+    for periode in index.monthly_stats:
+        tranches.setdefault(shard_key(periode, shard), []).append(periode)
+    keys = sorted(tranches)
+    print(f"🧩 {len(keys)} classeurs ({'années' if shard == 'year' else 'trimestres'}) sur {jobs} processus")
+    
+    os.makedirs(output_dir, exist_ok=True)
+    # Les tranches les plus lourdes partent en premier : la dernière à finir est une petite
+    ordre = sorted(keys, key=lambda key: -sum(index.monthly_stats[p]['count'] for p in tranches[key]))
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_batch_worker,
+                             initargs=(required_pool_size(options.get('pool_size', POOL_SIZE),
+                                                          options.get('parallel_fetch', 1)),)) as executor:
+        futures = {key: executor.submit(_generate_shard, tranches[key], shard_path(output_dir, key, user_id), options)
+                   for key in ordre}
+        reports = {key: future.result() for key, future in futures.items()}
+    
+    index.shards = [{'label': "-T".join(map(str, key)), 'periods': tranches[key], **reports[key]} for key in keys]
+    index_path = shard_path(output_dir, ("index",), user_id)
+    index.generate_report(index_path, fetch=False)
+    
+    generated = sum(1 for report in reports.values() if report['status'] == "ok")
+    failed = sum(1 for report in reports.values() if report['status'].startswith("erreur"))
+    print(f"✅ {generated} classeurs générés, {failed} en erreur, en {time.perf_counter() - start:.1f} s")
+    print(f"🗂️ Index: {index_path}")
+    return index.shards
+
+def report_output(path, format, stream=None):
+    """Destination du rapport de la ligne de commande (None : classeur horodaté par défaut)"""
+    from sinks import FileSink, StreamSink
+    if stream is not None:
+        return StreamSink(stream, format)
+    if path is None and format == "xlsx":
+        return None
+    return FileSink(path or f"rapport_financier_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{format}", format)
+
+def parse_args(argv=None):
+    """Analyse les options de la ligne de commande"""
+    parser = argparse.ArgumentParser(description="Générateur de rapports financiers Excel")
+    parser.add_argument("--user-id", help="limite l'export aux données d'un utilisateur (UUID)")
+    parser.add_argument("--since", type=date.fromisoformat, metavar="AAAA-MM-JJ",
+                        help="première date de transaction incluse")
+    parser.add_argument("--until", type=date.fromisoformat, metavar="AAAA-MM-JJ",
+                        help="dernière date de transaction incluse")
+    parser.add_argument("--output", metavar="FICHIER",
+                        help="fichier du rapport, ou - pour la sortie standard (défaut: rapport_financier_<horodatage>)")
+    parser.add_argument("--format", choices=("xlsx", "csv", "jsonl"), default="xlsx",
+                        help="classeur Excel, ou transactions en CSV / JSON lines sans classeur (défaut: xlsx)")
+    parser.add_argument("--check-config", action="store_true",
+                        help="vérifie DATABASE_URL et la connexion à PostgreSQL, puis quitte")
+    parser.add_argument("--create-indexes", action="store_true",
+                        help="crée les index (user_id, created_at) manquants avant l'export")
+    parser.add_argument("--batch", action="store_true",
+                        help="génère un classeur par utilisateur de la table users (pool de processus)")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(),
+                        help="processus du mode lot ou du mode fragmenté (défaut: nombre de cœurs)")
+    parser.add_argument("--output-dir", default="rapports",
+                        help="dossier des classeurs du mode lot (et de son manifeste), du mode fragmenté "
+                             "ou du démon (défaut: rapports)")
+    parser.add_argument("--shard", choices=("year", "quarter"),
+                        help="un classeur par année ou par trimestre (processus en parallèle) et un classeur index")
+    parser.add_argument("--daemon", action="store_true",
+                        help="reste actif : données tenues à jour par LISTEN/NOTIFY, classeur rendu à chaque demande")
+    parser.add_argument("--install-triggers", action="store_true",
+                        help="installe les triggers qui notifient le démon des écritures sur transactions et subscriptions")
+    parser.add_argument("--snapshot", metavar="DOSSIER",
+                        help="enregistre les données récupérées dans un snapshot Parquet")
+    parser.add_argument("--from-snapshot", metavar="DOSSIER",
+                        help="construit le rapport depuis un snapshot, sans connexion PostgreSQL")
+    parser.add_argument("--ingestion", choices=INGESTION_MODES, default="read_sql",
+                        help="lecture des lignes : curseur DB-API (read_sql) ou COPY ... TO STDOUT en CSV (copy)")
+    parser.add_argument("--parallel-fetch", type=int, default=1, metavar="N",
+                        help="lit les transactions en N plages de dates en parallèle, dans un même instantané")
+    parser.add_argument("--streaming", action="store_true",
+                        help="lit les transactions par blocs via un curseur serveur (mémoire constante)")
+    parser.add_argument("--constant-memory", action="store_true",
+                        help="écrit le classeur ligne par ligne sans le garder en mémoire (implicite avec --streaming)")
+    parser.add_argument("--itersize", type=int, default=STREAMING_ITERSIZE,
+                        help=f"taille des blocs du curseur serveur (défaut: {STREAMING_ITERSIZE})")
+    parser.add_argument("--max-memory", type=int, metavar="MO",
+                        help="budget mémoire : blocs de lecture adaptés à la mémoire résidente, mois terminés "
+                             "déversés sur disque, classeur en constant_memory")
+    parser.add_argument("--pool-size", type=int, default=POOL_SIZE,
+                        help=f"connexions PostgreSQL ouvertes pour l'export (défaut: {POOL_SIZE})")
+    parser.add_argument("--cache", metavar="FICHIER",
+                        help="cache SQLite des agrégats mensuels : seuls les mois nouveaux ou modifiés sont relus")
+    parser.add_argument("--sql-aggregates", action="store_true",
+                        help="calcule les agrégats (synthèse, catégories, abonnements) dans PostgreSQL")
+    parser.add_argument("--no-monthly-sheets", action="store_true",
+                        help="n'écrit pas les onglets mensuels détaillés (implique --sql-aggregates)")
+    parser.add_argument("--monthly-sheets-max-rows", type=int, metavar="N",
+                        help="omet les onglets mensuels au-delà de N transactions (implique --sql-aggregates)")
+    parser.add_argument("--projection-months", type=int, default=PROJECTION_MONTHS, metavar="N",
+                        help=f"horizon de la projection des prélèvements d'abonnements (défaut: {PROJECTION_MONTHS} mois)")
+    parser.add_argument("--duplicate-tolerance", type=int, default=DUPLICATE_TOLERANCE, metavar="JOURS",
+                        help=f"écart maximal en jours entre deux transactions identiques signalées comme doublon "
+                             f"(défaut: {DUPLICATE_TOLERANCE}, le même jour seulement)")
+    parser.add_argument("--metrics", metavar="FICHIER",
+                        help="écrit la durée et la mémoire de chaque étape en JSON, ou pour Prometheus (.prom)")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="relève aussi le pic d'allocations Python de chaque étape (tracemalloc, plus lent)")
+    parser.add_argument("--profile", metavar="FICHIER",
+                        help="profile l'export : cProfile (.pstats) ou pyinstrument (.html)")
+    args = parser.parse_args(argv)
+    
+    # Le périmètre d'un rapport hors ligne est celui du snapshot
+    if args.from_snapshot and (args.user_id or args.since or args.until or args.batch or args.create_indexes):
+        parser.error("--from-snapshot ne se combine pas avec --user-id, --since, --until, --batch ni --create-indexes")
+    if args.snapshot and args.batch:
+        parser.error("--snapshot n'est pas disponible en mode lot")
+    # En mode lot, les mesures de chaque classeur sont dans le manifeste
+    if (args.metrics or args.profile) and args.batch:
+        parser.error("--metrics et --profile ne sont pas disponibles en mode lot (mesures dans manifest.json)")
+    # Le démon garde toutes les lignes du périmètre en mémoire et les relit mois par mois
+    if args.daemon and (args.batch or args.streaming or args.cache or args.snapshot or args.from_snapshot
+                        or args.monthly_sheets_max_rows is not None):
+        parser.error("--daemon ne se combine pas avec --batch, --streaming, --cache, --snapshot, "
+                     "--from-snapshot ni --monthly-sheets-max-rows")
+    # Chaque classeur fragmenté relit ses mois : il ne part ni d'un cache ni d'un snapshot
+    if args.shard and (args.batch or args.daemon or args.cache or args.snapshot or args.from_snapshot
+                       or args.no_monthly_sheets):
+        parser.error("--shard ne se combine pas avec --batch, --daemon, --cache, --snapshot, "
+                     "--from-snapshot ni --no-monthly-sheets")
+    if (args.metrics or args.profile) and args.shard:
+        parser.error("--metrics et --profile ne sont pas disponibles en mode fragmenté")
+    if (args.output or args.format != "xlsx") and (args.batch or args.daemon or args.shard):
+        parser.error("--output et --format ne concernent que l'export d'un seul rapport")
+    if args.max_memory is not None and (args.max_memory < 1 or args.daemon or args.parallel_fetch > 1
+                                        or args.ingestion == "copy"):
+        parser.error("--max-memory doit être positif et ne se combine ni avec --daemon, ni avec --parallel-fetch, "
+                     "ni avec --ingestion copy")
+    if args.duplicate_tolerance < 0:
+        parser.error("--duplicate-tolerance ne peut pas être négatif")
+    if args.projection_months < 1:
+        parser.error("--projection-months doit valoir au moins 1")
+    return args
+
 def main():
     """Fonction principale avec gestion des erreurs améliorée"""
+    args = parse_args()
+    # Rapport écrit sur la sortie standard : les messages passent sur la sortie d'erreur
+    if args.output == "-":
+        report_stream = sys.stdout.buffer
+        with redirect_stdout(sys.stderr):
+            _main(args, report_stream)
+    else:
+        _main(args)
+
+def _main(args, report_stream=None):
+    """Exécute la commande demandée"""
     try:
         print("\n" + "🌟"*30)
         print("     FINANCE EXPORTER - Générateur de Rapports Pro     ".center(60))
         print("🌟"*30 + "\n")
         
-        exporter = FinanceExporter()
-        exporter.generate_report()
+        options = dict(
+            since=args.since,
+            until=args.until,
+            streaming=args.streaming,
+            itersize=args.itersize,
+            cache_path=args.cache,
+            sql_aggregates=args.sql_aggregates,
+            skip_monthly_sheets=args.no_monthly_sheets,
+            monthly_sheets_max_rows=args.monthly_sheets_max_rows,
+            pool_size=args.pool_size,
+            constant_memory=args.constant_memory,
+            snapshot_path=args.snapshot,
+            from_snapshot=args.from_snapshot,
+            ingestion=args.ingestion,
+            parallel_fetch=args.parallel_fetch,
+            trace_memory=args.trace_memory,
+            projection_months=args.projection_months,
+            max_memory=args.max_memory * 1024 * 1024 if args.max_memory else None,
+            duplicate_tolerance=args.duplicate_tolerance,
+        )
+        
+        if args.check_config:
+            with FinanceExporter(pool_size=1) as exporter:
+                if not exporter.check_connection():
+                    raise SystemExit(1)
+            return
+        
+        if args.batch:
+            run_batch(args.output_dir, args.jobs, options)
+            return
+        
+        if args.shard:
+            run_sharded(args.output_dir, args.shard, args.jobs, {**options, 'user_id': args.user_id})
+            return
+        
+        if args.daemon or args.install_triggers:
+            from daemon import ExportDaemon
+            with FinanceExporter(user_id=args.user_id, metrics_path=args.metrics, profile_path=args.profile,
+                                 **options) as exporter:
+                daemon = ExportDaemon(exporter, args.output_dir)
+                if args.install_triggers and not daemon.install_triggers():
+                    raise SystemExit(1)
+                if args.daemon:
+                    daemon.run()
+            return
+        
+        with FinanceExporter(user_id=args.user_id, metrics_path=args.metrics, profile_path=args.profile,
+                             **options) as exporter:
+            # Un export ciblé n'est rapide que si l'index (user_id, created_at) existe
+            if args.create_indexes or args.user_id:
+                exporter.check_indexes(create=args.create_indexes)
+            exporter.generate_report(output=report_output(args.output, args.format, report_stream))
         
     except KeyboardInterrupt:
         print("\n\n⚠️  Opération annulée par l'utilisateur")
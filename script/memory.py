@@ -0,0 +1,96 @@
+"""Budget mémoire d'un export (--max-memory) : RSS surveillé, blocs adaptés, mois déversés sur disque.
+
+Les lignes sont lues par blocs sur un curseur serveur ou dans un snapshot. Après chaque bloc,
+la mémoire résidente du processus est relevée : sous la moitié du budget, le bloc suivant
+double ; au-delà de 80 %, il est divisé par deux et les mois terminés (la requête trie les
+lignes par date décroissante) sont déversés dans un dossier temporaire, d'où ils ne sont relus que le temps d'écrire leur
+onglet. Le classeur est écrit en mode constant_memory : ses lignes partent aussi sur disque.
+"""
+import os
+import pickle
+import shutil
+import tempfile
+
+# Seuils en fraction du budget : déversement et réduction des blocs, croissance des blocs
+SPILL_RATIO = 0.8
+GROW_RATIO = 0.5
+MIN_CHUNK = 1000
+MAX_CHUNK = 200_000
+
+
+def current_rss():
+    """Mémoire résidente actuelle du processus, en octets (/proc, sinon pic relevé par getrusage)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class SpilledPartition:
+    """Lignes d'un mois déversées sur disque"""
+    __slots__ = ("path", "rows", "nbytes")
+
+    def __init__(self, path, rows, nbytes):
+        self.path = path
+        self.rows = rows
+        self.nbytes = nbytes
+
+    def __len__(self):
+        return self.rows
+
+
+class MemoryBudget:
+    def __init__(self, max_bytes, chunk_size):
+        self.max_bytes = max_bytes
+        self.chunk_size = min(max(chunk_size, MIN_CHUNK), MAX_CHUNK)
+        self.peak_rss = current_rss()
+        self.spill_dir = None
+        self.spilled = 0
+        self.spilled_bytes = 0
+
+    @property
+    def under_pressure(self):
+        return self.observe() >= SPILL_RATIO * self.max_bytes
+
+    def observe(self):
+        """Relève la mémoire résidente (et son pic depuis le début de l'export)"""
+        rss = current_rss()
+        self.peak_rss = max(self.peak_rss, rss)
+        return rss
+
+    def next_chunk_size(self):
+        """Taille du bloc suivant : doublée loin du budget, divisée par deux près de lui"""
+        rss = self.observe()
+        if rss >= SPILL_RATIO * self.max_bytes:
+            self.chunk_size = max(MIN_CHUNK, self.chunk_size // 2)
+        elif rss < GROW_RATIO * self.max_bytes:
+            self.chunk_size = min(MAX_CHUNK, self.chunk_size * 2)
+        return self.chunk_size
+
+    def spill(self, periode, transactions):
+        """Écrit les lignes d'un mois dans le dossier temporaire ; renvoie ce qui les remplace en mémoire"""
+        if self.spill_dir is None:
+            self.spill_dir = tempfile.mkdtemp(prefix="finance_exporter_")
+        annee, mois = periode
+        path = os.path.join(self.spill_dir, f"{annee}-{mois:02d}.pickle")
+        with open(path, "wb") as f:
+            pickle.dump(transactions, f, protocol=pickle.HIGHEST_PROTOCOL)
+        self.spilled += 1
+        self.spilled_bytes += transactions.nbytes
+        return SpilledPartition(path, len(transactions), transactions.nbytes)
+
+    @staticmethod
+    def restore(transactions):
+        """Lignes d'un mois, relues depuis le disque s'il a été déversé"""
+        if not isinstance(transactions, SpilledPartition):
+            return transactions
+        with open(transactions.path, "rb") as f:
+            return pickle.load(f)
+
+    def close(self):
+        """Supprime les mois déversés"""
+        if self.spill_dir is not None:
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
+            self.spill_dir = None
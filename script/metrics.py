@@ -0,0 +1,150 @@
+"""Mesures d'exécution d'un export : durée et mémoire par étape, volumes, profilage.
+
+Chaque étape de generate_report est chronométrée (durée cumulée et nombre d'appels).
+Les étapes de premier niveau relèvent aussi le pic de RSS du processus et, si
+tracemalloc est activé, le pic d'allocations Python pendant l'étape. Le relevé est
+écrit en JSON ou au format textfile de Prometheus (fichier `.prom`).
+"""
+import os
+import json
+import time
+import cProfile
+import resource
+import threading
+import tracemalloc
+from datetime import datetime
+from contextlib import contextmanager
+
+PROMETHEUS_PREFIX = "finance_exporter"
+
+
+def _peak_rss():
+    """Pic de mémoire résidente du processus, en octets (ru_maxrss est en Ko sous Linux)"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class RunMetrics:
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.started_at = datetime.now().isoformat(timespec="seconds")
+        self.stages = {}
+        self.counts = {}
+        self._depth = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        """Chronomètre une étape ; les appels répétés (ou concurrents) d'une même étape s'additionnent"""
+        with self._lock:
+            top_level = self._depth == 0
+            self._depth += 1
+        if top_level and self.trace_memory:
+            tracemalloc.reset_peak()
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            with self._lock:
+                self._depth -= 1
+                entry = self.stages.setdefault(name, {'seconds': 0.0, 'calls': 0})
+                entry['seconds'] += duration
+                entry['calls'] += 1
+                if top_level:
+                    entry['peak_rss_bytes'] = _peak_rss()
+                    if self.trace_memory:
+                        entry['tracemalloc_peak_bytes'] = tracemalloc.get_traced_memory()[1]
+
+    def count(self, name, value):
+        """Enregistre un volume (lignes, onglets, octets écrits)"""
+        with self._lock:
+            self.counts[name] = value
+
+    @contextmanager
+    def run(self):
+        """Mesure l'export entier (étape "total") ; les étapes qu'il contient sont de premier niveau"""
+        started_tracing = self.trace_memory and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages['total'] = {'seconds': time.perf_counter() - start, 'calls': 1,
+                                    'peak_rss_bytes': _peak_rss()}
+            if self.trace_memory:
+                self.stages['total']['tracemalloc_peak_bytes'] = tracemalloc.get_traced_memory()[1]
+            if started_tracing:
+                tracemalloc.stop()
+
+    def to_dict(self):
+        return {
+            'started_at': self.started_at,
+            'stages': {name: dict(entry) for name, entry in self.stages.items()},
+            'counts': dict(self.counts),
+            'peak_rss_bytes': _peak_rss(),
+        }
+
+    def write(self, path):
+        """Écrit le relevé en JSON, ou au format textfile de Prometheus pour un fichier .prom"""
+        content = self.to_prometheus() if path.endswith(".prom") else json.dumps(self.to_dict(), indent=2) + "\n"
+
+        # Écriture atomique : le collecteur textfile peut lire le fichier à tout moment
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+    def to_prometheus(self):
+        lines = []
+
+        def metric(name, help_text, samples):
+            lines.append(f"# HELP {PROMETHEUS_PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {PROMETHEUS_PREFIX}_{name} gauge")
+            for labels, value in samples:
+                lines.append(f"{PROMETHEUS_PREFIX}_{name}{labels} {value}")
+
+        metric("stage_seconds", "Durée cumulée de chaque étape de l'export.",
+               [(f'{{stage="{name}"}}', round(entry['seconds'], 6)) for name, entry in self.stages.items()])
+        metric("stage_peak_rss_bytes", "Pic de RSS du processus à la fin de l'étape.",
+               [(f'{{stage="{name}"}}', entry['peak_rss_bytes'])
+                for name, entry in self.stages.items() if 'peak_rss_bytes' in entry])
+        if self.trace_memory:
+            metric("stage_tracemalloc_peak_bytes", "Pic des allocations Python pendant l'étape.",
+                   [(f'{{stage="{name}"}}', entry['tracemalloc_peak_bytes'])
+                    for name, entry in self.stages.items() if 'tracemalloc_peak_bytes' in entry])
+        metric("count", "Volumes de l'export (lignes, onglets, octets écrits).",
+               [(f'{{name="{name}"}}', value) for name, value in self.counts.items()])
+        metric("peak_rss_bytes", "Pic de RSS du processus.", [("", _peak_rss())])
+        return "\n".join(lines) + "\n"
+
+
+class Profiler:
+    """Profilage d'un export : cProfile (fichier .pstats) ou pyinstrument (fichier .html, s'il est installé)"""
+
+    def __init__(self, path):
+        self.path = path
+        self.html = path.endswith(".html")
+        if self.html:
+            # Dépendance optionnelle, importée seulement si un rapport HTML est demandé
+            from pyinstrument import Profiler as HtmlProfiler
+            self.profiler = HtmlProfiler()
+        else:
+            self.profiler = cProfile.Profile()
+
+    def start(self):
+        if self.html:
+            self.profiler.start()
+        else:
+            self.profiler.enable()
+
+    def stop(self):
+        """Arrête le profilage et écrit le rapport"""
+        if self.html:
+            self.profiler.stop()
+            with open(self.path, "w", encoding="utf-8") as f:
+                f.write(self.profiler.output_html())
+        else:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.path)
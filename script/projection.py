@@ -0,0 +1,126 @@
+"""Projection des prélèvements d'abonnements sur un horizon de plusieurs mois.
+
+Chaque abonnement est débité à sa date (`date`) puis à chaque échéance de sa récurrence :
+toutes les semaines, tous les mois (même jour, ramené au dernier jour des mois plus
+courts) ou tous les ans. Les échéances tombant dans l'horizon sont dépliées par calcul
+de dates sur des tableaux NumPy, par blocs d'abonnements, puis sommées en centimes par
+mois, par récurrence et par utilisateur.
+"""
+import numpy as np
+
+WEEKLY, MONTHLY, YEARLY = 0, 1, 2
+RECURRENCES = ("weekly", "monthly", "yearly")
+
+# Valeurs de l'application mobile et variantes françaises (comparées en minuscules, sans espaces)
+RECURRENCE_ALIASES = {
+    "weekly": WEEKLY, "hebdomadaire": WEEKLY, "hebdo": WEEKLY, "semaine": WEEKLY,
+    "monthly": MONTHLY, "mensuel": MONTHLY, "mensuelle": MONTHLY, "mois": MONTHLY,
+    "yearly": YEARLY, "annual": YEARLY, "annuel": YEARLY, "annuelle": YEARLY, "an": YEARLY,
+}
+
+# Abonnements dépliés ensemble : une récurrence hebdomadaire donne ~53 échéances par an
+BLOCK_SIZE = 200_000
+
+
+def recurrence_codes(values):
+    """Code de récurrence de chaque valeur (-1 si elle n'est pas reconnue), chaque libellé distinct évalué une fois"""
+    libelles, inverse = np.unique(np.asarray(values, dtype=str), return_inverse=True)
+    codes = np.array([RECURRENCE_ALIASES.get(libelle.strip().lower(), -1) for libelle in libelles], dtype=np.int8)
+    return codes[inverse.ravel()] if len(libelles) else np.empty(0, dtype=np.int8)
+
+
+def _ceil_div(a, b):
+    return -(-a // b)
+
+
+def expand_charges(anchors, codes, start, end):
+    """Déplie les échéances comprises dans [start, end[ ; renvoie (indice de l'abonnement, date) par échéance
+
+    `anchors` est la date du premier prélèvement (datetime64[D]) ; `start` et `end` sont des
+    débuts de mois. Les abonnements de récurrence inconnue (-1) n'ont aucune échéance.
+    """
+    indices, days, _ = _expand(anchors, codes, np.datetime64(start, 'M'), np.datetime64(end, 'M'))
+    return indices, days.astype('datetime64[D]')
+
+
+def _expand(anchors, codes, start_month, end_month):
+    """Échéances en jours depuis 1970 et en rang de mois dans l'horizon, calculées en entiers"""
+    # Débuts des mois de l'horizon (et du mois suivant) : longueurs des mois sans calendrier Python
+    month_starts = np.arange(start_month, end_month + 1).astype('datetime64[D]').astype(np.int64)
+    start_day, end_day = month_starts[0], month_starts[-1]
+
+    anchor_days = anchors.astype('datetime64[D]').astype(np.int64)
+    anchor_months = anchors.astype('datetime64[M]')
+    day_of_month = anchor_days - anchor_months.astype('datetime64[D]').astype(np.int64)
+    anchor_months = anchor_months.astype(np.int64)
+    weekly = codes == WEEKLY
+    step = np.where(codes == YEARLY, 12, 1)
+
+    # Rang k de la première et de la dernière échéance utiles : anchor + 7k ou mois de l'ancre + pas × k
+    first = np.where(weekly, _ceil_div(start_day - anchor_days, 7),
+                     _ceil_div(start_month.astype(np.int64) - anchor_months, step)).clip(0)
+    stop = np.where(weekly, _ceil_div(end_day - anchor_days, 7),
+                    _ceil_div(end_month.astype(np.int64) - anchor_months, step))
+    counts = np.where(codes >= 0, stop - first, 0).clip(0)
+
+    # Rang de chaque échéance : position dans le bloc de son abonnement, décalée du premier rang
+    indices = np.repeat(np.arange(len(codes)), counts)
+    k = np.repeat(first - (np.cumsum(counts) - counts), counts) + np.arange(len(indices))
+
+    weekly_charge = weekly[indices]
+    days = anchor_days[indices] + 7 * k
+    month = np.where(weekly_charge, np.searchsorted(month_starts, days, side='right') - 1,
+                     anchor_months[indices] + step[indices] * k - start_month.astype(np.int64))
+    # Mensuel et annuel : même jour que l'ancre, ramené au dernier jour des mois plus courts
+    month_length = np.diff(month_starts)
+    days = np.where(weekly_charge, days, month_starts[month] + np.minimum(day_of_month[indices], month_length[month] - 1))
+    return indices, days, month
+
+
+class SubscriptionProjection:
+    def __init__(self, anchors, recurrences, cents, users, start, months=12):
+        self.start = np.datetime64(start, 'M')
+        self.months = self.start + np.arange(months)
+        self.codes = recurrence_codes(recurrences)
+        self.user_ids, user_codes = np.unique(np.asarray(users, dtype=str), return_inverse=True)
+        self.user_codes = user_codes.ravel()
+
+        horizon = len(self.months)
+        self.by_recurrence = np.zeros((len(RECURRENCES), horizon), dtype=np.int64)
+        self.by_user = np.zeros(len(self.user_ids), dtype=np.int64)
+        self.count_by_user = np.bincount(self.user_codes, minlength=len(self.user_ids))
+
+        end = self.start + horizon
+        for block in range(0, len(cents), BLOCK_SIZE):
+            window = slice(block, block + BLOCK_SIZE)
+            indices, _, mois = _expand(anchors[window], self.codes[window], self.start, end)
+            montants = cents[window][indices]
+
+            # Sommes par (récurrence, mois) et par utilisateur ; exactes en float64 sous 2**53 centimes
+            cle = self.codes[window][indices].astype(np.int64) * horizon + mois
+            self.by_recurrence += np.bincount(cle, weights=montants,
+                                              minlength=self.by_recurrence.size).astype(np.int64).reshape(self.by_recurrence.shape)
+            self.by_user += np.bincount(self.user_codes[window][indices], weights=montants,
+                                        minlength=len(self.user_ids)).astype(np.int64)
+
+    @classmethod
+    def from_records(cls, subscriptions, start, months=12):
+        """Construit la projection à partir des abonnements du rapport (un dict par ligne)"""
+        anchors = np.array([sub['date'] for sub in subscriptions], dtype='datetime64[D]')
+        # DECIMAL(10,2) : l'arrondi au centime absorbe l'erreur du float
+        cents = np.rint(np.array([float(sub['amount']) for sub in subscriptions]) * 100).astype(np.int64)
+        return cls(anchors, [sub['recurrence'] for sub in subscriptions], cents,
+                   [str(sub['user_id']) for sub in subscriptions], start, months)
+
+    @property
+    def unknown(self):
+        """Nombre d'abonnements dont la récurrence n'est pas reconnue (exclus de la projection)"""
+        return int((self.codes < 0).sum())
+
+    def monthly_totals(self):
+        """Coût projeté de chaque mois de l'horizon, toutes récurrences confondues (centimes)"""
+        return self.by_recurrence.sum(axis=0)
+
+    def monthly_average(self):
+        """Coût mensuel moyen sur l'horizon (centimes)"""
+        return int(self.by_recurrence.sum()) / len(self.months)
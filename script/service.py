@@ -0,0 +1,234 @@
+"""Service local de rapports : file de demandes asyncio, pool de processus et cache de classeurs.
+
+Une demande porte sur un utilisateur et une période. Le service calcule d'abord le filigrane
+des données du périmètre (nombre de lignes, somme et dernière date des transactions et des
+abonnements) : si un classeur de même périmètre et de même filigrane est en cache, ses octets
+sont renvoyés sans export. Sinon l'export est confié au pool de processus ; les demandes
+identiques qui arrivent pendant qu'il tourne attendent le même résultat au lieu d'en lancer un
+autre. Le cache est borné en nombre de classeurs et en octets (éviction du moins récemment servi).
+
+Protocole (TCP) : une ligne JSON par demande, par exemple
+    {"user_id": "3f1c...", "since": "2025-01-01", "until": "2025-01-31"}
+puis une ligne JSON d'en-tête ({"status": "ok", "bytes": N, "source": "cache"}) suivie des N octets du classeur.
+
+Exemple :
+    python service.py serve --port 8765 --workers 4 --cache-mb 256
+    python service.py get --user-id 3f1c...-uuid --since 2025-01-01 --output rapport.xlsx
+"""
+import os
+import json
+import asyncio
+import argparse
+import threading
+from datetime import date
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import main
+from main import (FinanceExporter, INGESTION_MODES, POOL_SIZE, PROJECTION_MONTHS,
+                  create_connection_pool, required_pool_size, _init_batch_worker)
+from sinks import MemorySink
+
+DEFAULT_PORT = 8765
+CACHE_ENTRIES = 100
+CACHE_MB = 256
+# Les filigranes sont de petites requêtes indexées : quelques connexions suffisent
+WATERMARK_CONNECTIONS = 4
+
+
+def _render_report(user_id, since, until, options):
+    """Génère un classeur en mémoire dans un processus du pool et renvoie ses octets (None s'il est vide)"""
+    with FinanceExporter(user_id=user_id, since=since, until=until, pool=main._worker_pool,
+                         verbose=False, **options) as exporter:
+        result = exporter.generate_report(output=MemorySink())
+    return result['content'] if result else None
+
+
+class ReportService:
+    def __init__(self, workers=os.cpu_count(), cache_entries=CACHE_ENTRIES, cache_bytes=CACHE_MB * 1024 * 1024,
+                 options=None):
+        self.options = options or {}
+        self.cache_entries = cache_entries
+        self.cache_bytes = cache_bytes
+        # (périmètre, filigrane) -> octets du classeur, du moins au plus récemment servi
+        self.cache = OrderedDict()
+        self.cache_size = 0
+        self.in_flight = {}
+        self.stats = {'cache': 0, 'partage': 0, 'genere': 0}
+
+        pool_size = required_pool_size(self.options.get('pool_size', POOL_SIZE), self.options.get('parallel_fetch', 1))
+        self.workers = ProcessPoolExecutor(max_workers=workers, initializer=_init_batch_worker, initargs=(pool_size,))
+        # Le pool psycopg2 ne met pas en attente : un fil par connexion pour les filigranes
+        self.watermark_pool = None
+        self._watermark_pool_lock = threading.Lock()
+        self.watermark_threads = ThreadPoolExecutor(max_workers=WATERMARK_CONNECTIONS)
+
+    def close(self):
+        self.workers.shutdown()
+        self.watermark_threads.shutdown()
+        if self.watermark_pool is not None:
+            self.watermark_pool.closeall()
+
+    def _watermark(self, scope):
+        """Filigrane du périmètre, lu sur le pool de connexions du service"""
+        # Plusieurs fils peuvent servir une première demande en même temps : un seul pool est créé
+        with self._watermark_pool_lock:
+            if self.watermark_pool is None:
+                self.watermark_pool = create_connection_pool(WATERMARK_CONNECTIONS)
+        user_id, since, until = scope
+        exporter = FinanceExporter(user_id=user_id, since=since, until=until, pool=self.watermark_pool, verbose=False)
+        return exporter.data_watermark()
+
+    async def get_report(self, user_id=None, since=None, until=None):
+        """Octets du classeur du périmètre et leur provenance (cache, partage ou genere)
+
+        Retourne (None, provenance) s'il n'y a rien à exporter.
+        """
+        loop = asyncio.get_running_loop()
+        scope = (user_id, since, until)
+        watermark = await loop.run_in_executor(self.watermark_threads, self._watermark, scope)
+        if watermark is None:
+            raise ConnectionError("filigrane des données indisponible")
+        key = (scope, watermark)
+
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            self.stats['cache'] += 1
+            return self.cache[key], "cache"
+
+        # Même périmètre, mêmes données : on attend l'export déjà lancé
+        future = self.in_flight.get(key)
+        if future is not None:
+            self.stats['partage'] += 1
+            source = "partage"
+        else:
+            future = loop.run_in_executor(self.workers, _render_report, user_id, since, until, self.options)
+            future.add_done_callback(lambda done: self._finished(key, done))
+            self.in_flight[key] = future
+            self.stats['genere'] += 1
+            source = "genere"
+        # Un demandeur qui abandonne n'annule pas l'export attendu par les autres
+        return await asyncio.shield(future), source
+
+    def _finished(self, key, future):
+        """Retire l'export de la liste en cours et met son classeur en cache"""
+        del self.in_flight[key]
+        if future.cancelled() or future.exception() is not None or future.result() is None:
+            return
+
+        # Les classeurs d'un filigrane antérieur du même périmètre ne serviront plus
+        scope = key[0]
+        for old in [old for old in self.cache if old[0] == scope]:
+            self.cache_size -= len(self.cache.pop(old))
+
+        content = future.result()
+        if len(content) > self.cache_bytes:
+            return
+        self.cache[key] = content
+        self.cache_size += len(content)
+        while len(self.cache) > self.cache_entries or self.cache_size > self.cache_bytes:
+            _, evicted = self.cache.popitem(last=False)
+            self.cache_size -= len(evicted)
+
+    async def handle(self, reader, writer):
+        """Sert les demandes d'une connexion : une ligne JSON par demande"""
+        try:
+            while line := await reader.readline():
+                try:
+                    request = json.loads(line)
+                    since = date.fromisoformat(request['since']) if request.get('since') else None
+                    until = date.fromisoformat(request['until']) if request.get('until') else None
+                    content, source = await self.get_report(request.get('user_id'), since, until)
+                    if content is None:
+                        header = {'status': "vide", 'bytes': 0, 'source': source}
+                    else:
+                        header = {'status': "ok", 'bytes': len(content), 'source': source}
+                except Exception as e:
+                    content, header = None, {'status': "erreur", 'message': str(e), 'bytes': 0}
+
+                writer.write(json.dumps(header).encode() + b"\n")
+                if content:
+                    writer.write(content)
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handle, host, port)
+        print(f"🛰️  Service de rapports en écoute sur {host}:{port}")
+        async with server:
+            await server.serve_forever()
+
+
+async def request_report(host, port, user_id=None, since=None, until=None):
+    """Demande un classeur au service ; renvoie son en-tête et ses octets"""
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        request = {'user_id': user_id,
+                   'since': since.isoformat() if since else None,
+                   'until': until.isoformat() if until else None}
+        writer.write(json.dumps(request).encode() + b"\n")
+        await writer.drain()
+        header = json.loads(await reader.readline())
+        content = await reader.readexactly(header['bytes']) if header['bytes'] else None
+        return header, content
+    finally:
+        writer.close()
+
+
+def run_serve(args):
+    options = dict(sql_aggregates=args.sql_aggregates, skip_monthly_sheets=args.no_monthly_sheets,
+                   ingestion=args.ingestion, pool_size=args.pool_size, projection_months=args.projection_months)
+    service = ReportService(args.workers, args.cache_entries, args.cache_mb * 1024 * 1024, options)
+    try:
+        asyncio.run(service.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        print(f"\n📊 Classeurs servis : {service.stats}")
+    finally:
+        service.close()
+
+
+def run_get(args):
+    header, content = asyncio.run(request_report(args.host, args.port, args.user_id, args.since, args.until))
+    if header['status'] != "ok":
+        raise SystemExit(f"❌ {header.get('message', 'aucune donnée à exporter')}")
+    with open(args.output, "wb") as f:
+        f.write(content)
+    print(f"✅ {args.output} ({header['bytes']} octets, {header['source']})")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Service local de rapports du Finance Exporter")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    connection = argparse.ArgumentParser(add_help=False)
+    connection.add_argument("--host", default="127.0.0.1")
+    connection.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"port TCP (défaut: {DEFAULT_PORT})")
+
+    serve = subparsers.add_parser("serve", parents=[connection], help="démarre le service")
+    serve.add_argument("--workers", type=int, default=os.cpu_count(),
+                       help="processus d'export (défaut: nombre de cœurs)")
+    serve.add_argument("--cache-entries", type=int, default=CACHE_ENTRIES,
+                       help=f"classeurs gardés en cache (défaut: {CACHE_ENTRIES})")
+    serve.add_argument("--cache-mb", type=int, default=CACHE_MB,
+                       help=f"taille maximale du cache en Mo (défaut: {CACHE_MB})")
+    serve.add_argument("--sql-aggregates", action="store_true")
+    serve.add_argument("--no-monthly-sheets", action="store_true")
+    serve.add_argument("--ingestion", choices=INGESTION_MODES, default="read_sql")
+    serve.add_argument("--pool-size", type=int, default=POOL_SIZE)
+    serve.add_argument("--projection-months", type=int, default=PROJECTION_MONTHS)
+    serve.set_defaults(func=run_serve)
+
+    get = subparsers.add_parser("get", parents=[connection], help="demande un classeur au service")
+    get.add_argument("--user-id")
+    get.add_argument("--since", type=date.fromisoformat, metavar="AAAA-MM-JJ")
+    get.add_argument("--until", type=date.fromisoformat, metavar="AAAA-MM-JJ")
+    get.add_argument("--output", default="rapport_financier.xlsx")
+    get.set_defaults(func=run_get)
+
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    args.func(args)
@@ -0,0 +1,179 @@
+"""Destinations d'un rapport : fichier, mémoire, flux (stdout, descripteur) ou fonction de rappel.
+
+Le classeur XLSX est écrit sur disque par défaut. Les autres destinations le construisent en
+mémoire (option `in_memory` de xlsxwriter, sans fichier temporaire) puis livrent ses octets ;
+xlsxwriter désactive alors `constant_memory`. Les formats `csv` et `jsonl` évitent entièrement
+le XLSX pour les consommateurs automatiques : les lignes sont encodées par blocs (Arrow pour le
+CSV, montants décimaux exacts à partir des centimes) et un flux les reçoit au fil de l'export.
+"""
+import io
+import os
+import json
+
+import numpy as np
+
+FORMATS = ("xlsx", "csv", "jsonl")
+TRANSACTION_FIELDS = ["date", "title", "category", "amount", "id"]
+
+
+def _check_format(format):
+    if format not in FORMATS:
+        raise ValueError(f"❌ Format de sortie inconnu: {format} (formats: {', '.join(FORMATS)})")
+    return format
+
+
+def _decimal_amounts(cents):
+    """Montants en centimes (int64) vers un tableau Arrow decimal128(12, 2), sans passer par le float"""
+    import pyarrow as pa
+    # Un decimal128 est un entier de 128 bits : mot bas = centimes, mot haut = extension du signe
+    words = np.stack([cents, cents >> 63], axis=1).ravel()
+    return pa.Array.from_buffers(pa.decimal128(12, 2), len(cents), [None, pa.py_buffer(words)])
+
+
+def transactions_csv(transactions, header=False):
+    """Lignes CSV d'un stockage de transactions (colonnes TRANSACTION_FIELDS)"""
+    import pyarrow as pa
+    from pyarrow import csv as pa_csv
+
+    table = pa.table({
+        'date': pa.array(transactions.dates),
+        'title': pa.array(np.asarray(transactions.titles), pa.string()),
+        'category': pa.array(np.asarray(transactions.categories), pa.string()),
+        'amount': _decimal_amounts(transactions.amounts),
+        'id': pa.array(transactions.id_strings(), pa.string()),
+    })
+    buffer = io.BytesIO()
+    pa_csv.write_csv(table, buffer, pa_csv.WriteOptions(include_header=header))
+    return buffer.getvalue()
+
+
+def transactions_jsonl(transactions):
+    """Un objet JSON par transaction ({"type": "transaction", ...}), encodé par pandas"""
+    import pandas as pd
+
+    df = pd.DataFrame({
+        'type': "transaction",
+        'date': np.datetime_as_string(transactions.dates, unit='D'),
+        'title': np.asarray(transactions.titles),
+        'category': np.asarray(transactions.categories),
+        'amount': transactions.amounts_euros(),
+        'id': transactions.id_strings(),
+    })
+    return df.to_json(orient='records', lines=True, force_ascii=False).encode() if len(df) else b""
+
+
+def records_jsonl(kind, records):
+    """Un objet JSON par enregistrement, marqué de son type ; dates et décimaux en texte"""
+    lines = [json.dumps({'type': kind, **record}, ensure_ascii=False, default=str) for record in records]
+    return "".join(line + "\n" for line in lines).encode()
+
+
+class FileSink:
+    """Fichier sur disque (destination par défaut)"""
+    content = None
+
+    def __init__(self, path, format="xlsx"):
+        self.path = path
+        self.format = _check_format(format)
+        self.bytes_written = 0
+        self._file = None
+
+    @property
+    def name(self):
+        return self.path
+
+    def workbook(self, options):
+        import xlsxwriter
+        return xlsxwriter.Workbook(self.path, options)
+
+    def write(self, data):
+        if self._file is None:
+            self._file = open(self.path, "wb")
+        self._file.write(data)
+
+    def close(self):
+        if self._file is None and self.format != "xlsx":
+            self.write(b"")
+        if self._file is not None:
+            self._file.close()
+        self.bytes_written = os.path.getsize(self.path)
+
+    def discard(self):
+        """Abandonne un rapport vide"""
+        if self._file is not None:
+            self._file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class MemorySink:
+    """Octets du rapport gardés en mémoire (résultat['content'])"""
+    path = None
+    name = "<mémoire>"
+
+    def __init__(self, format="xlsx"):
+        self.format = _check_format(format)
+        self.buffer = io.BytesIO()
+        self.bytes_written = 0
+        self.content = None
+
+    def workbook(self, options):
+        import xlsxwriter
+        return xlsxwriter.Workbook(self.buffer, {**options, 'in_memory': True})
+
+    def write(self, data):
+        self.buffer.write(data)
+
+    def close(self):
+        content = self.buffer.getvalue()
+        self.buffer = None
+        self.bytes_written = len(content)
+        self.deliver(content)
+
+    def deliver(self, content):
+        self.content = content
+
+    def discard(self):
+        self.buffer = None
+
+
+class StreamSink(MemorySink):
+    """Flux binaire (sys.stdout.buffer, socket...) ou descripteur de fichier
+
+    Le CSV et le JSON lines y sont écrits au fil de l'export ; un classeur XLSX, archive zip,
+    n'est envoyé qu'une fois terminé.
+    """
+    def __init__(self, stream, format="xlsx"):
+        super().__init__(format)
+        if isinstance(stream, int):
+            stream = os.fdopen(stream, "wb", closefd=False)
+        self.stream = stream
+        self.name = getattr(stream, "name", "<flux>")
+
+    def write(self, data):
+        self.stream.write(data)
+        self.bytes_written += len(data)
+
+    def close(self):
+        if self.format == "xlsx":
+            content = self.buffer.getvalue()
+            self.stream.write(content)
+            self.bytes_written = len(content)
+        self.buffer = None
+        self.stream.flush()
+
+    def discard(self):
+        self.buffer = None
+        self.stream.flush()
+
+
+class CallbackSink(MemorySink):
+    """Octets du rapport passés à une fonction, par exemple pour un envoi vers un stockage objet"""
+    name = "<rappel>"
+
+    def __init__(self, callback, format="xlsx"):
+        super().__init__(format)
+        self.callback = callback
+
+    def deliver(self, content):
+        self.callback(content)
@@ -0,0 +1,172 @@
+"""Statistiques en une passe et en mémoire bornée : quantiles (KLL) et titres fréquents (Misra-Gries).
+
+Les sketches sont alimentés bloc par bloc et sont fusionnables : ceux de deux blocs, de deux
+mois ou de deux processus se combinent en celui de leur union. Tant qu'un sketch n'a pas
+dépassé sa capacité, il est exact (petits comptes) ; au-delà, l'erreur de rang d'un quantile
+KLL est de l'ordre de 1,7/k et le compte d'un titre est sous-estimé d'au plus N/(m+1).
+"""
+import numpy as np
+
+KLL_K = 200
+HEAVY_HITTERS = 1000
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+def _split_by_code(codes, values):
+    """Valeurs groupées par code : (code, valeurs) pour chaque code présent, sans boucle sur les lignes"""
+    ordre = np.argsort(codes, kind='stable')
+    presents, debuts = np.unique(codes[ordre], return_index=True)
+    return zip(presents.tolist(), np.split(values[ordre], debuts[1:]))
+
+
+class KLLSketch:
+    """Quantiles approchés (KLL) : niveaux d'éléments de poids 2**h, compactés par tri et sous-échantillonnage"""
+
+    def __init__(self, k=KLL_K, seed=0):
+        self.k = k
+        self.levels = [np.empty(0)]
+        self.count = 0
+        self.min = np.inf
+        self.max = -np.inf
+        # Graine fixe : deux exports des mêmes lignes lues en blocs identiques donnent les mêmes quantiles.
+        # Les compactions dépendent du découpage en blocs (mode flux, --itersize, --max-memory) : d'un
+        # découpage à l'autre, les quantiles peuvent différer, dans la limite de l'erreur de rang.
+        self._rng = np.random.default_rng(seed)
+
+    def _capacity(self, level):
+        # Capacité k aux niveaux hauts, réduite de 2/3 par niveau en descendant
+        depth = len(self.levels) - 1 - level
+        return max(2, int(np.ceil(self.k * (2 / 3) ** depth)))
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        if not len(values):
+            return
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self.count += len(values)
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+        self._compress()
+
+    def merge(self, other):
+        """Ajoute les éléments d'un autre sketch (celui-ci est modifié, l'autre non)"""
+        for level, items in enumerate(other.levels):
+            if level == len(self.levels):
+                self.levels.append(np.empty(0))
+            self.levels[level] = np.concatenate([self.levels[level], items])
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._compress()
+        return self
+
+    def _compress(self):
+        """Compacte les niveaux trop pleins : un élément sur deux (trié) monte d'un niveau, de poids double"""
+        # Un nouveau niveau réduit la capacité des niveaux inférieurs : on recommence jusqu'à stabilité
+        compacted = True
+        while compacted:
+            compacted = False
+            for level in range(len(self.levels)):
+                items = self.levels[level]
+                if len(items) <= self._capacity(level):
+                    continue
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                items = np.sort(items)
+                # Un nombre impair laisse le plus petit élément sur place
+                reste = len(items) % 2
+                promus = items[reste + self._rng.integers(2)::2]
+                self.levels[level] = items[:reste]
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], promus])
+                compacted = True
+
+    def quantiles(self, qs=QUANTILES):
+        """Quantiles inférieurs : plus petite valeur dont le rang cumulé atteint q × count"""
+        if not self.count:
+            return [None] * len(qs)
+        items = np.concatenate(self.levels)
+        poids = np.concatenate([np.full(len(level), 2 ** h, dtype=np.int64) for h, level in enumerate(self.levels)])
+        ordre = np.argsort(items, kind='stable')
+        cumul = np.cumsum(poids[ordre])
+        rangs = np.searchsorted(cumul, np.asarray(qs) * cumul[-1], side='left')
+        return items[ordre][np.minimum(rangs, len(items) - 1)].tolist()
+
+    @property
+    def size(self):
+        """Éléments retenus (mémoire bornée, indépendante du nombre de valeurs vues)"""
+        return sum(len(level) for level in self.levels)
+
+
+class HeavyHitters:
+    """Valeurs les plus fréquentes (Misra-Gries) : au plus `capacity` compteurs, sous-estimés d'au plus `error`"""
+
+    def __init__(self, capacity=HEAVY_HITTERS):
+        self.capacity = capacity
+        self.counts = {}
+        self.total = 0
+        self.error = 0
+
+    def update(self, values):
+        """Ajoute une colonne de textes encodée par dictionnaire (pandas.Categorical)"""
+        comptes = np.bincount(values.codes[values.codes >= 0], minlength=len(values.categories))
+        presents = np.flatnonzero(comptes)
+        self.merge_counts(zip(values.categories[presents].tolist(), comptes[presents].tolist()))
+
+    def merge(self, other):
+        self.merge_counts(other.counts.items(), other.total, other.error)
+        return self
+
+    def merge_counts(self, counts, total=None, error=0):
+        """Fusionne des comptes : au-delà de la capacité, tous sont diminués du (capacity + 1)-ième plus grand"""
+        combined = self.counts
+        vus = 0
+        for valeur, compte in counts:
+            combined[valeur] = combined.get(valeur, 0) + compte
+            vus += compte
+        self.total += vus if total is None else total
+        self.error += error
+        if len(combined) > self.capacity:
+            seuil = int(np.partition(np.fromiter(combined.values(), np.int64, len(combined)),
+                                     -(self.capacity + 1))[-(self.capacity + 1)])
+            self.counts = {valeur: compte - seuil for valeur, compte in combined.items() if compte > seuil}
+            self.error += seuil
+
+    def top(self, n=20):
+        """Les n valeurs les plus fréquentes et leurs comptes (à `error` près), les plus fréquentes d'abord"""
+        return sorted(self.counts.items(), key=lambda item: -item[1])[:n]
+
+
+class TransactionSketch:
+    """Sketches d'un ensemble de transactions : montants par catégorie, dépenses, revenus et titres fréquents"""
+
+    def __init__(self):
+        self.categories = {}
+        self.depenses = KLLSketch()
+        self.revenus = KLLSketch()
+        self.titles = HeavyHitters()
+
+    def update(self, transactions):
+        """Ajoute un stockage de transactions (montants en centimes, valeurs absolues par catégorie)"""
+        montants = transactions.amounts
+        noms = transactions.categories.categories
+        for code, valeurs in _split_by_code(transactions.categories.codes, np.abs(montants)):
+            self.categories.setdefault(noms[code], KLLSketch()).update(valeurs)
+        self.depenses.update(-montants[montants < 0])
+        self.revenus.update(montants[montants > 0])
+        self.titles.update(transactions.titles)
+
+    def merge(self, other):
+        for categorie, sketch in other.categories.items():
+            self.categories.setdefault(categorie, KLLSketch()).merge(sketch)
+        self.depenses.merge(other.depenses)
+        self.revenus.merge(other.revenus)
+        self.titles.merge(other.titles)
+        return self
+
+    @classmethod
+    def merged(cls, sketches):
+        """Sketch de l'union de plusieurs sketches (ceux-ci ne sont pas modifiés)"""
+        result = cls()
+        for sketch in sketches:
+            result.merge(sketch)
+        return result
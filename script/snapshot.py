@@ -0,0 +1,148 @@
+"""Snapshots Parquet des données d'un export, pour reconstruire un rapport hors ligne.
+
+Un snapshot est un dossier contenant `transactions.parquet` et `subscriptions.parquet`
+(compression zstd), écrits au fil de la récupération PostgreSQL : en mode flux, chaque
+bloc du curseur serveur devient un row group. La relecture passe par des fichiers
+mappés en mémoire et peut se faire bloc par bloc, sans aucune connexion à la base.
+"""
+import os
+import json
+from datetime import datetime
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+TRANSACTIONS_FILE = "transactions.parquet"
+SUBSCRIPTIONS_FILE = "subscriptions.parquet"
+
+# Schémas explicites : les row groups d'un même fichier ont tous les mêmes types
+TRANSACTIONS_SCHEMA = pa.schema([
+    ("id", pa.string()),
+    ("user_id", pa.string()),
+    ("title", pa.string()),
+    ("amount", pa.decimal128(10, 2)),
+    ("category", pa.string()),
+    ("created_at", pa.date32()),
+])
+
+SUBSCRIPTIONS_SCHEMA = pa.schema([
+    ("id", pa.string()),
+    ("user_id", pa.string()),
+    ("label", pa.string()),
+    ("amount", pa.decimal128(10, 2)),
+    ("date", pa.date32()),
+    ("recurrence", pa.string()),
+    ("rating", pa.int32()),
+    ("image_url", pa.string()),
+    ("created_at", pa.timestamp("us")),
+])
+
+COMPRESSION = "zstd"
+# Lots de lecture regroupés en blocs quand la taille des blocs varie (budget mémoire)
+READ_BATCH = 1000
+
+
+def _to_table(df, schema):
+    """Convertit un DataFrame issu de PostgreSQL au schéma du snapshot"""
+    # Les UUID peuvent arriver en texte ou en objets uuid.UUID selon la configuration de psycopg2
+    df = df.astype({"id": str, "user_id": str})
+    # Types inférés puis convertis : les montants arrivent en Decimal (curseur) ou en float64 (COPY)
+    return pa.Table.from_pandas(df[schema.names], preserve_index=False).cast(schema)
+
+
+class SnapshotWriter:
+    def __init__(self, path, scope):
+        self.path = path
+        self.metadata = {b"finance_exporter": json.dumps({
+            "scope": scope,
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+        }).encode()}
+        self.transactions_writer = None
+        self.transactions = 0
+        self.closed = False
+        os.makedirs(path, exist_ok=True)
+
+    def write_transactions(self, df):
+        """Ajoute un bloc de transactions (un row group) au snapshot"""
+        if self.transactions_writer is None:
+            self.transactions_writer = pq.ParquetWriter(
+                os.path.join(self.path, TRANSACTIONS_FILE),
+                TRANSACTIONS_SCHEMA.with_metadata(self.metadata),
+                compression=COMPRESSION,
+            )
+        self.transactions_writer.write_table(_to_table(df, TRANSACTIONS_SCHEMA))
+        self.transactions += len(df)
+
+    def write_subscriptions(self, df):
+        """Écrit la table des abonnements"""
+        pq.write_table(_to_table(df, SUBSCRIPTIONS_SCHEMA).replace_schema_metadata(self.metadata),
+                       os.path.join(self.path, SUBSCRIPTIONS_FILE), compression=COMPRESSION)
+
+    def close(self):
+        """Termine le fichier des transactions (un fichier vide s'il n'y en avait aucune)"""
+        if self.closed:
+            return
+        self.closed = True
+        if self.transactions_writer is None:
+            pq.write_table(TRANSACTIONS_SCHEMA.with_metadata(self.metadata).empty_table(),
+                           os.path.join(self.path, TRANSACTIONS_FILE), compression=COMPRESSION)
+        else:
+            self.transactions_writer.close()
+
+
+class SnapshotReader:
+    def __init__(self, path):
+        self.path = path
+        transactions_path = os.path.join(path, TRANSACTIONS_FILE)
+        subscriptions_path = os.path.join(path, SUBSCRIPTIONS_FILE)
+        if not os.path.exists(transactions_path) or not os.path.exists(subscriptions_path):
+            raise FileNotFoundError(f"Snapshot incomplet dans {path}")
+        self.transactions_file = pq.ParquetFile(transactions_path, memory_map=True)
+        self.subscriptions_path = subscriptions_path
+
+    @property
+    def info(self):
+        """Périmètre et date du snapshot"""
+        metadata = self.transactions_file.schema_arrow.metadata or {}
+        return json.loads(metadata.get(b"finance_exporter", b"{}"))
+
+    @property
+    def num_transactions(self):
+        return self.transactions_file.metadata.num_rows
+
+    def read_transactions(self):
+        """Relit toutes les transactions au format de la requête PostgreSQL"""
+        return self._to_pandas(self.transactions_file.read())
+
+    def iter_transaction_chunks(self, batch_size):
+        """Relit les transactions par blocs de `batch_size` lignes
+        
+        `batch_size` peut être une fonction, rappelée avant chaque bloc : la taille des blocs suit
+        alors le budget mémoire, comme celle des blocs du curseur serveur.
+        """
+        if not callable(batch_size):
+            for batch in self.transactions_file.iter_batches(batch_size=batch_size):
+                yield self._to_pandas(pa.Table.from_batches([batch]))
+            return
+        
+        lots, lignes = [], 0
+        for batch in self.transactions_file.iter_batches(batch_size=READ_BATCH):
+            lots.append(batch)
+            lignes += batch.num_rows
+            if lignes >= batch_size():
+                yield self._to_pandas(pa.Table.from_batches(lots))
+                lots, lignes = [], 0
+        if lots:
+            yield self._to_pandas(pa.Table.from_batches(lots))
+
+    def read_subscriptions(self):
+        """Relit les abonnements (montants en Decimal, dates en objets date, comme psycopg2)"""
+        return pq.read_table(self.subscriptions_path, memory_map=True).to_pandas()
+
+    @staticmethod
+    def _to_pandas(table):
+        """Montants en float64 et dates en datetime64 : les conversions sont faites par Arrow"""
+        table = table.set_column(table.schema.get_field_index("amount"), "amount",
+                                 pc.cast(table["amount"], pa.float64()))
+        return table.to_pandas(date_as_object=False)
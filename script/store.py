@@ -0,0 +1,118 @@
+"""Stockage compact des transactions en colonnes typées.
+
+Chaque colonne est un tableau NumPy : montants en centimes (int64, sommes exactes
+sur des DECIMAL(10,2)), dates en datetime64[D], UUID en 16 octets, titres et
+catégories encodés par dictionnaire (codes entiers + valeurs distinctes). Un million
+de transactions tient en une trentaine de mégaoctets au lieu de plusieurs centaines.
+"""
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+
+def _encode(values):
+    """Encode une colonne de textes par dictionnaire, valeurs dans l'ordre d'apparition"""
+    codes, uniques = pd.factorize(values)
+    return pd.Categorical.from_codes(codes, uniques)
+
+
+def uuid_strings(ids):
+    """Formate des UUID de 16 octets (tableau S16) en texte 8-4-4-4-12, sans boucle Python"""
+    hexa = np.frombuffer(ids.tobytes().hex().encode(), dtype='S1').reshape(-1, 32)
+    texte = np.full((len(hexa), 36), b'-', dtype='S1')
+    for cible, source, largeur in ((0, 0, 8), (9, 8, 4), (14, 12, 4), (19, 16, 4), (24, 20, 12)):
+        texte[:, cible:cible + largeur] = hexa[:, source:source + largeur]
+    return texte.view('S36').ravel().astype(str)
+
+
+class TransactionStore:
+    __slots__ = ("titles", "categories", "amounts", "dates", "ids")
+
+    def __init__(self, titles, categories, amounts, dates, ids):
+        self.titles = titles
+        self.categories = categories
+        self.amounts = amounts
+        self.dates = dates
+        self.ids = ids
+
+    @classmethod
+    def from_frame(cls, df):
+        """Construit le stockage à partir des colonnes de la requête des transactions"""
+        # Les montants DECIMAL(10,2) sont exacts en centimes : l'arrondi absorbe l'erreur du float
+        amounts = np.rint(df['amount'].to_numpy(dtype='float64') * 100).astype(np.int64)
+        dates = pd.to_datetime(df['created_at']).to_numpy(dtype='datetime64[D]')
+
+        # Les UUID (texte ou uuid.UUID) sont décodés d'un seul bloc hexadécimal
+        hexa = "".join(map(str, df['id'].tolist())).replace("-", "")
+        ids = np.frombuffer(bytes.fromhex(hexa), dtype='S16')
+
+        return cls(_encode(df['title'].array), _encode(df['category'].array), amounts, dates, ids)
+
+    @classmethod
+    def concat(cls, stores):
+        """Met bout à bout plusieurs stockages (dictionnaires fusionnés)"""
+        return cls(
+            union_categoricals([store.titles for store in stores]),
+            union_categoricals([store.categories for store in stores]),
+            np.concatenate([store.amounts for store in stores]),
+            np.concatenate([store.dates for store in stores]),
+            np.concatenate([store.ids for store in stores]),
+        )
+
+    def take(self, indices):
+        """Sous-ensemble de lignes ; les dictionnaires sont partagés, pas copiés"""
+        return TransactionStore(self.titles.take(indices), self.categories.take(indices),
+                                self.amounts[indices], self.dates[indices], self.ids[indices])
+
+    def __len__(self):
+        return len(self.amounts)
+
+    @property
+    def nbytes(self):
+        """Mémoire occupée : tableaux, codes et valeurs des dictionnaires"""
+        total = self.amounts.nbytes + self.dates.nbytes + self.ids.nbytes
+        for column in (self.titles, self.categories):
+            total += column.codes.nbytes + column.categories.memory_usage(deep=True)
+        return total
+
+    def split_by_month(self):
+        """Répartit les lignes par (année, mois), dans l'ordre d'apparition des mois et des lignes"""
+        codes, mois = pd.factorize(self.dates.astype('datetime64[M]').astype(np.int64))
+        ordre = np.argsort(codes, kind='stable')
+        bornes = np.cumsum(np.bincount(codes, minlength=len(mois)))[:-1]
+
+        # Mois comptés depuis janvier 1970
+        return {
+            (1970 + int(m) // 12, int(m) % 12 + 1): self.take(indices)
+            for m, indices in zip(mois, np.split(ordre, bornes))
+        }
+
+    def totals(self):
+        """Agrégats en centimes : par catégorie (ordre d'apparition), dépenses, revenus et nombres de lignes"""
+        codes = self.categories.codes
+        # Les sommes partielles restent des entiers sous 2**53 : le float64 de bincount est exact
+        sommes = np.bincount(codes, weights=np.abs(self.amounts),
+                             minlength=len(self.categories.categories)).astype(np.int64)
+
+        presents, premiers = np.unique(codes, return_index=True)
+        noms = self.categories.categories
+        categories = {noms[code]: int(sommes[code]) for code in presents[np.argsort(premiers)]}
+
+        depenses = self.amounts < 0
+        revenus = self.amounts > 0
+        return {
+            'count': len(self),
+            'categories': categories,
+            'depenses': int(-self.amounts[depenses].sum()),
+            'revenus': int(self.amounts[revenus].sum()),
+            'nb_depenses': int(depenses.sum()),
+            'nb_revenus': int(revenus.sum()),
+        }
+
+    def amounts_euros(self):
+        """Montants en euros (float64), pour l'écriture des cellules"""
+        return self.amounts / 100
+
+    def id_strings(self):
+        """UUID au format texte 8-4-4-4-12"""
+        return uuid_strings(self.ids)
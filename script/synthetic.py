@@ -0,0 +1,223 @@
+"""Données synthétiques au schéma de l'application, pour mesurer l'exporteur sans données de production.
+
+Les tables `users`, `transactions` et `subscriptions` reprennent exactement le schéma de
+`backend/src/config/db.js`, avec les catégories et récurrences proposées par l'application
+mobile. Le jeu est entièrement déterminé par ses paramètres et sa graine : deux générations
+identiques produisent les mêmes lignes. Il peut être chargé dans PostgreSQL (schéma dédié,
+par COPY) ou écrit directement en snapshot Parquet relu par `--from-snapshot`.
+"""
+import io
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from pyarrow import csv as pa_csv
+from psycopg2 import sql
+
+from snapshot import SnapshotWriter
+from store import uuid_strings
+
+# Catégories de l'application mobile (createTransaction.jsx), complétées au-delà si besoin
+APP_CATEGORIES = [
+    "Food & Drinks", "Shopping", "Transportation", "Entertainment", "Bills", "Income",
+    "Healthcare", "Education", "Travel", "Groceries", "Housing", "Utilities", "Insurance",
+    "Personal Care", "Gifts & Donations", "Investments", "Savings", "Clothing", "Electronics",
+    "Sports & Fitness", "Pets", "Kids & Baby",
+]
+INCOME_CATEGORIES = {"Income", "Investments"}
+RECURRENCES = ["weekly", "monthly", "yearly"]
+SUBSCRIPTION_LABELS = ["Netflix", "Spotify", "Disney+", "Amazon Prime", "Salle de sport", "iCloud",
+                       "Assurance habitation", "Forfait mobile", "Box internet", "Presse"]
+
+# Schéma de backend/src/config/db.js, créé dans un schéma PostgreSQL dédié aux mesures
+SCHEMA_DDL = """
+CREATE EXTENSION IF NOT EXISTS "uuid-ossp" SCHEMA public;
+
+CREATE TABLE IF NOT EXISTS users (
+  id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+  username VARCHAR(255) NOT NULL UNIQUE,
+  email VARCHAR(255) NOT NULL UNIQUE,
+  password VARCHAR(255) NOT NULL,
+  profile_image VARCHAR(255) DEFAULT '',
+  created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
+  updated_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS transactions (
+  id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+  user_id UUID NOT NULL,
+  title VARCHAR(255) NOT NULL,
+  amount DECIMAL(10,2) NOT NULL,
+  category VARCHAR(255) NOT NULL,
+  created_at DATE NOT NULL DEFAULT CURRENT_DATE,
+  CONSTRAINT transactions_user_id_fkey
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE ON UPDATE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS subscriptions (
+  id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+  user_id UUID NOT NULL,
+  label VARCHAR(255) NOT NULL,
+  amount NUMERIC(10, 2) NOT NULL,
+  date DATE NOT NULL,
+  recurrence VARCHAR(50) NOT NULL,
+  rating INTEGER NOT NULL CHECK (rating >= 1 AND rating <= 5),
+  image_url VARCHAR(255),
+  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+  CONSTRAINT subscriptions_user_id_fkey
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE ON UPDATE CASCADE
+);
+"""
+
+# Index créés après le chargement : plus rapide que de les maintenir ligne à ligne
+SCHEMA_INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_transactions_user_created_at ON transactions (user_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_subscriptions_user_created_at ON subscriptions (user_id, created_at);
+"""
+
+BENCH_SCHEMA = "finance_bench"
+CHUNK_ROWS = 1_000_000
+# Mot de passe factice au format bcrypt : les mesures n'authentifient personne
+PASSWORD_HASH = "$2a$10$" + "x" * 53
+
+
+def _uuids(rng, n):
+    """UUID version 4 aléatoires (reproductibles pour une graine donnée), au format texte"""
+    octets = rng.integers(0, 256, (n, 16), dtype=np.uint8)
+    octets[:, 6] = (octets[:, 6] & 0x0F) | 0x40
+    octets[:, 8] = (octets[:, 8] & 0x3F) | 0x80
+    return uuid_strings(octets.view('S16').ravel())
+
+
+class SyntheticDataset:
+    def __init__(self, rows, users=1000, categories=len(APP_CATEGORIES), days=730, end=date(2025, 12, 31),
+                 subscriptions_per_user=3, titles_per_category=40, seed=42):
+        if rows < 0 or users < 1 or categories < 1 or days < 1:
+            raise ValueError("❌ Il faut au moins un utilisateur, une catégorie et un jour de données")
+        self.rows = rows
+        self.users_count = users
+        self.categories = APP_CATEGORIES[:categories] + [f"Catégorie {i}" for i in range(len(APP_CATEGORIES), categories)]
+        self.days = days
+        self.end = end
+        self.subscriptions_per_user = subscriptions_per_user
+        self.titles_per_category = titles_per_category
+        self.seed = seed
+        self.user_ids = _uuids(np.random.default_rng([seed, 0]), users)
+
+    @property
+    def params(self):
+        """Paramètres du jeu, enregistrés avec les mesures pour comparer des exécutions identiques"""
+        return {
+            'rows': self.rows,
+            'users': self.users_count,
+            'categories': len(self.categories),
+            'days': self.days,
+            'end': self.end.isoformat(),
+            'subscriptions_per_user': self.subscriptions_per_user,
+            'seed': self.seed,
+        }
+
+    def users(self):
+        """Table users : identifiants, noms et e-mails uniques"""
+        created_at = datetime.combine(self.end - timedelta(days=self.days), datetime.min.time())
+        names = [f"user{i}" for i in range(self.users_count)]
+        return pd.DataFrame({
+            'id': self.user_ids,
+            'username': names,
+            'email': [f"{name}@example.com" for name in names],
+            'password': PASSWORD_HASH,
+            'profile_image': "",
+            'created_at': created_at,
+            'updated_at': created_at,
+        })
+
+    def transaction_chunks(self, chunk_rows=CHUNK_ROWS):
+        """Transactions par blocs, dans l'ordre de la requête de l'exporteur (created_at décroissant)"""
+        # Seuls les décalages de dates sont tirés en une fois, pour un tri global (4 octets par ligne)
+        offsets = np.sort(np.random.default_rng([self.seed, 1]).integers(0, self.days, self.rows, dtype=np.int32))
+        # Répartition inégale des catégories, comme dans un vrai budget (loi en 1/rang)
+        weights = 1 / np.arange(1, len(self.categories) + 1)
+        weights /= weights.sum()
+        categories = np.array(self.categories, dtype=object)
+        income = np.isin(categories, list(INCOME_CATEGORIES))
+        titles = np.array([[f"{category} {i}" for i in range(self.titles_per_category)]
+                           for category in self.categories], dtype=object)
+        end = np.datetime64(self.end, 'D')
+
+        for index, start in enumerate(range(0, self.rows, chunk_rows)):
+            rng = np.random.default_rng([self.seed, 2, index])
+            n = min(chunk_rows, self.rows - start)
+            category = rng.choice(len(categories), n, p=weights)
+
+            # Montants au centime : dépenses négatives, revenus positifs et plus élevés
+            cents = np.rint(rng.lognormal(3.2, 1.0, n) * 100).astype(np.int64).clip(1, 99_999_999)
+            cents = np.where(income[category], cents * 20, -cents).clip(-99_999_999, 99_999_999)
+
+            title = rng.integers(0, self.titles_per_category, n)
+            yield pd.DataFrame({
+                'id': _uuids(rng, n),
+                'user_id': self.user_ids[rng.integers(0, self.users_count, n)],
+                'title': titles[category, title],
+                'amount': cents / 100,
+                'category': categories[category],
+                'created_at': end - offsets[start:start + n].astype('timedelta64[D]'),
+            })
+
+    def subscriptions(self):
+        """Table subscriptions : `subscriptions_per_user` abonnements par utilisateur"""
+        rng = np.random.default_rng([self.seed, 3])
+        n = self.users_count * self.subscriptions_per_user
+        start = np.datetime64(self.end, 'D') - np.timedelta64(self.days, 'D')
+        created_at = (start + rng.integers(0, self.days, n).astype('timedelta64[D]')).astype('datetime64[us]')
+        df = pd.DataFrame({
+            'id': _uuids(rng, n),
+            'user_id': np.repeat(self.user_ids, self.subscriptions_per_user),
+            'label': np.array(SUBSCRIPTION_LABELS, dtype=object)[rng.integers(0, len(SUBSCRIPTION_LABELS), n)],
+            'amount': np.rint(rng.uniform(2, 60, n) * 100) / 100,
+            'date': (created_at + rng.integers(0, 28, n).astype('timedelta64[D]')).astype('datetime64[D]'),
+            'recurrence': np.array(RECURRENCES, dtype=object)[rng.choice(3, n, p=[0.15, 0.75, 0.10])],
+            'rating': rng.integers(1, 6, n).astype(np.int32),
+            'image_url': None,
+            'created_at': created_at,
+        })
+        return df.sort_values('created_at', ascending=False, kind='stable', ignore_index=True)
+
+    def write_snapshot(self, path):
+        """Écrit le jeu en snapshot Parquet (un row group par bloc), relisible par --from-snapshot"""
+        writer = SnapshotWriter(path, "user=*;since=*;until=*")
+        try:
+            for chunk in self.transaction_chunks():
+                writer.write_transactions(chunk)
+            writer.write_subscriptions(self.subscriptions())
+        finally:
+            writer.close()
+        return path
+
+    def load_postgres(self, conn, schema=BENCH_SCHEMA):
+        """Charge le jeu par COPY dans `schema`, dont les tables sont vidées au préalable"""
+        with conn.cursor() as cursor:
+            cursor.execute(sql.SQL("CREATE SCHEMA IF NOT EXISTS {}").format(sql.Identifier(schema)))
+            cursor.execute(sql.SQL("SET search_path TO {}, public").format(sql.Identifier(schema)))
+            cursor.execute(SCHEMA_DDL)
+            cursor.execute("TRUNCATE users, transactions, subscriptions")
+
+            self._copy(cursor, "users", self.users())
+            for chunk in self.transaction_chunks():
+                self._copy(cursor, "transactions", chunk)
+            self._copy(cursor, "subscriptions", self.subscriptions())
+
+            cursor.execute(SCHEMA_INDEXES)
+            cursor.execute("ANALYZE users, transactions, subscriptions")
+        conn.commit()
+
+    @staticmethod
+    def _copy(cursor, table, df):
+        """COPY ... FROM STDIN d'un DataFrame, sérialisé en CSV par Arrow (NULL = champ vide non quoté)"""
+        buffer = io.BytesIO()
+        pa_csv.write_csv(pa.Table.from_pandas(df, preserve_index=False), buffer,
+                         pa_csv.WriteOptions(include_header=False))
+        buffer.seek(0)
+        columns = sql.SQL(", ").join(map(sql.Identifier, df.columns))
+        query = sql.SQL("COPY {} ({}) FROM STDIN WITH (FORMAT csv)").format(sql.Identifier(table), columns)
+        cursor.copy_expert(query.as_string(cursor), buffer)
@@ -0,0 +1,5 @@
+"""Les modules du script s'importent par leur nom (python main.py depuis script/) : même chose pour les tests"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,140 @@
+"""Doublons et montants atypiques comparés à une recherche ligne par ligne"""
+import uuid
+from decimal import Decimal
+from datetime import date, timedelta
+from collections import Counter, defaultdict
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from controls import MIN_CATEGORY_COUNT, TransactionControls, prepare
+from sketches import KLLSketch
+
+
+def make_frame(n, seed, users=2, titles=6, jours=75):
+    """Transactions par date décroissante, avec de nombreuses lignes identiques à quelques jours d'écart"""
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        'id': [str(uuid.UUID(int=int(x))) for x in rng.integers(1, 2**62, n)],
+        'user_id': [f"u{i}" for i in rng.integers(0, users, n)],
+        'title': [f"t{i}" for i in rng.integers(0, titles, n)],
+        'amount': [Decimal(int(c)) / 100 for c in rng.choice([-1999, -500, 1250, -7], n)],
+        'category': [["Alimentation", "Loisirs"][i] for i in rng.integers(0, 2, n)],
+        'created_at': [date(2024, 1, 20) + timedelta(days=int(d)) for d in rng.integers(0, jours, n)],
+    })
+    return df.sort_values('created_at', ascending=False, kind='stable').reset_index(drop=True)
+
+
+def naive_duplicates(df, tolerance):
+    """(jour, titre, centimes, écart) de chaque ligne suivant une ligne identique du même mois à ≤ tolerance jours"""
+    groupes = defaultdict(list)
+    for ligne in df.itertuples():
+        cle = (ligne.user_id, ligne.title, int(ligne.amount * 100), ligne.created_at.year, ligne.created_at.month)
+        groupes[cle].append(ligne.created_at)
+    doublons = Counter()
+    for (_, titre, cents, _, _), jours in groupes.items():
+        jours.sort()
+        for precedent, jour in zip(jours, jours[1:]):
+            if (jour - precedent).days <= tolerance:
+                doublons[(jour, titre, cents, (jour - precedent).days)] += 1
+    return doublons
+
+
+def run_controls(df, tolerance, chunk):
+    """Contrôles par mois alimentés bloc par bloc, puis fusionnés"""
+    par_mois = {}
+    for debut in range(0, len(df), chunk):
+        for periode, lignes in prepare(df.iloc[debut:debut + chunk]).items():
+            par_mois.setdefault(periode, TransactionControls(tolerance)).update(lignes)
+    return TransactionControls.merged(par_mois[periode] for periode in sorted(par_mois, reverse=True))
+
+
+def test_prepare_splits_by_month_with_days_and_cents():
+    df = make_frame(300, 0)
+    mois = prepare(df)
+    assert sorted(mois) == sorted({(jour.year, jour.month) for jour in df['created_at']})
+    for (annee, m), lignes in mois.items():
+        attendu = df[[jour.year == annee and jour.month == m for jour in df['created_at']]]
+        assert lignes['id'].tolist() == attendu['id'].tolist()
+        assert lignes['amount'].tolist() == [int(a * 100) for a in attendu['amount']]
+        assert (lignes['day'].to_numpy().astype('datetime64[D]').astype(object).tolist()
+                == attendu['created_at'].tolist())
+
+
+def test_prepare_ignores_time_of_day():
+    df = make_frame(4, 1)
+    df['created_at'] = pd.to_datetime(["2025-03-02 23:59:59", "2025-03-02 00:00:00", "2025-03-01 12:00:00", "2025-03-01 00:00:00"])
+    lignes = prepare(df)[(2025, 3)]
+    assert lignes['day'].tolist() == [20149, 20149, 20148, 20148]
+
+
+@pytest.mark.parametrize("tolerance", [0, 1, 3])
+@pytest.mark.parametrize("chunk", [7, 50, 10_000])
+def test_duplicates_match_naive_search(tolerance, chunk):
+    df = make_frame(600, 2)
+    controls = run_controls(df, tolerance, chunk)
+    attendu = naive_duplicates(df, tolerance)
+
+    assert controls.same_day == sum(n for (_, _, _, ecart), n in attendu.items() if ecart == 0)
+    assert controls.near == sum(n for (_, _, _, ecart), n in attendu.items() if ecart > 0)
+    lignes = controls.duplicate_rows()
+    jours = lignes['day'].to_numpy().astype('datetime64[D]').astype(object)
+    assert Counter(zip(jours, lignes['title'], lignes['amount'], lignes['gap'])) == attendu
+
+
+def test_identical_rows_are_not_paired_across_users_or_amounts():
+    df = make_frame(3, 3)
+    df['created_at'] = date(2025, 5, 4)
+    df['title'] = "t"
+    df['user_id'] = ["a", "b", "a"]
+    df['amount'] = [Decimal("-1.00"), Decimal("-1.00"), Decimal("-1.01")]
+    controls = run_controls(df, 5, 10)
+    assert (controls.same_day, controls.near) == (0, 0)
+    assert controls.duplicate_rows().empty
+
+
+def naive_outliers(df):
+    """Identifiants au-delà de Q3 + 3 × IQR des montants absolus de leur catégorie (quantiles inférieurs exacts)"""
+    ids = set()
+    for _, groupe in df.groupby('category'):
+        montants = sorted(abs(int(a * 100)) for a in groupe['amount'])
+        if len(montants) < MIN_CATEGORY_COUNT:
+            continue
+        q1, q3 = (montants[max(int(np.ceil(q * len(montants))) - 1, 0)] for q in (0.25, 0.75))
+        ids |= {i for i, a in zip(groupe['id'], groupe['amount']) if abs(int(a * 100)) > q3 + 3 * (q3 - q1)}
+    return ids
+
+
+def test_outliers_match_iqr_fence():
+    rng = np.random.default_rng(4)
+    df = make_frame(400, 4)
+    df['amount'] = [Decimal(int(c)) / 100 for c in rng.normal(-3000, 800, len(df)).round()]
+    extremes = df.sample(5, random_state=0).index
+    df.loc[extremes, 'amount'] = [Decimal("-900.00"), Decimal("-1200.00"), Decimal("5000.00"),
+                                  Decimal("-80.00"), Decimal("-750.50")]
+    # Catégorie trop petite : jamais contrôlée
+    df.loc[df.index[:3], 'category'] = "Rare"
+    df.loc[df.index[0], 'amount'] = Decimal("-99999.00")
+
+    controls = run_controls(df, 0, 37)
+    sketches = {}
+    for categorie, groupe in df.groupby('category'):
+        sketch = KLLSketch(k=10_000)
+        sketch.update([abs(int(a * 100)) for a in groupe['amount']])
+        sketches[categorie] = sketch
+    atypiques = controls.outliers(sketches)
+
+    assert set(atypiques['id']) == naive_outliers(df)
+    assert len(atypiques) >= 3 and "Rare" not in set(atypiques['category'])
+    # z-score décroissant, calculé sur tous les montants absolus de la catégorie
+    assert atypiques['zscore'].is_monotonic_decreasing
+    for ligne in atypiques.itertuples():
+        montants = np.abs(np.array([int(a * 100) for a in df.loc[df['category'] == ligne.category, 'amount']]))
+        assert ligne.zscore == pytest.approx((abs(ligne.amount) - montants.mean()) / montants.std())
+
+
+def test_empty_controls():
+    controls = TransactionControls.merged([])
+    assert controls.duplicate_rows().empty
+    assert controls.outliers({}).empty
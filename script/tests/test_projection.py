@@ -0,0 +1,96 @@
+"""Projection des abonnements comparée à un dépliage échéance par échéance avec le calendrier Python"""
+import calendar
+from decimal import Decimal
+from datetime import date, timedelta
+
+import numpy as np
+import pytest
+
+from projection import MONTHLY, RECURRENCES, WEEKLY, YEARLY, SubscriptionProjection, expand_charges, recurrence_codes
+
+
+def add_months(jour, n, ancre):
+    """Mois suivant au même jour que l'ancre, ramené au dernier jour des mois plus courts"""
+    mois = jour.month - 1 + n
+    annee, mois = jour.year + mois // 12, mois % 12 + 1
+    return date(annee, mois, min(ancre.day, calendar.monthrange(annee, mois)[1]))
+
+
+def naive_charges(anchors, codes, start, end):
+    charges = []
+    for i, (ancre, code) in enumerate(zip(anchors, codes)):
+        k, jour = 0, ancre
+        while code >= 0 and jour < end:
+            if jour >= start:
+                charges.append((i, jour))
+            k += 1
+            jour = ancre + timedelta(weeks=k) if code == WEEKLY else add_months(ancre, k * (12 if code == YEARLY else 1), ancre)
+    return sorted(charges)
+
+
+def random_anchors(n, seed):
+    rng = np.random.default_rng(seed)
+    jours = [date(2022, 1, 1) + timedelta(days=int(d)) for d in rng.integers(0, 1500, n)]
+    # Fins de mois et 29 février : les cas du report au dernier jour
+    return jours + [date(2024, 1, 31), date(2024, 2, 29), date(2023, 8, 31), date(2025, 3, 30)]
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_expand_charges_matches_calendar(seed):
+    anchors = random_anchors(60, seed)
+    codes = np.random.default_rng(seed).integers(-1, 3, len(anchors)).astype(np.int8)
+    start, end = date(2024, 11, 1), date(2026, 2, 1)
+
+    indices, jours = expand_charges(np.array(anchors, dtype='datetime64[D]'), codes, start, end)
+    obtenu = sorted(zip(indices.tolist(), jours.astype(object).tolist()))
+    assert obtenu == naive_charges(anchors, codes, start, end)
+
+
+def test_month_end_anchor_is_clamped():
+    indices, jours = expand_charges(np.array(["2024-01-31"], dtype='datetime64[D]'),
+                                    np.array([MONTHLY], dtype=np.int8), date(2024, 1, 1), date(2024, 5, 1))
+    assert jours.astype(str).tolist() == ["2024-01-31", "2024-02-29", "2024-03-31", "2024-04-30"]
+    assert indices.tolist() == [0, 0, 0, 0]
+
+
+def test_recurrence_codes_aliases_and_unknown():
+    codes = recurrence_codes(["monthly", " Mensuel ", "HEBDO", "annuel", "tous les jours", ""])
+    assert codes.tolist() == [MONTHLY, MONTHLY, WEEKLY, YEARLY, -1, -1]
+    assert recurrence_codes([]).tolist() == []
+
+
+def test_projection_totals_match_naive_sums(monkeypatch):
+    # Blocs réduits : les sommes doivent être les mêmes d'un bloc à l'autre
+    monkeypatch.setattr("projection.BLOCK_SIZE", 7)
+    anchors = random_anchors(40, 3)
+    rng = np.random.default_rng(3)
+    recurrences = [["weekly", "monthly", "yearly", "inconnue"][i] for i in rng.integers(0, 4, len(anchors))]
+    cents = rng.integers(100, 5000, len(anchors))
+    users = [f"u{i}" for i in rng.integers(0, 3, len(anchors))]
+    projection = SubscriptionProjection(np.array(anchors, dtype='datetime64[D]'), recurrences, cents, users,
+                                        date(2025, 1, 15), months=14)
+
+    codes = recurrence_codes(recurrences)
+    debut = date(2025, 1, 1)
+    fin = add_months(debut, 14, debut)
+    par_recurrence = np.zeros((len(RECURRENCES), 14), dtype=np.int64)
+    par_utilisateur = {}
+    for i, jour in naive_charges(anchors, codes, debut, fin):
+        mois = (jour.year - debut.year) * 12 + jour.month - debut.month
+        par_recurrence[codes[i], mois] += cents[i]
+        par_utilisateur[users[i]] = par_utilisateur.get(users[i], 0) + int(cents[i])
+
+    assert np.array_equal(projection.by_recurrence, par_recurrence)
+    assert dict(zip(projection.user_ids.tolist(), projection.by_user.tolist())) == \
+        {u: par_utilisateur.get(u, 0) for u in sorted(set(users))}
+    assert projection.monthly_totals().tolist() == par_recurrence.sum(axis=0).tolist()
+    assert projection.monthly_average() == par_recurrence.sum() / 14
+    assert projection.unknown == recurrences.count("inconnue")
+
+
+def test_from_records_rounds_decimal_amounts():
+    subscriptions = [{'date': date(2025, 1, 10), 'amount': Decimal("9.99"), 'recurrence': "monthly", 'user_id': "u"},
+                     {'date': date(2025, 1, 3), 'amount': Decimal("0.29"), 'recurrence': "weekly", 'user_id': "v"}]
+    projection = SubscriptionProjection.from_records(subscriptions, date(2025, 1, 1), months=1)
+    assert projection.by_recurrence[MONTHLY].tolist() == [999]
+    assert projection.by_recurrence[WEEKLY].tolist() == [5 * 29]
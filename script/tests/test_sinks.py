@@ -0,0 +1,75 @@
+"""Encodage des lignes CSV et JSON lines, et destinations, comparés à un formatage ligne par ligne"""
+import io
+import csv
+import json
+import uuid
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from sinks import CallbackSink, FileSink, MemorySink, StreamSink, _decimal_amounts, transactions_csv, transactions_jsonl
+from store import TransactionStore
+
+CENTS = [0, 1, -1, 29, -113, 99, -100, 9_999_999_999, -9_999_999_999, 2**40 + 7, -(2**40) - 7]
+
+
+def make_store(cents):
+    """Stockage de transactions aux montants donnés (titres avec virgule et guillemets) et ses UUID"""
+    n = len(cents)
+    ids = [uuid.UUID(int=i * 7919 + 1) for i in range(n)]
+    octets = np.frombuffer(b"".join(i.bytes for i in ids), dtype='S16') if n else np.empty(0, dtype='S16')
+    return TransactionStore(pd.Categorical([f"titre {i % 3}, \"cité\"" for i in range(n)]),
+                            pd.Categorical(["Alimentation", "Café"][i % 2] for i in range(n)),
+                            np.array(cents, dtype=np.int64),
+                            np.datetime64("2025-01-01") + np.arange(n).astype('timedelta64[D]'), octets), ids
+
+
+def test_decimal_amounts_are_exact():
+    montants = _decimal_amounts(np.array(CENTS, dtype=np.int64))
+    assert montants.to_pylist() == [Decimal(c).scaleb(-2) for c in CENTS]
+
+
+def test_transactions_csv_matches_naive_rows():
+    store, ids = make_store(CENTS)
+    lignes = list(csv.reader(io.StringIO(transactions_csv(store, header=True).decode())))
+    assert lignes[0] == ["date", "title", "category", "amount", "id"]
+    attendu = [[str(jour), titre, categorie, str(Decimal(c).scaleb(-2)), str(i)]
+               for jour, titre, categorie, c, i in zip(store.dates.astype(object), store.titles,
+                                                      store.categories, CENTS, ids)]
+    assert lignes[1:] == attendu
+
+
+def test_transactions_jsonl_matches_naive_records():
+    store, ids = make_store(CENTS[:6])
+    records = [json.loads(line) for line in transactions_jsonl(store).decode().splitlines()]
+    assert records == [{'type': "transaction", 'date': str(jour), 'title': titre, 'category': categorie,
+                        'amount': c / 100, 'id': str(i)}
+                       for jour, titre, categorie, c, i in zip(store.dates.astype(object), store.titles,
+                                                              store.categories, CENTS, ids)]
+    assert transactions_jsonl(make_store([])[0]) == b""
+
+
+def test_memory_stream_and_callback_sinks_deliver_the_same_bytes():
+    recus = []
+    flux = io.BytesIO()
+    sinks = [MemorySink("csv"), StreamSink(flux, "csv"), CallbackSink(recus.append, "csv")]
+    for sink in sinks:
+        sink.write(b"a,b\n")
+        sink.write(b"1,2\n")
+        sink.close()
+    assert sinks[0].content == flux.getvalue() == recus[0] == b"a,b\n1,2\n"
+    assert [sink.bytes_written for sink in sinks] == [8, 8, 8]
+
+
+def test_file_sink_writes_an_empty_file_for_empty_csv(tmp_path):
+    sink = FileSink(str(tmp_path / "vide.csv"), "csv")
+    sink.close()
+    assert (tmp_path / "vide.csv").read_bytes() == b""
+    assert sink.bytes_written == 0
+
+
+def test_unknown_format_is_rejected():
+    with pytest.raises(ValueError):
+        MemorySink("parquet")
@@ -0,0 +1,151 @@
+"""Sketches KLL et Misra-Gries comparés aux quantiles et comptes exacts"""
+import math
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from sketches import HeavyHitters, KLLSketch, TransactionSketch
+from store import TransactionStore
+
+QS = [0.01, 0.25, 0.5, 0.75, 0.9, 0.99]
+
+
+def naive_quantiles(values, qs):
+    """Quantile inférieur : plus petite valeur dont le rang atteint q × n"""
+    ordre = sorted(values)
+    return [ordre[max(math.ceil(q * len(ordre)) - 1, 0)] for q in qs]
+
+
+def rank_error(values, estimate, q):
+    """Écart entre le rang (normalisé) de l'estimation et q"""
+    values = np.sort(values)
+    bas = np.searchsorted(values, estimate, side='left') / len(values)
+    haut = np.searchsorted(values, estimate, side='right') / len(values)
+    return 0.0 if bas <= q <= haut else min(abs(q - bas), abs(q - haut))
+
+
+def test_kll_is_exact_below_capacity():
+    values = np.random.default_rng(0).integers(0, 1000, 150)
+    sketch = KLLSketch(k=200)
+    sketch.update(values[:70])
+    sketch.update(values[70:])
+    assert sketch.quantiles(QS) == naive_quantiles(values.tolist(), QS)
+    assert (sketch.count, sketch.min, sketch.max) == (150, values.min(), values.max())
+
+
+def test_empty_kll_has_no_quantiles():
+    assert KLLSketch().quantiles([0.5, 0.9]) == [None, None]
+
+
+@pytest.mark.parametrize("chunk", [1_000, 7_919, 100_000])
+def test_kll_rank_error_is_bounded(chunk):
+    values = np.random.default_rng(1).lognormal(3, 1, 100_000)
+    sketch = KLLSketch(k=200)
+    for debut in range(0, len(values), chunk):
+        sketch.update(values[debut:debut + chunk])
+    assert sketch.count == len(values)
+    # Mémoire bornée : quelques multiples de k, quel que soit le nombre de valeurs
+    assert sketch.size < 3 * 200 + 20 * len(sketch.levels)
+    for q, estimate in zip(QS, sketch.quantiles(QS)):
+        assert rank_error(values, estimate, q) < 0.02
+
+
+def test_merged_kll_matches_union():
+    rng = np.random.default_rng(2)
+    parts = [rng.normal(loc, 10, size) for loc, size in [(0, 30_000), (50, 5_000), (-20, 60_000)]]
+    sketches = []
+    for part in parts:
+        sketch = KLLSketch()
+        sketch.update(part)
+        sketches.append(sketch)
+    merged = KLLSketch()
+    for sketch in sketches:
+        merged.merge(sketch)
+
+    union = np.concatenate(parts)
+    assert merged.count == len(union)
+    assert (merged.min, merged.max) == (union.min(), union.max())
+    for q, estimate in zip(QS, merged.quantiles(QS)):
+        assert rank_error(union, estimate, q) < 0.02
+    # Les sketches fusionnés ne sont pas modifiés
+    assert [sketch.count for sketch in sketches] == [len(part) for part in parts]
+
+
+def test_same_chunking_gives_same_quantiles():
+    values = np.random.default_rng(3).normal(0, 1, 50_000)
+    resultats = []
+    for _ in range(2):
+        sketch = KLLSketch()
+        for debut in range(0, len(values), 5_000):
+            sketch.update(values[debut:debut + 5_000])
+        resultats.append(sketch.quantiles(QS))
+    assert resultats[0] == resultats[1]
+
+
+def test_heavy_hitters_are_exact_below_capacity():
+    values = [f"t{i % 37}" for i in range(1000)]
+    hitters = HeavyHitters(capacity=50)
+    hitters.update(pd.Categorical(values[:400]))
+    hitters.update(pd.Categorical(values[400:]))
+    assert hitters.error == 0
+    assert hitters.counts == Counter(values)
+    assert [compte for _, compte in hitters.top(3)] == [28, 27, 27]
+
+
+@pytest.mark.parametrize("capacity", [5, 20])
+def test_heavy_hitters_error_bound(capacity):
+    rng = np.random.default_rng(4)
+    # Zipf : quelques titres très fréquents, une longue traîne de titres rares
+    values = [f"t{x}" for x in rng.zipf(1.5, 20_000) % 500]
+    hitters = HeavyHitters(capacity=capacity)
+    for debut in range(0, len(values), 3_000):
+        hitters.update(pd.Categorical(values[debut:debut + 3_000]))
+
+    exacts = Counter(values)
+    assert hitters.total == len(values)
+    assert len(hitters.counts) <= capacity
+    assert hitters.error <= len(values) / (capacity + 1)
+    for valeur, compte in hitters.counts.items():
+        assert exacts[valeur] - hitters.error <= compte <= exacts[valeur]
+    # Toute valeur plus fréquente que l'erreur est retenue
+    for valeur, compte in exacts.items():
+        if compte > hitters.error:
+            assert valeur in hitters.counts
+
+
+def test_merged_heavy_hitters_keep_the_bound():
+    rng = np.random.default_rng(5)
+    parts = [[f"t{x}" for x in rng.zipf(1.3, 5_000) % 300] for _ in range(4)]
+    merged = HeavyHitters(capacity=10)
+    for part in parts:
+        hitters = HeavyHitters(capacity=10)
+        hitters.update(pd.Categorical(part))
+        merged.merge(hitters)
+
+    exacts = Counter(v for part in parts for v in part)
+    assert merged.total == sum(exacts.values())
+    for valeur, compte in merged.counts.items():
+        assert exacts[valeur] - merged.error <= compte <= exacts[valeur]
+
+
+def test_transaction_sketch_splits_amounts_by_category():
+    rng = np.random.default_rng(6)
+    n = 500
+    categories = [["Alimentation", "Loisirs", "Transport"][i] for i in rng.integers(0, 3, n)]
+    cents = rng.integers(-20_000, 20_000, n)
+    titles = [f"t{i % 11}" for i in range(n)]
+    store = TransactionStore(pd.Categorical(titles), pd.Categorical(categories), cents,
+                             np.full(n, np.datetime64("2025-01-01")), np.zeros(n, dtype='S16'))
+    sketch = TransactionSketch()
+    sketch.update(store.take(np.arange(200)))
+    sketch.update(store.take(np.arange(200, n)))
+
+    for categorie in set(categories):
+        montants = [abs(int(c)) for c, cat in zip(cents, categories) if cat == categorie]
+        assert sketch.categories[categorie].count == len(montants)
+        assert sketch.categories[categorie].quantiles([0.5]) == naive_quantiles(montants, [0.5])
+    assert sketch.depenses.count == int((cents < 0).sum())
+    assert sketch.revenus.count == int((cents > 0).sum())
+    assert sketch.titles.counts == Counter(titles)
@@ -0,0 +1,108 @@
+"""TransactionStore comparé à un calcul ligne par ligne en Decimal"""
+import uuid
+from decimal import Decimal
+from datetime import date, timedelta
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+
+from store import TransactionStore, uuid_strings
+
+
+def make_frame(n, seed=0, titles=("Courses", "Loyer", "Café"), categories=("Alimentation", "Logement")):
+    """Lignes au format de la requête des transactions (montants Decimal, UUID, dates)"""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'id': [uuid.UUID(int=int(x)) for x in rng.integers(1, 2**62, n)],
+        'user_id': ["u"] * n,
+        'title': [titles[i] for i in rng.integers(0, len(titles), n)],
+        'amount': [Decimal(int(c)) / 100 for c in rng.integers(-50_000, 50_000, n)],
+        'category': [categories[i] for i in rng.integers(0, len(categories), n)],
+        'created_at': [date(2024, 1, 1) + timedelta(days=int(d)) for d in rng.integers(0, 120, n)],
+    })
+
+
+def naive_totals(df):
+    categories = defaultdict(int)
+    for categorie, montant in zip(df['category'], df['amount']):
+        categories[categorie] += abs(int(montant * 100))
+    cents = [int(montant * 100) for montant in df['amount']]
+    return {
+        'count': len(df),
+        'categories': dict(categories),
+        'depenses': -sum(c for c in cents if c < 0),
+        'revenus': sum(c for c in cents if c > 0),
+        'nb_depenses': sum(1 for c in cents if c < 0),
+        'nb_revenus': sum(1 for c in cents if c > 0),
+    }
+
+
+def test_from_frame_keeps_exact_cents_dates_and_ids():
+    df = make_frame(500)
+    # Valeurs dont le produit par 100 n'est pas entier en float64
+    df.loc[:2, 'amount'] = [Decimal("0.29"), Decimal("-1.13"), Decimal("99999999.99")]
+    store = TransactionStore.from_frame(df)
+
+    assert store.amounts.tolist() == [int(montant * 100) for montant in df['amount']]
+    assert store.dates.tolist() == df['created_at'].tolist()
+    assert store.id_strings().tolist() == [str(i) for i in df['id']]
+    assert list(store.titles) == df['title'].tolist()
+    assert list(store.categories) == df['category'].tolist()
+
+
+def test_from_frame_accepts_float_amounts_and_text_ids():
+    df = make_frame(200, seed=1)
+    copie = df.assign(amount=df['amount'].astype(float), id=df['id'].astype(str))
+    attendu = TransactionStore.from_frame(df)
+    store = TransactionStore.from_frame(copie)
+    assert np.array_equal(store.amounts, attendu.amounts)
+    assert np.array_equal(store.ids, attendu.ids)
+
+
+def test_uuid_strings_matches_uuid_formatting():
+    ids = [uuid.UUID(int=0), uuid.UUID(int=2**128 - 1), uuid.uuid4()]
+    octets = np.frombuffer(b"".join(i.bytes for i in ids), dtype='S16')
+    assert uuid_strings(octets).tolist() == [str(i) for i in ids]
+
+
+def test_concat_merges_dictionaries():
+    premier = make_frame(50, seed=2, titles=("A", "B"), categories=("X",))
+    second = make_frame(70, seed=3, titles=("B", "C"), categories=("Y", "X"))
+    store = TransactionStore.concat([TransactionStore.from_frame(premier), TransactionStore.from_frame(second)])
+    tout = pd.concat([premier, second], ignore_index=True)
+
+    assert len(store) == 120
+    assert list(store.titles) == tout['title'].tolist()
+    assert list(store.categories) == tout['category'].tolist()
+    assert store.id_strings().tolist() == [str(i) for i in tout['id']]
+    assert store.totals() == naive_totals(tout)
+
+
+def test_totals_match_naive_sums():
+    df = make_frame(1000, seed=4)
+    totaux = TransactionStore.from_frame(df).totals()
+    assert totaux == naive_totals(df)
+    # Catégories dans l'ordre de première apparition
+    assert list(totaux['categories']) == list(dict.fromkeys(df['category']))
+
+
+def test_split_by_month_keeps_row_order():
+    df = make_frame(800, seed=5)
+    mois = TransactionStore.from_frame(df).split_by_month()
+    attendu = defaultdict(list)
+    for i, jour in enumerate(df['created_at']):
+        attendu[(jour.year, jour.month)].append(i)
+
+    assert list(mois) == list(attendu)
+    for periode, indices in attendu.items():
+        assert mois[periode].amounts.tolist() == [int(df['amount'][i] * 100) for i in indices]
+        assert mois[periode].dates.tolist() == [df['created_at'][i] for i in indices]
+
+
+def test_take_shares_dictionaries():
+    store = TransactionStore.from_frame(make_frame(100, seed=6))
+    extrait = store.take(np.array([5, 1, 9]))
+    assert extrait.titles.categories.equals(store.titles.categories)
+    assert list(extrait.titles) == [store.titles[i] for i in (5, 1, 9)]
+    assert extrait.amounts.tolist() == store.amounts[[5, 1, 9]].tolist()
@@ -0,0 +1,101 @@
+"""Séries temporelles comparées à des boucles jour par jour"""
+from datetime import date, timedelta
+from collections import defaultdict
+
+import numpy as np
+import pytest
+
+from timeseries import TimeSeries, daily_totals, month_days, month_over_month, rolling_sum
+
+
+def random_rows(n, seed, debut=date(2024, 1, 10), jours=200):
+    rng = np.random.default_rng(seed)
+    dates = [debut + timedelta(days=int(d)) for d in rng.integers(0, jours, n)]
+    cents = rng.integers(-10_000, 10_000, n)
+    return dates, cents
+
+
+def naive_daily(dates, cents):
+    totaux = defaultdict(lambda: [0, 0])
+    for jour, c in zip(dates, cents):
+        totaux[jour][0 if c < 0 else 1] += abs(int(c))
+    return totaux
+
+
+def to_month_totals(dates, cents):
+    cents = np.asarray(cents)
+    return daily_totals(np.array(dates, dtype='datetime64[D]'), np.where(cents < 0, -cents, 0), np.where(cents > 0, cents, 0))
+
+
+def test_month_days_handles_leap_years():
+    assert month_days((2024, 2)) == (np.datetime64("2024-02-01"), 29)
+    assert month_days((2023, 2))[1] == 28
+    assert month_days((2024, 12)) == (np.datetime64("2024-12-01"), 31)
+
+
+def test_daily_totals_match_naive_sums():
+    dates, cents = random_rows(3000, 0)
+    par_mois = to_month_totals(dates, cents)
+    attendu = naive_daily(dates, cents)
+
+    assert sorted(par_mois) == sorted({(jour.year, jour.month) for jour in dates})
+    for (annee, mois), totaux in par_mois.items():
+        assert totaux.shape == (month_days((annee, mois))[1], 2)
+        for i, (depenses, revenus) in enumerate(totaux.tolist()):
+            assert [depenses, revenus] == attendu.get(date(annee, mois, 1) + timedelta(days=i), [0, 0])
+    assert daily_totals(np.array([], dtype='datetime64[D]'), [], []) == {}
+
+
+@pytest.mark.parametrize("window", [1, 3, 7, 30, 500])
+def test_rolling_sum_matches_naive_window(window):
+    values = np.random.default_rng(1).integers(0, 1000, 120)
+    attendu = [int(values[max(0, i - window + 1):i + 1].sum()) for i in range(len(values))]
+    assert rolling_sum(values, window).tolist() == attendu
+
+
+def test_time_series_is_dense_and_trimmed():
+    dates, cents = random_rows(500, 2, debut=date(2024, 3, 5), jours=90)
+    serie = TimeSeries(to_month_totals(dates, cents))
+    attendu = naive_daily(dates, cents)
+
+    premier, dernier = min(dates), max(dates)
+    assert len(serie) == (dernier - premier).days + 1
+    assert serie.days[0] == np.datetime64(premier) and serie.days[-1] == np.datetime64(dernier)
+    balance = 0
+    for i in range(len(serie)):
+        depenses, revenus = attendu.get(premier + timedelta(days=i), [0, 0])
+        balance += revenus - depenses
+        assert (serie.depenses[i], serie.revenus[i], serie.balance[i]) == (depenses, revenus, balance)
+    assert serie.rolling[7].tolist() == rolling_sum(serie.depenses, 7).tolist()
+
+
+def test_weekly_groups_monday_to_sunday():
+    dates, cents = random_rows(800, 3, debut=date(2024, 1, 3), jours=60)
+    serie = TimeSeries(to_month_totals(dates, cents))
+    lundis, depenses, revenus, balance = serie.weekly()
+
+    semaines = defaultdict(lambda: [0, 0])
+    for jour, c in zip(dates, cents):
+        semaines[jour - timedelta(days=jour.weekday())][0 if c < 0 else 1] += abs(int(c))
+    attendu = sorted(semaines)
+    assert lundis.astype(object).tolist() == attendu
+    assert all(lundi.weekday() == 0 for lundi in attendu)
+    assert depenses.tolist() == [semaines[lundi][0] for lundi in attendu]
+    assert revenus.tolist() == [semaines[lundi][1] for lundi in attendu]
+    # Balance en fin de semaine (ou au dernier jour de la série)
+    cumul = np.cumsum(revenus - depenses)
+    assert balance.tolist() == cumul.tolist()
+
+
+def test_month_over_month_fills_missing_months():
+    stats = {
+        (2024, 11): {'categories': {'Loisirs': 10.0, 'Transport': 5.0}},
+        (2025, 1): {'categories': {'Loisirs': 4.5}},
+        (2025, 2): {'categories': {'Transport': 20.0, 'Loisirs': 4.5}},
+    }
+    variations = month_over_month(stats)
+    assert list(variations.index) == [(2024, 11), (2024, 12), (2025, 1), (2025, 2)]
+    # Catégories par total décroissant
+    assert list(variations.columns) == ['Transport', 'Loisirs']
+    assert variations.iloc[0].isna().all()
+    assert variations.iloc[1:].to_dict('list') == {'Transport': [-5.0, 0.0, 20.0], 'Loisirs': [-10.0, 4.5, 0.0]}
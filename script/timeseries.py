@@ -0,0 +1,108 @@
+"""Séries temporelles des transactions : calendrier quotidien dense, semaines et fenêtres glissantes.
+
+Pendant la lecture, les montants de chaque mois sont sommés par jour (centimes, np.bincount) ;
+seuls ces totaux sont gardés, quelques centaines d'octets par mois quel que soit le nombre de
+lignes. Au rendu, les mois sont placés sur un index calendaire continu (jours sans transaction
+à zéro) : dépenses glissantes, balance cumulée et totaux hebdomadaires s'obtiennent par sommes
+cumulées sur ce tableau, sans boucle sur les jours ni sur les lignes.
+"""
+import numpy as np
+
+ROLLING_WINDOWS = (7, 30)
+
+
+def month_days(periode):
+    """Premier jour (datetime64[D]) et nombre de jours d'un mois (année, mois)"""
+    annee, mois = periode
+    debut = np.datetime64(f"{annee:04d}-{mois:02d}", 'M')
+    premier = debut.astype('datetime64[D]')
+    return premier, int(((debut + 1).astype('datetime64[D]') - premier).astype(np.int64))
+
+
+def daily_totals(dates, depenses, revenus):
+    """Dépenses et revenus de chaque jour (centimes), par mois : {(année, mois): tableau (jours, 2)}
+
+    `dates` est en datetime64[D] ; `depenses` et `revenus` sont des centimes positifs, ligne par
+    ligne ou déjà sommés par jour.
+    """
+    if not len(dates):
+        return {}
+    mois = dates.astype('datetime64[M]')
+    premier = mois.min().astype('datetime64[D]')
+    jours = (dates - premier).astype(np.int64)
+    nb_jours = int(((mois.max() + 1).astype('datetime64[D]') - premier).astype(np.int64))
+
+    # Les sommes restent des entiers sous 2**53 : le float64 de bincount est exact
+    totaux = np.stack([np.bincount(jours, weights=depenses, minlength=nb_jours),
+                       np.bincount(jours, weights=revenus, minlength=nb_jours)], axis=1).astype(np.int64)
+    resultat = {}
+    for m in np.unique(mois).astype(np.int64).tolist():
+        periode = (1970 + m // 12, m % 12 + 1)
+        debut, longueur = month_days(periode)
+        decalage = int((debut - premier).astype(np.int64))
+        resultat[periode] = totaux[decalage:decalage + longueur]
+    return resultat
+
+
+def rolling_sum(values, window):
+    """Somme glissante sur `window` jours, fenêtre tronquée en début de série"""
+    cumul = np.cumsum(values)
+    resultat = cumul.copy()
+    resultat[window:] -= cumul[:-window]
+    return resultat
+
+
+class TimeSeries:
+    """Série quotidienne continue du premier au dernier jour actif, à partir des totaux journaliers par mois"""
+
+    def __init__(self, totals_by_month, windows=ROLLING_WINDOWS):
+        periodes = sorted(totals_by_month)
+        premier, _ = month_days(periodes[0])
+        dernier, longueur = month_days(periodes[-1])
+        totaux = np.zeros((int((dernier - premier).astype(np.int64)) + longueur, 2), dtype=np.int64)
+        for periode in periodes:
+            debut, longueur = month_days(periode)
+            decalage = int((debut - premier).astype(np.int64))
+            totaux[decalage:decalage + longueur] = totals_by_month[periode]
+
+        # Les jours sans activité avant la première et après la dernière transaction sont retirés
+        actifs = np.flatnonzero(totaux.any(axis=1))
+        debut, fin = (actifs[0], actifs[-1] + 1) if len(actifs) else (0, len(totaux))
+        self.days = premier + np.arange(debut, fin)
+        self.depenses = totaux[debut:fin, 0]
+        self.revenus = totaux[debut:fin, 1]
+        self.balance = np.cumsum(self.revenus - self.depenses)
+        self.rolling = {window: rolling_sum(self.depenses, window) for window in windows}
+
+    def __len__(self):
+        return len(self.days)
+
+    def weekly(self):
+        """Semaines du lundi au dimanche : (lundis, dépenses, revenus, balance cumulée en fin de semaine)"""
+        # Le 1er janvier 1970 est un jeudi : décalés de 3 jours, les lundis tombent sur des multiples de 7
+        semaines = (self.days.astype(np.int64) + 3) // 7
+        semaines -= semaines[0]
+        depenses = np.bincount(semaines, weights=self.depenses).astype(np.int64)
+        revenus = np.bincount(semaines, weights=self.revenus).astype(np.int64)
+
+        lundis = self.days[0] - (self.days[0].astype(np.int64) + 3) % 7 + 7 * np.arange(len(depenses))
+        # Dernier jour de chaque semaine dans la série (la dernière peut être incomplète)
+        fins = np.append(np.flatnonzero(np.diff(semaines)), len(semaines) - 1)
+        return lundis, depenses, revenus, self.balance[fins]
+
+
+def month_over_month(monthly_stats):
+    """Variation de chaque catégorie d'un mois sur l'autre (euros), mois en lignes et catégories en colonnes
+
+    Les mois sans transaction comptent pour zéro ; les catégories sont rangées par total
+    décroissant et la première ligne (aucun mois précédent) est vide.
+    """
+    import pandas as pd
+
+    # Mois comptés depuis l'an 0 : l'index calendaire continu est un simple intervalle d'entiers
+    totaux = pd.DataFrame.from_dict({annee * 12 + mois - 1: dict(stats['categories'])
+                                     for (annee, mois), stats in monthly_stats.items()}, orient='index')
+    totaux = totaux.reindex(range(totaux.index.min(), totaux.index.max() + 1)).fillna(0.0)
+    totaux = totaux[totaux.sum().sort_values(ascending=False, kind='stable').index]
+    totaux.index = [(m // 12, m % 12 + 1) for m in totaux.index]
+    return totaux.diff().round(2)